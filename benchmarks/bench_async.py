@@ -0,0 +1,162 @@
+"""
+Concurrency against memory of the threaded Flask app and the asyncio app.
+
+    python -m benchmarks.bench_async --concurrency 10 100 1000
+
+Every run holds `concurrency` clients in flight against the room history
+endpoint, as threads for cas.app and as tasks for cas.async_app, and
+reports throughput, tail latency and how much the resident set grew. Runs
+happen in fresh interpreters so the peak RSS of one does not hide another.
+DATABASE_URL defaults to a temporary SQLite file, it is dropped and
+recreated, never point it at one holding real data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.common import percentile
+
+PATH = '/history/room/1?limit=20'
+
+
+def seed(messages: int):
+    from cas.database import (
+        Conversation,
+        ConversationUser,
+        Session,
+        User,
+        insert_room_messages,
+        recreate_database,
+    )
+    from cas.migrations import bootstrap_schema
+    from cas.utils import encode_security_token
+
+    recreate_database()
+    bootstrap_schema()
+    with Session.begin() as session:
+        user = User(nick_name='bench', email='bench@gmail.com',
+                    password='secret', key_word='bench-key-word')
+        session.add_all([user, Conversation(conversation_name='bench')])
+        session.flush()
+        session.add(ConversationUser(user_id=user.id, conversation_id=1))
+        insert_room_messages(session, 1, [
+            {'msg': f'seed {n}', 'created_at': datetime.now(),
+             'sender_id': user.id} for n in range(messages)])
+        return {'user_id': str(user.id),
+                'authorization': encode_security_token(
+                    user.id, user.nick_name, user.key_word)}
+
+
+def max_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_threads(headers, concurrency, requests):
+    from cas.app import app
+
+    latencies = []
+    errors = []
+
+    def drive():
+        with app.test_client() as http:
+            for _ in range(requests):
+                start = time.perf_counter()
+                data = http.get(PATH, headers=headers).get_json()
+                latencies.append(time.perf_counter() - start)
+                if data['status_code'] != 200:
+                    errors.append(data)
+
+    rss = max_rss_kb()
+    threads = [threading.Thread(target=drive) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors), time.perf_counter() - start, rss
+
+
+def run_tasks(headers, concurrency, requests):
+    from cas.async_app import app
+
+    latencies = []
+    errors = []
+
+    async def drive(http):
+        for _ in range(requests):
+            start = time.perf_counter()
+            data = await (await http.get(PATH, headers=headers)).get_json()
+            latencies.append(time.perf_counter() - start)
+            if data['status_code'] != 200:
+                errors.append(data)
+
+    async def main():
+        async with app.test_app() as test_app:
+            http = test_app.test_client()
+            rss = max_rss_kb()
+            start = time.perf_counter()
+            await asyncio.gather(*(drive(http) for _ in range(concurrency)))
+            return time.perf_counter() - start, rss
+
+    wall, rss = asyncio.run(main())
+    return latencies, len(errors), wall, rss
+
+
+def child(args):
+    headers = json.loads(os.environ['BENCH_HEADERS'])
+    run = run_threads if args.mode == 'threads' else run_tasks
+    latencies, errors, wall, rss = run(headers, args.child,
+                                       args.requests)
+    print(json.dumps({
+        'mode': args.mode,
+        'concurrency': args.child,
+        'errors': errors,
+        'rps': len(latencies) / wall,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'rss_growth_mb': (max_rss_kb() - rss) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--requests', type=int, default=5,
+                        help='requests per client')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--mode', choices=('threads', 'tasks'))
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    os.environ['AUTH_MODE'] = 'expiring'
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'cas_bench_async.db')
+    os.environ['BENCH_HEADERS'] = json.dumps(seed(args.messages))
+    print(f'{"mode":<8} {"clients":>8} {"err":>5} {"rps":>8} '
+          f'{"p99 ms":>9} {"rss +MB":>8}')
+    for concurrency in args.concurrency:
+        for mode in ('threads', 'tasks'):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_async',
+                 '--mode', mode, '--child', str(concurrency),
+                 '--requests', str(args.requests)],
+                capture_output=True, text=True, check=True).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f'{r["mode"]:<8} {r["concurrency"]:>8} {r["errors"]:>5} '
+                  f'{r["rps"]:>8.0f} {r["p99_ms"]:>9.1f} '
+                  f'{r["rss_growth_mb"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
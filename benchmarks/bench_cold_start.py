@@ -0,0 +1,48 @@
+"""
+Worker cold start, the time it takes to import the app in a fresh
+interpreter against an existing database.
+
+    DATABASE_URL=sqlite:////tmp/cas_bench.db python -m benchmarks.bench_cold_start
+
+The first start bootstraps the schema, the following ones should only pay
+for the schema version check.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_APP = 'import cas.app'
+
+
+def cold_start(env) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', IMPORT_APP], env=env, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--starts', type=int, default=10)
+    args = parser.parse_args()
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:////tmp/cas_bench.db')
+    baseline = []
+    for _ in range(args.starts):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import flask, sqlalchemy'],
+                       env=env, check=True)
+        baseline.append(time.perf_counter() - start)
+    first = cold_start(env)
+    warm = [cold_start(env) for _ in range(args.starts)]
+    print(f'interpreter + flask/sqlalchemy import: '
+          f'{statistics.median(baseline) * 1000:.0f} ms')
+    print(f'first start: {first * 1000:.0f} ms')
+    print(f'later starts: median {statistics.median(warm) * 1000:.0f} ms, '
+          f'max {max(warm) * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
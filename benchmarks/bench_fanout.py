@@ -0,0 +1,73 @@
+"""
+Fan-out latency of the room hub as the number of subscribers grows.
+
+    python -m benchmarks.bench_fanout --subscribers 1 10 100 1000 --rounds 200
+
+For every publish the latency until the first, median and last subscriber
+received the event is recorded.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.common import percentile
+from cas.pubsub import RoomHub
+
+
+async def consume(subscription, received, expected):
+    for _ in range(expected):
+        await subscription.queue.get()
+        received.append(time.perf_counter())
+
+
+def run(subscribers: int, rounds: int):
+    hub = RoomHub(queue_size=rounds + 1)
+    room_id = 1
+    received = [[] for _ in range(subscribers)]
+    tasks = []
+    for i in range(subscribers):
+        sub = hub.subscribe(room_id)
+        tasks.append(asyncio.run_coroutine_threadsafe(
+            consume(sub, received[i], rounds), hub.loop))
+    sent = []
+    for _ in range(rounds):
+        sent.append(time.perf_counter())
+        hub.publish(room_id, {'Message': 'x'})
+        # Let every subscriber drain before the next publish.
+        while any(len(r) < len(sent) for r in received):
+            time.sleep(0)
+    for task in tasks:
+        task.result()
+    first, median, last = [], [], []
+    for n, start in enumerate(sent):
+        delays = sorted(r[n] - start for r in received)
+        first.append(delays[0])
+        median.append(delays[len(delays) // 2])
+        last.append(delays[-1])
+    return {
+        'subscribers': subscribers,
+        'first_ms': statistics.median(first) * 1000,
+        'median_ms': statistics.median(median) * 1000,
+        'last_ms': statistics.median(last) * 1000,
+        'last_p99_ms': percentile(last, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--subscribers', type=int, nargs='+',
+                        default=[1, 10, 100, 1000, 5000])
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+    print(f'{"subscribers":>11} {"first ms":>9} {"median ms":>10} '
+          f'{"last ms":>9} {"last p99 ms":>12}')
+    for n in args.subscribers:
+        r = run(n, args.rounds)
+        print(f'{r["subscribers"]:>11} {r["first_ms"]:>9.3f} '
+              f'{r["median_ms"]:>10.3f} {r["last_ms"]:>9.3f} '
+              f'{r["last_p99_ms"]:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
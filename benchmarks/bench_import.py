@@ -0,0 +1,104 @@
+"""
+Rows per second of the bulk importer at several batch sizes, against
+storing the same messages one transaction each like send_msg does.
+
+    python -m benchmarks.bench_import --url sqlite:////tmp/cas_bench.db \
+        --messages 200000 --batch-rows 1000 5000 20000
+
+The generated export has `rooms` rooms with `users` members each and
+spreads the messages over them.
+"""
+import argparse
+import json
+import time
+from datetime import (
+    datetime,
+    timedelta,
+)
+
+from sqlalchemy.orm import sessionmaker
+
+from cas.database import (
+    Base,
+    Conversation,
+    User,
+    add_room_member,
+    create_database_engine,
+    insert_room_messages,
+)
+from cas.importer import Importer
+
+
+def export_lines(messages: int, users: int, rooms: int):
+    for n in range(users):
+        yield json.dumps({'type': 'user', 'id': n, 'nick_name': f'user{n}',
+                          'email': f'user{n}@bench.io'})
+    for room in range(rooms):
+        yield json.dumps({'type': 'room', 'id': room, 'name': f'room{room}'})
+        for n in range(users):
+            yield json.dumps({'type': 'member', 'user': n, 'room': room})
+    start = datetime(2021, 1, 1)
+    for n in range(messages):
+        yield json.dumps({
+            'type': 'message', 'room': n % rooms, 'sender': n % users,
+            'msg': f'imported message number {n}',
+            'created_at': (start + timedelta(seconds=n)).isoformat()})
+
+
+def setup(url: str):
+    engine = create_database_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine, sessionmaker(bind=engine)
+
+
+def one_by_one(factory, messages: int, users: int) -> float:
+    with factory.begin() as session:
+        session.add_all([User(nick_name=f'user{n}', password='bench',
+                              email=f'user{n}@bench.io')
+                         for n in range(users)])
+        session.add(Conversation(conversation_name='room0'))
+        session.flush()
+        for n in range(users):
+            add_room_member(session, n + 1, 1)
+    start = time.perf_counter()
+    for n in range(messages):
+        with factory.begin() as session:
+            insert_room_messages(session, 1, [{
+                'msg': f'imported message number {n}',
+                'sender_id': n % users + 1, 'created_at': datetime.now()}])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='sqlite:////tmp/cas_bench.db')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--batch-rows', type=int, nargs='+',
+                        default=[1000, 5000, 20000])
+    parser.add_argument('--baseline-messages', type=int, default=2000,
+                        help='messages stored one by one, 0 skips it')
+    args = parser.parse_args()
+
+    print(f'{"mode":>16} {"rows":>9} {"seconds":>8} {"rows/s":>9}')
+    if args.baseline_messages:
+        engine, factory = setup(args.url)
+        elapsed = one_by_one(factory, args.baseline_messages, args.users)
+        engine.dispose()
+        # A message is a row in messages and one in conversation_messages.
+        rows = 2 * args.baseline_messages
+        print(f'{"one by one":>16} {rows:>9} {elapsed:>8.2f} '
+              f'{rows / elapsed:>9.0f}')
+    for batch_rows in args.batch_rows:
+        engine, factory = setup(args.url)
+        stats = Importer(factory, source='bench', batch_rows=batch_rows).run(
+            export_lines(args.messages, args.users, args.rooms))
+        engine.dispose()
+        print(f'{f"batch {batch_rows}":>16} {stats.rows:>9} '
+              f'{stats.seconds:>8.2f} {stats.rows_per_second:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Messages per second of the per-request commit path against the group
+commit message writer.
+
+    python -m benchmarks.bench_ingest --url sqlite:////tmp/cas_bench.db \
+        --messages 5000 --clients 64
+
+Every client thread sends its share of the messages one by one, the way
+concurrent send_msg requests would.
+"""
+import argparse
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from cas.database import (
+    Base,
+    Conversation,
+    User,
+    add_room_message,
+    create_database_engine,
+)
+from cas.ingest import MessageWriter
+
+
+def setup(url: str):
+    engine = create_database_engine(url, pool_size=32, max_overflow=0)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory.begin() as session:
+        session.add(User(nick_name='bench', password='bench',
+                         email='bench@bench.io'))
+        session.add(Conversation(conversation_name='bench'))
+    return engine, factory
+
+
+def drive(send, messages: int, clients: int) -> tuple:
+    per_client = messages // clients
+
+    def client(n):
+        for i in range(per_client):
+            send(f'{n}-{i}')
+
+    threads = [threading.Thread(target=client, args=(n,))
+               for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return per_client * clients, time.perf_counter() - start
+
+
+def direct(factory, messages, clients):
+    def send(msg):
+        with factory.begin() as session:
+            add_room_message(session, 1, 1, msg, datetime.now())
+
+    return drive(send, messages, clients)
+
+
+def writer(factory, messages, clients, wait, flush_ms, batch_rows):
+    message_writer = MessageWriter(factory, flush_interval=flush_ms / 1000,
+                                   batch_rows=batch_rows,
+                                   queue_size=messages, submit_timeout=5)
+
+    def send(msg):
+        future = message_writer.submit(1, 1, msg, datetime.now())
+        if wait:
+            future.result()
+
+    sent, elapsed = drive(send, messages, clients)
+    start = time.perf_counter()
+    message_writer.stop()
+    return sent, elapsed + time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='sqlite:////tmp/cas_bench.db')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--flush-ms', type=int, default=5)
+    parser.add_argument('--batch-rows', type=int, default=500)
+    args = parser.parse_args()
+    runs = [
+        ('per-request commit', lambda f: direct(f, args.messages,
+                                                args.clients)),
+        ('writer, reply after flush',
+         lambda f: writer(f, args.messages, args.clients, True,
+                          args.flush_ms, args.batch_rows)),
+        ('writer, reply when queued',
+         lambda f: writer(f, args.messages, args.clients, False,
+                          args.flush_ms, args.batch_rows)),
+    ]
+    print(f'{"path":<28} {"messages":>9} {"seconds":>8} {"msg/s":>9}')
+    for name, run in runs:
+        engine, factory = setup(args.url)
+        sent, elapsed = run(factory)
+        engine.dispose()
+        print(f'{name:<28} {sent:>9} {elapsed:>8.2f} {sent / elapsed:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
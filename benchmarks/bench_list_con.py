@@ -0,0 +1,119 @@
+"""
+Cost of listing the rooms of a user as the number of memberships grows,
+the lazy loading loop list_con used to run against get_room_summaries.
+
+    python -m benchmarks.bench_list_con --memberships 10 1000 10000
+
+DATABASE_URL defaults to a temporary SQLite file, it is dropped and
+recreated, never point it at one holding real data.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+
+def seed(memberships: list, messages: int):
+    from sqlalchemy import insert
+    from cas.database import (
+        Conversation,
+        ConversationMessage,
+        ConversationUser,
+        Message,
+        Session,
+        User,
+        recreate_database,
+    )
+    from cas.migrations import bootstrap_schema
+
+    recreate_database()
+    bootstrap_schema()
+    rooms = max(memberships)
+    created_at = datetime.now()
+    with Session.begin() as session:
+        session.execute(insert(User), [
+            {'id': n, 'nick_name': f'user{n}', 'email': f'user{n}@gmail.com',
+             'password': 'secret'} for n in range(1, len(memberships) + 1)])
+        session.execute(insert(Conversation), [
+            {'id': n, 'conversation_name': f'room{n}'}
+            for n in range(1, rooms + 1)])
+        session.execute(insert(ConversationUser), [
+            {'user_id': user_id, 'conversation_id': room_id}
+            for user_id, count in enumerate(memberships, 1)
+            for room_id in range(1, count + 1)])
+        session.execute(insert(Message), [
+            {'id': n, 'msg': f'seed {n}', 'created_at': created_at,
+             'sender_id': 1} for n in range(1, rooms * messages + 1)])
+        session.execute(insert(ConversationMessage), [
+            {'conversation_id': n % rooms + 1, 'message_id': n,
+             'created_at': created_at}
+            for n in range(1, rooms * messages + 1)])
+
+
+def lazy_rooms(session, user_id):
+    from cas.database import get_all_conv_user_by_user_id
+
+    return {'Room {0}'.format(conv_user.id):
+            conv_user.conversation.conversation_name
+            for conv_user in get_all_conv_user_by_user_id(session, user_id)}
+
+
+def summaries(session, user_id):
+    from cas.app import room_summaries_info
+    from cas.database import get_room_summaries
+
+    return room_summaries_info(get_room_summaries(session, user_id))
+
+
+def measure(func, user_id, rounds):
+    from cas.database import (
+        Session,
+        get_engine,
+    )
+
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    timings = []
+    event.listen(get_engine(), 'before_cursor_execute', count)
+    try:
+        for _ in range(rounds):
+            statements.clear()
+            with Session.begin() as session:
+                start = time.perf_counter()
+                func(session, user_id)
+                timings.append(time.perf_counter() - start)
+    finally:
+        event.remove(get_engine(), 'before_cursor_execute', count)
+    return statistics.median(timings) * 1000, len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--memberships', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    parser.add_argument('--messages', type=int, default=5,
+                        help='messages per room')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'cas_bench_list_con.db')
+    seed(args.memberships, args.messages)
+    print(f'{"rooms":>7} {"lazy ms":>9} {"lazy sql":>9} '
+          f'{"summary ms":>11} {"summary sql":>12}')
+    for user_id, count in enumerate(args.memberships, 1):
+        lazy_ms, lazy_sql = measure(lazy_rooms, user_id, args.rounds)
+        summary_ms, summary_sql = measure(summaries, user_id, args.rounds)
+        print(f'{count:>7} {lazy_ms:>9.1f} {lazy_sql:>9} '
+              f'{summary_ms:>11.1f} {summary_sql:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Login throughput at each password hashing cost.
+
+    python -m benchmarks.bench_login --kdf scrypt --costs 12 14 15
+
+For every cost the users are stored with a hash of that cost, then
+`concurrency` threads log in through the Flask app, whose password hasher
+is swapped for one with the same cost so no login pays for a rehash.
+Reports logins per second and the latency percentiles.
+DATABASE_URL defaults to a temporary SQLite file, it is dropped and
+recreated, never point it at one holding real data.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile
+
+
+def seed(hasher, users: int):
+    from cas.database import (
+        Session,
+        User,
+        recreate_database,
+    )
+    from cas.migrations import bootstrap_schema
+
+    recreate_database()
+    bootstrap_schema()
+    encoded = hasher.hash('secret').result()
+    with Session.begin() as session:
+        session.add_all([
+            User(nick_name=f'bench{n}', email=f'bench{n}@gmail.com',
+                 password=encoded) for n in range(users)])
+
+
+def run(concurrency: int, requests: int):
+    from cas.app import app
+
+    latencies = []
+    errors = []
+
+    def drive(n):
+        body = {'email': f'bench{n}@gmail.com', 'password': 'secret'}
+        with app.test_client() as http:
+            for _ in range(requests):
+                start = time.perf_counter()
+                data = http.post('/login', json=body).get_json()
+                latencies.append(time.perf_counter() - start)
+                if data['status_code'] != 200:
+                    errors.append(data)
+
+    threads = [threading.Thread(target=drive, args=(n,))
+               for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--kdf', default='scrypt',
+                        choices=['scrypt', 'pbkdf2_sha256'])
+    parser.add_argument('--costs', type=int, nargs='+', default=[12, 14, 15])
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=10)
+    args = parser.parse_args()
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'cas_bench_login.db')
+    from cas import app as cas_app
+    from cas.passwords import PasswordHasher
+
+    print(f'{"cost":>8} {"logins/s":>9} {"p50 ms":>8} {"p99 ms":>8} '
+          f'{"errors":>7}')
+    for cost in args.costs:
+        hasher = PasswordHasher(args.kdf, cost=cost,
+                                max_workers=args.workers,
+                                max_pending=args.concurrency,
+                                submit_timeout=60)
+        cas_app.password_hasher = hasher
+        seed(hasher, args.concurrency)
+        elapsed, latencies, errors = run(args.concurrency, args.requests)
+        hasher.shutdown()
+        print(f'{cost:>8} {len(latencies) / elapsed:>9.1f} '
+              f'{percentile(latencies, 50) * 1000:>8.1f} '
+              f'{percentile(latencies, 99) * 1000:>8.1f} {len(errors):>7}')
+
+
+if __name__ == '__main__':
+    main()
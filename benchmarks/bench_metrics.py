@@ -0,0 +1,56 @@
+"""
+Cost of recording request metrics.
+
+    python -m benchmarks.bench_metrics --iterations 200000 --threads 1 8
+
+Reports the time per record_request call, the work the metrics hooks add
+to every request, single threaded and with threads contending for the
+same route.
+"""
+import argparse
+import threading
+import time
+
+from cas.metrics import (
+    Counter,
+    Histogram,
+    record_request,
+)
+
+
+def per_call_ns(func, iterations: int, threads: int) -> float:
+    def run():
+        for _ in range(iterations):
+            func()
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (iterations * threads) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    args = parser.parse_args()
+    counter = Counter('bench_total', 'Bench.', ('route',))
+    histogram = Histogram('bench_seconds', 'Bench.', ('route',))
+    cases = [
+        ('Counter.inc', lambda: counter.inc('/send_msg')),
+        ('Histogram.observe', lambda: histogram.observe(0.004, '/send_msg')),
+        ('record_request', lambda: record_request('/send_msg', 'POST', 200,
+                                                  0.004)),
+    ]
+    print(f'{"operation":<20} {"threads":>7} {"ns/call":>9}')
+    for name, func in cases:
+        for threads in args.threads:
+            print(f'{name:<20} {threads:>7} '
+                  f'{per_call_ns(func, args.iterations, threads):>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Cost of a rate limit check.
+
+    python -m benchmarks.bench_ratelimit --rounds 200000 --keys 1 1000 100000
+
+Times RateLimiter.check with the send_msg limits of the configuration, a
+user and a room bucket per check, spread over `keys` users, then the same
+from `--threads` threads sharing the limiter. Reports the microseconds per
+check and the buckets kept at the end.
+"""
+import argparse
+import threading
+import time
+import timeit
+
+from cas import config
+from cas.ratelimit import (
+    LocalBackend,
+    RateLimiter,
+)
+
+
+def limiter(keys: int) -> RateLimiter:
+    return RateLimiter({'send_msg': config.RATE_LIMITS['send_msg']},
+                       LocalBackend(max_keys=2 * keys + 2))
+
+
+def single(keys: int, rounds: int) -> tuple:
+    rate_limiter = limiter(keys)
+    users = iter(range(rounds))
+    seconds = timeit.timeit(
+        lambda: rate_limiter.check('send_msg', next(users) % keys, 1),
+        number=rounds)
+    return seconds / rounds * 1e6, len(rate_limiter.backend)
+
+
+def threaded(keys: int, rounds: int, threads: int) -> float:
+    rate_limiter = limiter(keys)
+    share = rounds // threads
+
+    def drive(n):
+        for user_id in range(n * share, (n + 1) * share):
+            rate_limiter.check('send_msg', user_id % keys, 1)
+
+    workers = [threading.Thread(target=drive, args=(n,))
+               for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (share * threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=200000)
+    parser.add_argument('--keys', type=int, nargs='+',
+                        default=[1, 1000, 100000])
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    print(f'{"keys":>8} {"us/check":>9} {f"{args.threads} threads":>11} '
+          f'{"buckets":>8}')
+    for keys in args.keys:
+        us, buckets = single(keys, args.rounds)
+        threaded_us = threaded(keys, args.rounds, args.threads)
+        print(f'{keys:>8} {us:>9.2f} {threaded_us:>11.2f} {buckets:>8}')
+
+
+if __name__ == '__main__':
+    main()
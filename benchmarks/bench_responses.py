@@ -0,0 +1,75 @@
+"""
+Cost of building the JSON responses of the API.
+
+    python -m benchmarks.bench_responses --rounds 100000
+
+Times ok_response and error_response with every available encoder against
+the jsonify based helpers they replaced, on a body shaped like the
+send_msg reply.
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+from flask import jsonify
+
+from cas.utils import (
+    JSON_ENCODERS,
+    app,
+    error_response,
+    ok_response,
+    set_json_encoder,
+)
+
+PAYLOAD = {'User': {'ID': 42, 'Name': 'pero', 'Authorization': 'x' * 150},
+           'Room': 7, 'Message': 'See you at the standup'}
+
+
+def jsonify_ok_response(message, status_code=200, **additional_data):
+    data = {
+        'status': 'OK',
+        'code': status_code,
+        'server_time': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        'message': message,
+    }
+    for k, v in additional_data.items():
+        data['{0}'.format(k)] = v
+    return jsonify({"info": {'data': data}, "status_code": status_code})
+
+
+def jsonify_error_response(message, status_code):
+    data = {
+        'status': 'ERROR',
+        'code': status_code,
+        'server_time': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        'message': message
+    }
+    return jsonify({"info": {'data': data}, "status_code": status_code})
+
+
+def run(ok, error, rounds):
+    ok_us = timeit.timeit(lambda: ok('Message is successfully send!',
+                                     **PAYLOAD), number=rounds)
+    error_us = timeit.timeit(lambda: error('User does not exist!', 404),
+                             number=rounds)
+    return ok_us / rounds * 1e6, error_us / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=100000)
+    args = parser.parse_args()
+    print(f'{"helpers":<18} {"ok us":>8} {"error us":>9}')
+    with app.app_context():
+        ok_us, error_us = run(jsonify_ok_response, jsonify_error_response,
+                              args.rounds)
+        print(f'{"jsonify":<18} {ok_us:>8.2f} {error_us:>9.2f}')
+        for name in JSON_ENCODERS:
+            set_json_encoder(name)
+            ok_us, error_us = run(ok_response, error_response, args.rounds)
+            print(f'{"direct " + name:<18} {ok_us:>8.2f} {error_us:>9.2f}')
+        set_json_encoder('auto')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Latency of room search on a large room.
+
+    python -m benchmarks.bench_search --messages 1000000
+
+Messages are drawn from a skewed vocabulary, so the queries range from
+rare words to ones found in a large share of the room. On SQLite the time
+to load the room into the in-process index is reported separately.
+DATABASE_URL defaults to a temporary SQLite file, it is dropped and
+recreated, never point it at one holding real data.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.common import percentile
+
+QUERIES = {
+    'rare': 'w4000',
+    'common': 'w1',
+    'two words': 'w1 w20',
+    'no match': 'nothing',
+}
+
+
+def seed(messages: int, chunk: int = 50000):
+    from sqlalchemy import insert
+    from cas.database import (
+        Conversation,
+        ConversationMessage,
+        Message,
+        Session,
+        User,
+        recreate_database,
+    )
+    from cas.migrations import bootstrap_schema
+
+    recreate_database()
+    bootstrap_schema()
+    rng = random.Random(1)
+    words = [f'w{n}' for n in range(1, 5001)]
+    weights = [1 / n for n in range(1, 5001)]
+    created_at = datetime.now()
+    with Session.begin() as session:
+        session.add_all([
+            User(id=1, nick_name='bench', email='bench@gmail.com',
+                 password='secret'),
+            Conversation(id=1, conversation_name='bench')])
+    for start in range(1, messages + 1, chunk):
+        ids = range(start, min(start + chunk, messages + 1))
+        with Session.begin() as session:
+            session.execute(insert(Message), [
+                {'id': n, 'created_at': created_at, 'sender_id': 1,
+                 'msg': ' '.join(rng.choices(words, weights, k=4))}
+                for n in ids])
+            session.execute(insert(ConversationMessage), [
+                {'conversation_id': 1, 'message_id': n,
+                 'created_at': created_at} for n in ids])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'cas_bench_search.db')
+    from cas.database import (
+        Session,
+        get_engine,
+    )
+    from cas.search import (
+        search_index,
+        search_room_messages,
+    )
+
+    start = time.perf_counter()
+    seed(args.messages)
+    print(f'seeded {args.messages} messages in '
+          f'{time.perf_counter() - start:.1f}s')
+    if get_engine().dialect.name != 'postgresql':
+        start = time.perf_counter()
+        search_index.room(1)
+        print(f'loaded the room index in {time.perf_counter() - start:.1f}s')
+    print(f'{"query":<10} {"results":>8} {"p50 ms":>8} {"p99 ms":>8}')
+    for name, query in QUERIES.items():
+        timings = []
+        for _ in range(args.rounds):
+            with Session() as session:
+                start = time.perf_counter()
+                results = search_room_messages(session, 1, query,
+                                               limit=args.limit)
+                timings.append(time.perf_counter() - start)
+        print(f'{name:<10} {len(results):>8} '
+              f'{percentile(timings, 50) * 1000:>8.2f} '
+              f'{percentile(timings, 99) * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
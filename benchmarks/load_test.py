@@ -0,0 +1,287 @@
+"""
+Load test of the HTTP API. Seeds users, rooms, memberships and messages,
+then drives every endpoint from concurrent clients and reports requests
+per second, latency percentiles and SQL statements per request.
+
+    DATABASE_URL=sqlite:////tmp/cas_load.db python -m benchmarks.load_test \
+        --users 1000 --rooms 100 --messages 100000 --clients 16 \
+        --requests 200 --out baseline.json
+
+    python -m benchmarks.load_test --compare baseline.json --out new.json
+
+The database behind DATABASE_URL is dropped and recreated, never point it
+at one holding real data. Clients run in process through the Flask test
+client, so the numbers exclude the HTTP server and network. Rate limits
+are off unless RATE_LIMITS_ENABLED=1 is set, every client shares one
+address and the default create_room limits alone turn most of its
+requests away.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.common import percentile
+
+ENDPOINTS = ('register', 'login', 'create_room', 'join_room', 'send_msg',
+             'list_con')
+
+
+class StatementCounter:
+    """
+    Counts the statements executed by the current thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self) -> int:
+        return getattr(self._local, 'count', 0)
+
+    def before_cursor_execute(self, *args, **kwargs):
+        self._local.count = self.count + 1
+
+
+class Client:
+
+    def __init__(self, n: int, user_id: int, email: str, rooms: list,
+                 joinable: list):
+        self.n = n
+        self.user_id = user_id
+        self.email = email
+        self.rooms = rooms
+        self.joinable = joinable
+        self.token = None
+
+    def headers(self) -> dict:
+        return {'user_id': str(self.user_id),
+                'authorization': self.token or ''}
+
+    def update_token(self, body):
+        token = find_token(body)
+        if token:
+            self.token = token
+
+
+def find_token(body):
+    if isinstance(body, dict):
+        for key, value in body.items():
+            if key == 'Authorization' and isinstance(value, str):
+                return value
+            token = find_token(value)
+            if token:
+                return token
+    return None
+
+
+def make_request(endpoint: str, client: Client, i: int):
+    if endpoint == 'register':
+        return 'POST', '/register', {
+            'nick_name': f'load{client.n}-{i}',
+            'email': f'l{client.n}x{i}@gmail.com', 'password': 'secret'}
+    if endpoint == 'login':
+        return 'POST', '/login', {'email': client.email,
+                                  'password': 'secret'}
+    if endpoint == 'create_room':
+        return 'POST', '/create_room', {'user_id': client.user_id,
+                                        'room_name': f'lr{client.n}-{i}'}
+    if endpoint == 'join_room':
+        room_id = client.joinable.pop()
+        client.rooms.append(room_id)
+        return 'POST', '/join_room', {'user_id': client.user_id,
+                                      'room_id': room_id}
+    if endpoint == 'send_msg':
+        return 'POST', '/send_msg', {'user_id': client.user_id,
+                                     'room_id': random.choice(client.rooms),
+                                     'msg': f'load {i}'}
+    return 'GET', f'/list_con/user_id/{client.user_id}', None
+
+
+def seed(args):
+    from sqlalchemy import insert
+    from cas.database import (
+        Conversation,
+        ConversationUser,
+        Session,
+        User,
+        insert_room_messages,
+        recreate_database,
+    )
+    from cas.app import password_hasher
+    from cas.migrations import bootstrap_schema
+
+    recreate_database()
+    bootstrap_schema()
+    created_at = datetime.now()
+    memberships = {}
+    # Logins verify a hash of the configured cost, like in production. One
+    # hash is shared, hashing every seeded user would dominate the seed.
+    password = password_hasher.hash('secret').result()
+    with Session.begin() as session:
+        session.execute(insert(User), [
+            {'nick_name': f'user{n}', 'email': f'user{n}@gmail.com',
+             'password': password} for n in range(1, args.users + 1)])
+        session.execute(insert(Conversation), [
+            {'conversation_name': f'room{n}'}
+            for n in range(1, args.rooms + 1)])
+        rows = []
+        for user_id in range(1, args.users + 1):
+            rooms = [(user_id + j) % args.rooms + 1
+                     for j in range(args.memberships)]
+            memberships[user_id] = rooms
+            rows.extend({'user_id': user_id, 'conversation_id': room_id}
+                        for room_id in rooms)
+        session.execute(insert(ConversationUser), rows)
+    per_room = args.messages // args.rooms
+    for room_id in range(1, args.rooms + 1):
+        with Session.begin() as session:
+            insert_room_messages(session, room_id, [
+                {'msg': f'seed {n}', 'created_at': created_at,
+                 'sender_id': random.randint(1, args.users)}
+                for n in range(per_room)])
+    return memberships
+
+
+def run_endpoint(app, counter, endpoint, clients, requests):
+    results = [[] for _ in clients]
+    errors = [0 for _ in clients]
+
+    def drive(c, client):
+        with app.test_client() as http:
+            for i in range(requests):
+                method, path, body = make_request(endpoint, client, i)
+                counter.reset()
+                start = time.perf_counter()
+                response = http.open(path, method=method, json=body,
+                                     headers=client.headers())
+                elapsed = time.perf_counter() - start
+                data = response.get_json(silent=True) or {}
+                client.update_token(data)
+                results[c].append((elapsed, counter.count))
+                if data.get('status_code', response.status_code) != 200:
+                    errors[c] += 1
+
+    threads = [threading.Thread(target=drive, args=(c, client))
+               for c, client in enumerate(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    latencies = [r[0] for rs in results for r in rs]
+    statements = [r[1] for rs in results for r in rs]
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'statements_per_request': sum(statements) / len(statements),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def print_report(report, baseline=None):
+    print(f'{"endpoint":<12} {"req":>6} {"err":>5} {"rps":>8} {"p50 ms":>8} '
+          f'{"p95 ms":>8} {"p99 ms":>8} {"sql/req":>8}')
+    for endpoint, r in report['endpoints'].items():
+        print(f'{endpoint:<12} {r["requests"]:>6} {r["errors"]:>5} '
+              f'{r["rps"]:>8.0f} {r["p50_ms"]:>8.2f} {r["p95_ms"]:>8.2f} '
+              f'{r["p99_ms"]:>8.2f} {r["statements_per_request"]:>8.1f}')
+        old = (baseline or {}).get('endpoints', {}).get(endpoint)
+        if old:
+            print(f'{"  vs base":<12} {"":>6} {"":>5} '
+                  + ' '.join(f'{delta(r[k], old[k]):>8}' for k in (
+                      'rps', 'p50_ms', 'p95_ms', 'p99_ms',
+                      'statements_per_request')))
+
+
+def delta(new, old) -> str:
+    if not old:
+        return '-'
+    return f'{(new - old) / old * 100:+.0f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--memberships', type=int, default=5,
+                        help='rooms every seeded user is a member of')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=100,
+                        help='requests per client and endpoint')
+    parser.add_argument('--endpoints', nargs='+', default=list(ENDPOINTS),
+                        choices=ENDPOINTS)
+    parser.add_argument('--out', help='write the report as JSON')
+    parser.add_argument('--compare', help='JSON report to compare against')
+    args = parser.parse_args()
+    if args.clients > args.users:
+        parser.error('--clients can not exceed --users')
+    if args.requests > args.rooms - args.memberships:
+        parser.error('every join needs a room the client is not in yet, '
+                     'raise --rooms or lower --requests')
+    os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/cas_load.db')
+    os.environ.setdefault('RATE_LIMITS_ENABLED', '0')
+
+    from sqlalchemy import event
+    from cas.app import app
+    from cas.database import get_engine
+
+    memberships = seed(args)
+    counter = StatementCounter()
+    event.listen(get_engine(), 'before_cursor_execute',
+                 counter.before_cursor_execute)
+    clients = [Client(n, n, f'user{n}@gmail.com', list(memberships[n]),
+                      [r for r in range(1, args.rooms + 1)
+                       if r not in memberships[n]])
+               for n in range(1, args.clients + 1)]
+    if 'login' not in args.endpoints:
+        run_endpoint(app, counter, 'login', clients, 1)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now().isoformat(),
+            'database': get_engine().dialect.name,
+            'scale': {k: getattr(args, k) for k in (
+                'users', 'rooms', 'memberships', 'messages', 'clients',
+                'requests')},
+        },
+        'endpoints': {},
+    }
+    for endpoint in ENDPOINTS:
+        if endpoint in args.endpoints:
+            report['endpoints'][endpoint] = run_endpoint(
+                app, counter, endpoint, clients, args.requests)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,320 @@
+import hmac
 import os
 from flask import (
     request,
+    Response,
 )
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from cas.database import (
     recreate_database,
-    ConversationUser,
-    ConversationMessage,
     Session,
     add_user,
     add_conversation,
-    add_message,
-    update_user,
+    add_room_message,
+    add_room_messages,
+    add_room_member,
+    remove_room_member,
     get_user_by_email,
     get_user_by_id,
+    update_user_password,
     get_conv_user_by_ids,
-    get_all_conv_user_by_user_id,
-    get_message_by_msg,
+    get_idempotent_messages,
     get_message_by_user_id,
+    get_room_summaries,
+    get_unread_counts,
+    mark_room_read,
+    set_room_retention,
     get_conversation_by_id,
     get_conversation_by_room_name,
     delete_conversation_by_id,
     join_user_msg,
     delete_msg_by_msg_id,
+    get_room_history,
 )
 from cas.utils import (
     authorization,
     app,
-    random_string,
-    encode_security_token,
     ok_response,
     error_response,
+    json_dumps,
+    message_info,
     now,
     refresh_security_token,
+    rotate_security_token,
 )
+from cas import (
+    config,
+    instrumentation,
+    metrics,
+)
+from cas.archive import (
+    Archiver,
+    message_archive,
+)
+from cas.export import (
+    CONTENT_TYPE as EXPORT_CONTENT_TYPE,
+    export_room,
+    wants_gzip,
+)
+from cas.idempotency import (
+    HEADER as IDEMPOTENCY_HEADER,
+    REPLAYED_HEADER as IDEMPOTENT_REPLAYED_HEADER,
+    SentMessage,
+    key_error as idempotency_key_error,
+    recall as recall_sent_message,
+    remember as remember_sent_message,
+    remember_when_stored,
+)
+from cas.importer import (
+    ImportRecordError,
+    Importer,
+)
+from cas.ingest import (
+    IngestQueueFull,
+    MessageWriter,
+)
+from cas.membership import membership
+from cas.passwords import (
+    PasswordHasher,
+    PasswordHasherBusy,
+)
+from cas.migrations import bootstrap_schema
+from cas.partitions import PartitionManager
+from cas.pubsub import hub
+from cas.purge import RoomPurger
+from cas.ratelimit import (
+    limit_address,
+    rate_limit,
+)
+from cas.search import search_room_messages
 from cas.validation import (
     RegisterUserCheck,
     RoomCheck,
     RoomJoinLeave,
     MessageCheck,
+    MessagesCheck,
+    MarkReadCheck,
+    RetentionCheck,
     validation_check,
 )
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'my_secret_key'
-db = SQLAlchemy(app)
-recreate_database()
+app.config['STREAM_KEEP_ALIVE'] = 15
+app.config['HISTORY_PAGE_SIZE'] = 50
+app.config['HISTORY_MAX_PAGE_SIZE'] = 200
+app.config['SEARCH_PAGE_SIZE'] = 20
+app.config['SEARCH_MAX_PAGE_SIZE'] = 100
+app.config['EXPORT_CHUNK_ROWS'] = 1000
+# 'off' commits every message in its request, 'flush' queues it for the
+# message writer and replies once it is committed, 'queued' replies as soon
+# as the message is accepted by the queue.
+app.config['INGEST_MODE'] = os.environ.get('INGEST_MODE', 'off')
+app.config['INGEST_FLUSH_MS'] = int(os.environ.get('INGEST_FLUSH_MS', 5))
+app.config['INGEST_BATCH_ROWS'] = int(
+    os.environ.get('INGEST_BATCH_ROWS', 500))
+app.config['INGEST_QUEUE_SIZE'] = int(
+    os.environ.get('INGEST_QUEUE_SIZE', 10000))
+instrumentation.init_app(app)
+metrics.init_app(app)
+if config.TEST_MODE:
+    recreate_database()
+bootstrap_schema()
+
+
+def publish_stored_messages(stored):
+    for item, msg_id in stored:
+        hub.publish(item.room_id, {**item.event, 'ID': msg_id})
+
+
+def export_headers(room_id: int, compress: bool) -> dict:
+    headers = {'Content-Disposition':
+               f'attachment; filename=room_{room_id}.ndjson',
+               'Vary': 'Accept-Encoding', 'X-Accel-Buffering': 'no'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
+
+def import_allowed(token: str) -> bool:
+    return bool(config.IMPORT_TOKEN) and hmac.compare_digest(
+        (token or '').encode(), config.IMPORT_TOKEN.encode())
+
+
+def find_sent_message(session, user_id: int, user_name: str,
+                      key: str) -> SentMessage:
+    row = get_idempotent_messages(session, [(user_id, key)]).get(
+        (user_id, key))
+    if row is None:
+        return None
+    sent = SentMessage(row.id, row.room_id, row.msg, user_name)
+    remember_sent_message(user_id, key, sent)
+    return sent
+
+
+def member_info(user_id: int, user_name: str, room_id: int,
+                token: str) -> dict:
+    """
+    The body shared by the replies of join_room, leave_room and send_msgs.
+    """
+    return {'User': {'ID': user_id, 'Name': user_name,
+                     'Authorization': token},
+            'Room': room_id}
+
+
+def sent_message_info(user_id: int, sent: SentMessage, token: str) -> dict:
+    """
+    The body of the send_msg reply that stored `sent`.
+    """
+    return {**member_info(user_id, sent.user_name, sent.room_id, token),
+            'Message': sent.msg}
+
+
+def room_created_info(user_id: int, user_name: str, user_email: str,
+                      room_id: int, room_name: str, token: str) -> dict:
+    return {'Info': {
+        'User': {'ID': user_id, 'Authorization': token, 'Name': user_name,
+                 'Email': user_email},
+        'Room': {'ID': room_id, 'Name': room_name}}}
+
+
+def message_event(room_id: int, user_id: int, user_name: str, msg: str,
+                  created_at) -> dict:
+    """
+    The stream event of a sent message, without the ID it is stored with.
+    """
+    return {'Room': room_id, 'User': {'ID': user_id, 'Name': user_name},
+            'Message': msg, 'Created_at': created_at.isoformat()}
+
+
+def read_cursor_info(room_id: int, cursor, token: str) -> dict:
+    return {'Room': room_id, 'Last_read': cursor.last_read_message_id,
+            'Unread': cursor.unread_count, 'Authorization': token}
+
+
+def limit_error(limit: int, max_limit: int) -> str:
+    if limit < 1 or limit > max_limit:
+        return f'Limit must be between 1 and {max_limit}!'
+    return None
+
+
+def history_args(args, app_config) -> tuple:
+    """
+    The query string of a history request.
+    :param args: request.args
+    :param app_config: config of the serving app
+    :return: before, limit and the message of the 400 reply or None
+    """
+    before = args.get('before', type=int)
+    limit = args.get('limit', app_config['HISTORY_PAGE_SIZE'], type=int)
+    return before, limit, limit_error(limit,
+                                      app_config['HISTORY_MAX_PAGE_SIZE'])
+
+
+def history_info(messages: list, limit: int) -> dict:
+    """
+    :param messages: message_info of the page
+    :param limit: page size
+    """
+    return {'Messages': messages,
+            'Next_before': messages[-1]['ID'] if len(messages) == limit
+            else None}
+
+
+def search_args(args, app_config) -> tuple:
+    """
+    The query string of a search request.
+    :param args: request.args
+    :param app_config: config of the serving app
+    :return: query, limit, offset and the message of the 400 reply or None
+    """
+    query = args.get('q', '').strip()
+    limit = args.get('limit', app_config['SEARCH_PAGE_SIZE'], type=int)
+    offset = args.get('offset', 0, type=int)
+    error = limit_error(limit, app_config['SEARCH_MAX_PAGE_SIZE'])
+    if not query:
+        error = 'Search query is missing!'
+    elif error is None and offset < 0:
+        error = 'Offset must not be negative!'
+    return query, limit, offset, error
+
+
+def search_results_info(results: list, limit: int, offset: int) -> dict:
+    """
+    :param results: SearchResult of the page
+    :param limit: page size
+    :param offset: of the page
+    """
+    messages = [{'ID': result.message.id,
+                 'Sender_id': result.message.sender_id,
+                 'Message': result.message.msg,
+                 'Created_at': result.message.created_at.isoformat(),
+                 'Rank': result.rank} for result in results]
+    return {'Messages': messages,
+            'Next_offset': offset + limit if len(messages) == limit
+            else None}
+
+
+def replay_sent_message(user_id: int, sent: SentMessage, data: dict,
+                        token: str):
+    if not sent.matches(data.get('room_id'), data.get('msg')):
+        return error_response(
+            message=f'{IDEMPOTENCY_HEADER} was used for another message!',
+            status_code=422)
+    response = ok_response(message='Message is successfully send!',
+                           **sent_message_info(user_id, sent, token))
+    response.headers[IDEMPOTENT_REPLAYED_HEADER] = 'true'
+    return response
+
+
+def room_summaries_info(summaries) -> dict:
+    """
+    The body of list_con, `rooms` keeps the membership to room name mapping
+    older clients read.
+    :param summaries: rows of get_room_summaries
+    :return: dict
+    """
+    return {
+        'rooms': {'Room {0}'.format(row.membership_id): row.room_name
+                  for row in summaries},
+        'summaries': [{
+            'ID': row.room_id,
+            'Name': row.room_name,
+            'Members': row.members,
+            'Unread': row.unread_count or 0,
+            'Last_message': None if row.last_message_id is None else {
+                'ID': row.last_message_id,
+                'Message': row.last_message,
+                'Created_at': row.last_message_at.isoformat()},
+        } for row in summaries],
+    }
+
+
+message_writer = MessageWriter(
+    Session, flush_interval=app.config['INGEST_FLUSH_MS'] / 1000,
+    batch_rows=app.config['INGEST_BATCH_ROWS'],
+    queue_size=app.config['INGEST_QUEUE_SIZE'],
+    on_commit=publish_stored_messages)
+password_hasher = PasswordHasher(
+    config.PASSWORD_KDF, cost=config.PASSWORD_COST,
+    max_workers=config.PASSWORD_POOL_SIZE,
+    max_pending=config.PASSWORD_MAX_PENDING,
+    submit_timeout=config.PASSWORD_SUBMIT_TIMEOUT)
+room_purger = RoomPurger(
+    Session, chunk_size=config.PURGE_CHUNK_ROWS,
+    chunk_pause=config.PURGE_CHUNK_PAUSE_MS / 1000,
+    poll_interval=config.PURGE_POLL_INTERVAL)
+archiver = Archiver(
+    message_archive, Session, chunk_size=config.ARCHIVE_CHUNK_ROWS,
+    default_days=config.ARCHIVE_RETENTION_DAYS or None,
+    interval=config.ARCHIVE_INTERVAL)
+if config.ARCHIVE_INTERVAL:
+    archiver.start()
+partition_manager = PartitionManager(
+    months_ahead=config.MESSAGE_PARTITION_MONTHS_AHEAD,
+    retain_months=config.MESSAGE_PARTITION_RETAIN_MONTHS,
+    interval=config.MESSAGE_PARTITION_INTERVAL)
+if config.MESSAGE_PARTITION_INTERVAL:
+    partition_manager.start()
 
 
 @app.route('/register', methods=['POST'])
@@ -54,13 +322,23 @@ def register():
     data = request.get_json()
     val = validation_check(data, RegisterUserCheck)
     if not val:
-        with Session.begin() as session:
-            user = get_user_by_email(session, data.get('email'))
-            if user:
+        with Session() as session:
+            if get_user_by_email(session, data.get('email')):
                 return error_response(message='Email already exist!',
                                       status_code=400)
-            else:
-                add_user(session, data)
+        # Hashed without holding a connection, the unique email index
+        # catches a concurrent registration.
+        try:
+            password = password_hasher.hash(data.get('password')).result()
+        except PasswordHasherBusy:
+            return error_response(message='Server is busy, try again!',
+                                  status_code=503)
+        try:
+            with Session.begin() as session:
+                add_user(session, {**data, 'password': password})
+        except IntegrityError:
+            return error_response(message='Email already exist!',
+                                  status_code=400)
         return ok_response(message='User created!', **{
             'User_info': {'Nick_name': data.get('nick_name'),
                           'User_email': data.get('email')}})
@@ -70,16 +348,28 @@ def register():
 @app.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
-    with Session.begin() as session:
+    with Session() as session:
         user = get_user_by_email(session, data.get('email'))
         if not user:
             return error_response(message='User does no exist!',
                                   status_code=404)
-        user_id = user.id
-        key_word = random_string(64)
+        user_id, encoded = user.id, user.password
+    password = data.get('password') or ''
+    try:
+        if not password_hasher.verify(password, encoded).result():
+            return error_response(message='Wrong password!',
+                                  status_code=401)
+        rehashed = None
+        if password_hasher.needs_rehash(encoded):
+            rehashed = password_hasher.hash(password).result()
+    except PasswordHasherBusy:
+        return error_response(message='Server is busy, try again!',
+                              status_code=503)
+    with Session.begin() as session:
+        if rehashed:
+            update_user_password(session, user_id, encoded, rehashed)
         try:
-            update_user(session, user, key_word=key_word)
-            token = encode_security_token(user_id, user.nick_name, key_word)
+            user_id, token = rotate_security_token(session, user_id)
         except BaseException as ex:
             return error_response(message=f'Error: {ex}', status_code=500)
     return ok_response(message='Success!', **{
@@ -87,7 +377,9 @@ def login():
 
 
 @app.route('/create_room', methods=['POST'])
+@limit_address('create_room')
 @authorization
+@rate_limit('create_room')
 def create_room():
     data = request.get_json()
     val = validation_check(data, RoomCheck)
@@ -124,18 +416,17 @@ def create_room():
                 return error_response(message='You are already joined!',
                                       status_code=400)
             else:
-                session.add(ConversationUser(
-                    user_id=user.id, conversation_id=conv.id))
-        return ok_response(message='Room created!', **{'Info': {
-            'User': {'ID': user_id,
-                     'Authorization': new_token.get('Authorization'),
-                     'Name': user_name, 'Email': user_email},
-            'Room': {'ID': room_id, 'Name': room_name}}})
+                add_room_member(session, user.id, conv.id)
+        return ok_response(message='Room created!', **room_created_info(
+            user_id, user_name, user_email, room_id, room_name,
+            new_token.get('Authorization')))
     return error_response(message=val, status_code=400)
 
 
 @app.route('/join_room', methods=['POST'])
+@limit_address('join_room')
 @authorization
+@rate_limit('join_room')
 def join_room():
     data = request.get_json()
     val = validation_check(data, RoomJoinLeave)
@@ -153,26 +444,21 @@ def join_room():
             if not conv:
                 return error_response(message='Room does not exist!',
                                       status_code=404)
-            room_id = conv.id
-            conv_user = get_conv_user_by_ids(session, user_id, room_id)
-            if conv_user:
+            if membership.contains(user_id, conv.id):
+                return error_response(message='You are already joined!',
+                                      status_code=400)
+            try:
+                add_room_member(session, user_id, conv.id)
+                session.flush()
+            except IntegrityError:
+                # Joined through another worker.
+                session.rollback()
                 return error_response(message='You are already joined!',
                                       status_code=400)
-            else:
-                session.add(ConversationUser(user_id=user_id,
-                                             conversation_id=conv.id))
-                conv_user = get_conv_user_by_ids(session, user_id, room_id)
-            if not conv_user:
-                return error_response(
-                    message=f'Room for the user {user.nick_name} does not '
-                            f'exist!',
-                    status_code=404)
-            session.commit()
         return ok_response(
             message=f'You joined the room: {data.get("room_id")}',
-            **{'User': {'ID': user_id, 'Name': user_name,
-                        'Authorization': new_token.get('Authorization')},
-               'Room': data.get('room_id')})
+            **member_info(user_id, user_name, data.get('room_id'),
+                          new_token.get('Authorization')))
     return error_response(message=val, status_code=400)
 
 
@@ -189,41 +475,113 @@ def leave_room():
             if not user:
                 return error_response(message='User does not exist!',
                                       status_code=404)
-            conv = get_conversation_by_id(session, data.get('room_id'))
-            if not conv:
-                return error_response(message='Room does not exist!',
-                                      status_code=404)
-            room_id = conv.id
-            conv_user = get_conv_user_by_ids(session, user.id, room_id)
-            if not conv_user:
+            if not remove_room_member(session, user.id, data.get('room_id')):
                 return error_response(
                     message=f'Room for the user {user.nick_name} does not '
                             f'exist!',
                     status_code=404)
-            conv = get_conversation_by_id(session, data.get('room_id'))
-            if not conv:
-                return error_response(message='Room does not exist!',
-                                      status_code=404)
-            room = session.query(ConversationUser).filter(
-                ConversationUser.user_id == user.id,
-                ConversationUser.conversation_id == conv.id).first()
-            session.delete(room)
             return ok_response(
                 message=f'You leaved the room: {data.get("room_id")}',
-                **{'User': {'ID': user.id, 'Name': user.nick_name,
-                            'Authorization': new_token.get(
-                                'Authorization')},
-                   'Room': data.get('room_id')})
+                **member_info(user.id, user.nick_name, data.get('room_id'),
+                              new_token.get('Authorization')))
     return error_response(message=val, status_code=400)
 
 
 @app.route('/send_msg', methods=['POST'])
+@limit_address('send_msg')
 @authorization
+@rate_limit('send_msg')
 def send_msg():
     data = request.get_json()
     val = validation_check(data, MessageCheck)
     ref_token = refresh_security_token().json
     new_token = ref_token.get('info', {}).get('data')
+    if not val:
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        key_error = idempotency_key_error(key)
+        if key_error:
+            return error_response(message=key_error, status_code=400)
+        room_id = data.get('room_id')
+        sent = recall_sent_message(data.get('user_id'), key) if key else None
+        if sent is not None:
+            return replay_sent_message(data.get('user_id'), sent, data,
+                                       new_token.get('Authorization'))
+        try:
+            with Session.begin() as session:
+                user = get_user_by_id(session, data.get('user_id'))
+                if not user:
+                    return error_response(message='User does not exist!',
+                                          status_code=404)
+                user_id = user.id
+                user_name = user.nick_name
+                if not membership.is_member(user_id, room_id):
+                    return error_response(
+                        message='You are not joined to the conversation!',
+                        status_code=404)
+                if key is not None:
+                    sent = find_sent_message(session, user_id, user_name, key)
+                    if sent is not None:
+                        return replay_sent_message(
+                            user_id, sent, data,
+                            new_token.get('Authorization'))
+                created_at = now()
+                event = message_event(room_id, user_id, user_name,
+                                      data.get('msg'), created_at)
+                if app.config['INGEST_MODE'] == 'off':
+                    msg_id = add_room_message(session, room_id, user_id,
+                                              data.get('msg'), created_at,
+                                              idempotency_key=key)
+        except IntegrityError:
+            if key is None:
+                raise
+            # Sent with the same key through another request at once.
+            with Session() as session:
+                sent = find_sent_message(session, user_id, user_name, key)
+            if sent is None:
+                raise
+            return replay_sent_message(user_id, sent, data,
+                                       new_token.get('Authorization'))
+        if app.config['INGEST_MODE'] == 'off':
+            hub.publish(room_id, {**event, 'ID': msg_id})
+            if key is not None:
+                remember_sent_message(user_id, key, SentMessage(
+                    msg_id, room_id, data.get('msg'), user_name))
+        else:
+            try:
+                stored = message_writer.submit(room_id, user_id,
+                                               data.get('msg'), created_at,
+                                               event=event,
+                                               idempotency_key=key)
+            except IngestQueueFull:
+                return error_response(
+                    message='Server is busy, try again later!',
+                    status_code=503)
+            if key is not None:
+                remember_when_stored(stored, user_id, key, room_id,
+                                     data.get('msg'), user_name)
+            if app.config['INGEST_MODE'] == 'flush':
+                try:
+                    stored.result()
+                except Exception as ex:
+                    return error_response(message=f'Error: {ex}',
+                                          status_code=500)
+        return ok_response(message='Message is successfully send!',
+                           **member_info(user_id, user_name,
+                                         data.get('room_id'),
+                                         new_token.get('Authorization')),
+                           Message=data.get('msg'))
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/send_msgs', methods=['POST'])
+@limit_address('send_msgs')
+@authorization
+@rate_limit('send_msgs')
+def send_msgs():
+    data = request.get_json()
+    val = validation_check(data, MessagesCheck)
+    ref_token = refresh_security_token().json
+    new_token = ref_token.get('info', {}).get('data')
     if not val:
         with Session.begin() as session:
             user = get_user_by_id(session, data.get('user_id'))
@@ -232,30 +590,191 @@ def send_msg():
                                       status_code=404)
             user_id = user.id
             user_name = user.nick_name
-            conv = get_conversation_by_id(session, data.get('room_id'))
-            if not conv:
+            room_id = data.get('room_id')
+            if not membership.is_member(user_id, room_id):
                 return error_response(
                     message='You are not joined to the conversation!',
                     status_code=404)
-            add_message(session, data=data, created_at=now(),
-                        sender_id=user_id)
-            msg = get_message_by_msg(session, data.get('msg'))
-            session.add(ConversationMessage(conversation_id=conv.id,
-                                            message_id=msg.id))
-            session.commit()
-        return ok_response(message='Message is successfully send!',
-                           **{'User': {'ID': user_id, 'Name': user_name,
-                                       'Authorization': new_token.get(
-                                           'Authorization')},
-                              'Room': data.get('room_id'),
-                              'Message': data.get('msg')})
+            created_at = now()
+            msg_ids = add_room_messages(session, room_id, user_id,
+                                        data.get('msgs'), created_at)
+        messages = [{'ID': msg_id, 'Message': msg}
+                    for msg_id, msg in zip(msg_ids, data.get('msgs'))]
+        for message in messages:
+            hub.publish(room_id, {**message_event(
+                room_id, user_id, user_name, message['Message'], created_at),
+                'ID': message['ID']})
+        return ok_response(message='Messages are successfully send!',
+                           **member_info(user_id, user_name, room_id,
+                                         new_token.get('Authorization')),
+                           Messages=messages)
     return error_response(message=val, status_code=400)
 
 
+@app.route('/stream/room/<int:room_id>', methods=['GET'])
+@authorization
+def stream_room(room_id):
+    user_id = int(request.headers.get('user_id'))
+    if not membership.is_member(user_id, room_id):
+        return error_response(
+            message='You are not joined to the conversation!',
+            status_code=403)
+    subscription = hub.subscribe(room_id)
+    keep_alive = app.config['STREAM_KEEP_ALIVE']
+
+    def events():
+        try:
+            yield b': connected\n\n'
+            while True:
+                event = subscription.get(timeout=keep_alive)
+                if event is None:
+                    yield b': keep-alive\n\n'
+                else:
+                    yield b'event: message\ndata: ' + json_dumps(event) + \
+                        b'\n\n'
+        finally:
+            subscription.close()
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+@app.route('/history/room/<int:room_id>', methods=['GET'])
+@authorization
+def room_history(room_id):
+    before, limit, error = history_args(request.args, app.config)
+    if error:
+        return error_response(message=error, status_code=400)
+    user_id = int(request.headers.get('user_id'))
+    ref_token = refresh_security_token().json
+    new_token = ref_token.get('info', {}).get('data')
+    with Session.begin() as session:
+        if not membership.is_member(user_id, room_id):
+            return error_response(
+                message='You are not joined to the conversation!',
+                status_code=403)
+        messages = [message_info(msg) for msg in get_room_history(
+            session, room_id, before=before, limit=limit)]
+    if len(messages) < limit:
+        # The older part of the history may have moved to the archive.
+        messages += [message_info(msg) for msg in message_archive.history(
+            room_id, before=messages[-1]['ID'] if messages else before,
+            limit=limit - len(messages))]
+    return ok_response(message='Success!', Room=room_id,
+                       **history_info(messages, limit),
+                       Authorization=new_token.get('Authorization'))
+
+
+@app.route('/export/room/<int:room_id>', methods=['GET'])
+@authorization
+def export_room_messages(room_id):
+    user_id = int(request.headers.get('user_id'))
+    if not membership.is_member(user_id, room_id):
+        return error_response(
+            message='You are not joined to the conversation!',
+            status_code=403)
+    compress = wants_gzip(request.headers.get('Accept-Encoding'))
+    return Response(export_room(Session, message_archive, room_id, compress,
+                                app.config['EXPORT_CHUNK_ROWS']),
+                    mimetype=EXPORT_CONTENT_TYPE,
+                    headers=export_headers(room_id, compress))
+
+
+@app.route('/import', methods=['POST'])
+def import_history():
+    if not import_allowed(request.headers.get('import_token')):
+        return error_response(message='Invalid import token!',
+                              status_code=403)
+    importer = Importer(Session, request.args.get('source', 'default'),
+                        config.IMPORT_BATCH_ROWS)
+    try:
+        stats = importer.run(request.stream)
+    except ImportRecordError as ex:
+        return error_response(message=str(ex), status_code=400)
+    return ok_response(message='History imported!', **stats.as_dict())
+
+
+@app.route('/search/room/<int:room_id>', methods=['GET'])
+@authorization
+def search_room(room_id):
+    query, limit, offset, error = search_args(request.args, app.config)
+    if error:
+        return error_response(message=error, status_code=400)
+    user_id = int(request.headers.get('user_id'))
+    ref_token = refresh_security_token().json
+    new_token = ref_token.get('info', {}).get('data')
+    with Session.begin() as session:
+        if not membership.is_member(user_id, room_id):
+            return error_response(
+                message='You are not joined to the conversation!',
+                status_code=403)
+        results = search_room_messages(session, room_id, query, limit=limit,
+                                       offset=offset)
+        page = search_results_info(results, limit, offset)
+    return ok_response(message='Success!', Room=room_id, Query=query,
+                       **page, Authorization=new_token.get('Authorization'))
+
+
+@app.route('/mark_read', methods=['POST'])
+@authorization
+def mark_read():
+    data = request.get_json()
+    val = validation_check(data, MarkReadCheck)
+    ref_token = refresh_security_token().json
+    new_token = ref_token.get('info', {}).get('data')
+    if not val:
+        with Session.begin() as session:
+            conv_user = get_conv_user_by_ids(session, data.get('user_id'),
+                                             data.get('room_id'))
+            if not conv_user:
+                return error_response(
+                    message='You are not joined to the conversation!',
+                    status_code=404)
+            cursor = mark_room_read(session, conv_user, data.get('msg_id'))
+            return ok_response(
+                message='Room marked as read!',
+                **read_cursor_info(conv_user.conversation_id, cursor,
+                                   new_token.get('Authorization')))
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/room_retention', methods=['POST'])
+@authorization
+def room_retention():
+    data = request.get_json()
+    val = validation_check(data, RetentionCheck)
+    ref_token = refresh_security_token().json
+    new_token = ref_token.get('info', {}).get('data')
+    if not val:
+        if not membership.is_member(data.get('user_id'), data.get('room_id')):
+            return error_response(
+                message='You are not joined to the conversation!',
+                status_code=403)
+        with Session.begin() as session:
+            set_room_retention(session, data.get('room_id'), data.get('days'))
+        return ok_response(message='Retention updated!', **{
+            'Room': data.get('room_id'), 'Retention_days': data.get('days'),
+            'Authorization': new_token.get('Authorization')})
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/unread/user_id/<int:user_id>', methods=['GET'])
+@authorization
+def unread_counts(user_id):
+    ref_token = refresh_security_token().json
+    new_token = ref_token.get('info', {}).get('data')
+    with Session.begin() as session:
+        unread = {row.room_id: row.unread_count
+                  for row in get_unread_counts(session, user_id)}
+    return ok_response(message='Success!',
+                       **{'Unread': unread, 'User_id': user_id,
+                          'Authorization': new_token.get('Authorization')})
+
+
 @app.route('/list_con/user_id/<int:user_id>', methods=['GET'])
 @authorization
 def lst_of_conversations(user_id):
-    conv_data = {}
     ref_token = refresh_security_token().json
     new_token = ref_token.get('info', {}).get('data')
     with Session.begin() as session:
@@ -263,18 +782,16 @@ def lst_of_conversations(user_id):
         if not user:
             return error_response(message='User does not exist!',
                                   status_code=404)
-        conv_user = get_all_conv_user_by_user_id(session, user.id)
-        if not conv_user:
+        summaries = get_room_summaries(session, user.id)
+        if not summaries:
             return error_response(
                 message=f'Room for the user {user.nick_name} does not'
                         f' exist!',
                 status_code=404)
         try:
-            for all_con in conv_user:
-                conv_data['Room {0}'.format(
-                    all_con.id)] = all_con.conversation.conversation_name
             return ok_response(message='Success!',
-                               **{'Conversations_info': {'rooms': conv_data},
+                               **{'Conversations_info':
+                                  room_summaries_info(summaries),
                                   'User_id': user.id,
                                   'Authorization': new_token.get(
                                       'Authorization')})
@@ -293,17 +810,14 @@ def delete_conversation(user_id, conv_id):
         if not user:
             return error_response(message='User does not exist',
                                   status_code=404)
-        conv_users = get_all_conv_user_by_user_id(session, user.id)
-        for conv_user_lst in conv_users:
-            if conv_user_lst.conversation_id == conv_id:
-                delete_conversation_by_id(session, conv_id)
-                session.commit()
-                return ok_response(message='Conversation deleted!', **{
-                    'User_ID': user.id,
-                    'Authorization': new_token.get('Authorization')})
-        return error_response(
-            message='Room already deleted or doesnt exist!',
-            status_code=404)
+        if not membership.is_member(user.id, conv_id):
+            return error_response(
+                message='Room already deleted or doesnt exist!',
+                status_code=404)
+        delete_conversation_by_id(session, conv_id)
+    room_purger.wake()
+    return ok_response(message='Conversation deleted!', **{
+        'User_ID': user_id, 'Authorization': new_token.get('Authorization')})
 
 
 @app.route('/delete_msg/user_id/<int:user_id>/msg_id/<int:msg_id>',
@@ -323,16 +837,13 @@ def delete_message(user_id, msg_id):
             return error_response(
                 message=f'Message by the id: {user_id} does not exist '
                         f'for the user: {user.nick_name} ', status_code=404)
-        for msg_lst in join_msg:
-            if msg_lst.id == msg_id:
-                delete_msg_by_msg_id(session, msg_id)
-                session.commit()
-                return ok_response(message='Message deleted!', **{
-                    'User_ID': user.id,
-                    'Authorization': new_token.get('Authorization')})
-        return error_response(
-            message='Message already deleted or doesnt exist!',
-            status_code=404)
+        if msg_id not in {msg_lst.id for msg_lst in join_msg}:
+            return error_response(
+                message='Message already deleted or doesnt exist!',
+                status_code=404)
+        delete_msg_by_msg_id(session, msg_id)
+    return ok_response(message='Message deleted!', **{
+        'User_ID': user_id, 'Authorization': new_token.get('Authorization')})
 
 
 if __name__ == '__main__':
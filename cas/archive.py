@@ -0,0 +1,350 @@
+"""
+Cold storage for old messages. Rooms with a retention period have their
+older messages moved out of the messages tables into gzip compressed
+NDJSON segments on local disk, one per room and month (or any other
+strftime bucket set in ARCHIVE_BUCKET_FORMAT):
+
+    <ARCHIVE_DIR>/room_<id>/<yyyy-mm>.ndjson.gz
+    <ARCHIVE_DIR>/room_<id>/index.json
+
+Segments are append only, every archiver pass adds a gzip member to them.
+The index lists the id range and size of every segment, and the offset and
+id range of each of its members so a history page only decompresses the
+members it is read from. It is replaced atomically once the appended data
+is on disk, the rows are only deleted after that. A pass interrupted in
+between is repeated, already archived ids are skipped on write and on
+read.
+
+    python -m cas.archive
+
+runs a single pass in the foreground and prints the progress.
+"""
+import argparse
+import atexit
+import functools
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import zlib
+from collections import (
+    deque,
+    namedtuple,
+)
+from datetime import (
+    datetime,
+    timedelta,
+)
+from cas import config
+from cas.database import (
+    Session,
+    delete_room_messages,
+    get_expired_room_messages,
+    get_room_retentions,
+)
+
+logger = logging.getLogger(__name__)
+
+ArchivedMessage = namedtuple('ArchivedMessage',
+                             'id sender_id msg created_at')
+INDEX_FILE = 'index.json'
+
+
+def parse_message(line: str) -> ArchivedMessage:
+    record = json.loads(line)
+    return ArchivedMessage(record['id'], record['sender_id'], record['msg'],
+                           datetime.fromisoformat(record['created_at']))
+
+
+def iter_segment(path: str):
+    """
+    Messages of a segment in id order, read as a stream. Ids written twice
+    by an interrupted pass and a member still being appended are skipped.
+    """
+    last_id = 0
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as segment:
+            for line in segment:
+                message = parse_message(line)
+                if message.id <= last_id:
+                    continue
+                last_id = message.id
+                yield message
+    except (EOFError, gzip.BadGzipFile, zlib.error, ValueError):
+        return
+
+
+def read_member(path: str, member: dict) -> list:
+    """
+    Messages of a single gzip member of a segment in id order.
+    :param member: dict with offset, size, min_id and max_id from the index
+    """
+    with open(path, 'rb') as segment:
+        segment.seek(member['offset'])
+        data = gzip.decompress(segment.read(member['size']))
+    return [parse_message(line)
+            for line in data.decode('utf-8').splitlines()]
+
+
+class MessageArchive:
+
+    def __init__(self, root: str, bucket_format: str = '%Y-%m'):
+        self.root = root
+        self.bucket_format = bucket_format
+        self._lock = threading.Lock()
+
+    def room_dir(self, room_id: int) -> str:
+        return os.path.join(self.root, f'room_{room_id}')
+
+    def index(self, room_id: int) -> list:
+        """
+        Segments of the room ordered by id, each a dict with bucket, file,
+        min_id, max_id, count and members, the members are missing from
+        the segments written before they were recorded.
+        """
+        try:
+            with open(os.path.join(self.room_dir(room_id), INDEX_FILE)) as f:
+                return json.load(f)['segments']
+        except FileNotFoundError:
+            return []
+
+    def _write_index(self, room_id: int, segments: list):
+        path = os.path.join(self.room_dir(room_id), INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segments': segments}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def append(self, room_id: int, messages: list) -> int:
+        """
+        Append the messages, ordered by id, to the segments of their bucket.
+        :param room_id:
+        :param messages: objects with id, sender_id, msg and created_at
+        :return: number of messages written
+        """
+        with self._lock:
+            os.makedirs(self.room_dir(room_id), exist_ok=True)
+            segments = {segment['bucket']: segment
+                        for segment in self.index(room_id)}
+            buckets = {}
+            for message in messages:
+                bucket = message.created_at.strftime(self.bucket_format)
+                segment = segments.get(bucket)
+                if segment is None or message.id > segment['max_id']:
+                    buckets.setdefault(bucket, []).append(message)
+            for bucket, batch in buckets.items():
+                segment = segments.setdefault(bucket, {
+                    'bucket': bucket, 'file': f'{bucket}.ndjson.gz',
+                    'min_id': batch[0].id, 'max_id': 0, 'count': 0,
+                    'members': []})
+                lines = ''.join(json.dumps({
+                    'id': message.id, 'sender_id': message.sender_id,
+                    'msg': message.msg,
+                    'created_at': message.created_at.isoformat()}) + '\n'
+                    for message in batch)
+                data = gzip.compress(lines.encode('utf-8'))
+                path = os.path.join(self.room_dir(room_id), segment['file'])
+                with open(path, 'ab') as f:
+                    # Past whatever an interrupted pass left behind.
+                    offset = f.tell()
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if 'members' in segment:
+                    segment['members'].append({
+                        'offset': offset, 'size': len(data),
+                        'min_id': batch[0].id, 'max_id': batch[-1].id})
+                segment['max_id'] = batch[-1].id
+                segment['count'] += len(batch)
+            if buckets:
+                self._write_index(room_id, sorted(
+                    segments.values(), key=lambda segment: segment['min_id']))
+            return sum(len(batch) for batch in buckets.values())
+
+    def history(self, room_id: int, before: int = None,
+                limit: int = 50) -> list:
+        """
+        Archived messages of the room newest first, paged like
+        get_room_history. The id ranges of the segments overlap when old
+        messages were imported into a room later, so the members are merged
+        by id. A member is only read once it may hold the next message.
+        :return: list of ArchivedMessage
+        """
+        def upper(max_id):
+            return max_id if before is None else min(max_id, before - 1)
+
+        sources = []
+        for segment in self.index(room_id):
+            if before is not None and segment['min_id'] >= before:
+                continue
+            path = os.path.join(self.room_dir(room_id), segment['file'])
+            if 'members' not in segment:
+                sources.append((upper(segment['max_id']), functools.partial(
+                    self._stream_history, path, segment, before, limit)))
+                continue
+            for member in segment['members']:
+                if before is None or member['min_id'] < before:
+                    sources.append((upper(member['max_id']), functools.partial(
+                        self._member_history, path, member, before)))
+        sources.sort(key=lambda source: source[0], reverse=True)
+        # Max heap of the messages read and not returned yet.
+        pending = []
+        order = itertools.count()
+        messages = []
+        while len(messages) < limit:
+            while sources and (not pending or
+                               sources[0][0] > -pending[0][0]):
+                _, read = sources.pop(0)
+                for message in read():
+                    heapq.heappush(pending,
+                                   (-message.id, next(order), message))
+            if not pending:
+                break
+            _, _, message = heapq.heappop(pending)
+            if not messages or messages[-1].id != message.id:
+                messages.append(message)
+        return messages
+
+    @staticmethod
+    def _member_history(path: str, member: dict, before: int) -> list:
+        return [message for message in read_member(path, member)
+                if before is None or message.id < before]
+
+    @staticmethod
+    def _stream_history(path: str, segment: dict, before: int,
+                        limit: int) -> list:
+        """
+        The newest messages of a segment without recorded members, at most
+        `limit` of them are held while it is streamed.
+        """
+        newest = deque(maxlen=limit)
+        for message in iter_segment(path):
+            if message.id > segment['max_id'] or (
+                    before is not None and message.id >= before):
+                break
+            newest.append(message)
+        return list(reversed(newest))
+
+    def iter_room(self, room_id: int):
+        """
+        Every archived message of the room oldest first, without caching
+        whole segments.
+        """
+        for segment in self.index(room_id):
+            path = os.path.join(self.room_dir(room_id), segment['file'])
+            for message in iter_segment(path):
+                if message.id > segment['max_id']:
+                    break
+                yield message
+
+    def remove_room(self, room_id: int):
+        with self._lock:
+            shutil.rmtree(self.room_dir(room_id), ignore_errors=True)
+
+
+class Archiver:
+    """
+    Moves the messages past the retention of their room into the archive,
+    `chunk_size` messages per transaction. Rooms without a retention of
+    their own use `default_days`, None keeps their messages forever. Runs
+    every `interval` seconds from a background thread once started.
+    """
+
+    def __init__(self, archive: MessageArchive, session_factory=Session,
+                 chunk_size: int = 5000, default_days: int = None,
+                 interval: float = 3600, on_progress=None):
+        self.archive = archive
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.default_days = default_days
+        self.interval = interval
+        self.on_progress = on_progress
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='cas-archiver', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def archive_expired(self, now: datetime = None) -> int:
+        """
+        One pass over every room.
+        :param now: reference time of the retention periods
+        :return: number of messages archived
+        """
+        now = now or datetime.now()
+        with self.session_factory() as session:
+            rooms = get_room_retentions(session)
+        total = 0
+        for room_id, days in rooms:
+            days = days or self.default_days
+            if days and not self._stopping.is_set():
+                total += self.archive_room(room_id,
+                                           now - timedelta(days=days))
+        return total
+
+    def archive_room(self, room_id: int, cutoff: datetime) -> int:
+        total = 0
+        while not self._stopping.is_set():
+            with self.session_factory.begin() as session:
+                messages = get_expired_room_messages(session, room_id, cutoff,
+                                                     self.chunk_size)
+                if not messages:
+                    break
+                self.archive.append(room_id, messages)
+                delete_room_messages(session, room_id,
+                                     [message.id for message in messages],
+                                     cutoff)
+            total += len(messages)
+            if self.on_progress is not None:
+                self.on_progress(room_id, total)
+        if total:
+            logger.info('Archived %d messages of room %d', total, room_id)
+        return total
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.archive_expired()
+            except Exception:
+                logger.exception('Archiving expired messages failed')
+            self._stopping.wait(self.interval)
+
+
+message_archive = MessageArchive(config.ARCHIVE_DIR,
+                                 config.ARCHIVE_BUCKET_FORMAT)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Archive the expired messages once.')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    def report(room_id, total):
+        print(f'room {room_id}: {total} messages archived', flush=True)
+
+    archiver = Archiver(message_archive, chunk_size=args.chunk_size,
+                        default_days=config.ARCHIVE_RETENTION_DAYS or None,
+                        on_progress=report)
+    print(f'{archiver.archive_expired()} messages archived')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,894 @@
+"""
+Asyncio serving mode, the endpoints of cas.app on Quart with the database
+accessed through SQLAlchemy's AsyncSession. Handlers await the database
+instead of holding a worker thread, so one process can keep many more
+requests in flight.
+
+    pip install quart asyncpg  # or aiosqlite
+    hypercorn cas.async_app:app
+
+It shares the configuration, the schema bootstrap, the room hub, the
+message writer and the checks of the query strings and the bodies of the
+replies with cas.app, only the database access differs. With SQLite point DATABASE_URL at a file, an
+in-memory database is not shared between the sync and async engines.
+"""
+import asyncio
+import logging
+import time
+from functools import wraps
+from quart import (
+    Quart,
+    Response,
+    g,
+    request,
+)
+from sqlalchemy.exc import IntegrityError
+from cas import (
+    config,
+    metrics,
+)
+from cas.app import (
+    app as flask_app,
+    export_headers,
+    history_args,
+    history_info,
+    import_allowed,
+    member_info,
+    message_event,
+    read_cursor_info,
+    room_created_info,
+    search_args,
+    search_results_info,
+    sent_message_info,
+    message_writer,
+    password_hasher,
+    room_purger,
+    room_summaries_info,
+)
+from cas.async_database import (
+    async_session,
+    dispose_async_engine,
+    add_user,
+    add_conversation,
+    add_room_message,
+    add_room_messages,
+    add_room_member,
+    remove_room_member,
+    get_user_by_email,
+    get_user_by_id,
+    update_user_password,
+    get_conv_user_by_ids,
+    get_idempotent_messages,
+    get_message_by_user_id,
+    get_conversation_by_id,
+    get_conversation_by_room_name,
+    get_room_history,
+    get_room_summaries,
+    get_unread_counts,
+    mark_room_read,
+    set_room_retention,
+    delete_conversation_by_id,
+    join_user_msg,
+    delete_msg_by_msg_id,
+)
+from cas.archive import message_archive
+from cas.database import room_messages_select
+from cas.export import (
+    CONTENT_TYPE as EXPORT_CONTENT_TYPE,
+    ChunkEncoder,
+    archived_batches,
+    wants_gzip,
+)
+from cas.idempotency import (
+    HEADER as IDEMPOTENCY_HEADER,
+    REPLAYED_HEADER as IDEMPOTENT_REPLAYED_HEADER,
+    SentMessage,
+    key_error as idempotency_key_error,
+    recall as recall_sent_message,
+    remember as remember_sent_message,
+    remember_when_stored,
+)
+from cas.importer import (
+    ImportRecordError,
+    Importer,
+)
+from cas.ingest import IngestQueueFull
+from cas.membership import membership
+from cas.passwords import PasswordHasherBusy
+from cas.pubsub import hub
+from cas.ratelimit import (
+    rate_limiter,
+    request_room_id,
+    retry_after,
+)
+from cas.search import (
+    search_index,
+    search_room_messages,
+)
+from cas.utils import (
+    acts_as,
+    cache_key_word,
+    error_data,
+    json_dumps,
+    json_response,
+    message_info,
+    now,
+    ok_data,
+    rotate_security_token,
+    token_needs_refresh,
+    token_payload,
+    verify_cached_security_token,
+)
+from cas.validation import (
+    RegisterUserCheck,
+    RoomCheck,
+    RoomJoinLeave,
+    MessageCheck,
+    MessagesCheck,
+    MarkReadCheck,
+    RetentionCheck,
+    validation_check,
+)
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.config.from_mapping(flask_app.config)
+
+
+def ok_response(message, status_code=200, **additional_data):
+    return json_response(ok_data(message, status_code, **additional_data),
+                         Response)
+
+
+def error_response(message, status_code):
+    return json_response(error_data(message, status_code), Response)
+
+
+async def is_member(session, user_id: int, room_id: int) -> bool:
+    """
+    Async counterpart of MembershipIndex.is_member, the miss is confirmed
+    through the async session.
+    """
+    if membership.contains(user_id, room_id):
+        return True
+    found = await get_conv_user_by_ids(session, user_id, room_id) is not None
+    membership.confirm(user_id, room_id, found)
+    return found
+
+
+async def run_hasher(method, *args):
+    """
+    Submits from a worker thread, waiting for a free slot of the password
+    hasher must not block the event loop.
+    """
+    future = await asyncio.to_thread(method, *args)
+    return await asyncio.wrap_future(future)
+
+
+async def verify_security_token(user_id: int, auth_token: str):
+    payload = verify_cached_security_token(user_id, auth_token)
+    if payload is not None:
+        return payload
+    async with async_session() as session:
+        user = await get_user_by_id(session, user_id)
+        if not user or not user.key_word:
+            return None
+        key_word = user.key_word
+    cache_key_word(user_id, key_word)
+    return token_payload(user_id, auth_token, key_word)
+
+
+async def refresh_security_token() -> str:
+    """
+    The function will return the token the client should use next.
+    """
+    if not token_needs_refresh(g.auth_payload):
+        return request.headers.get('authorization')
+    async with async_session() as session, session.begin():
+        _, token = await session.run_sync(rotate_security_token,
+                                          g.auth_user_id)
+    return token
+
+
+def authorization(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        try:
+            user_id = int(request.headers.get('user_id'))
+            auth_token = request.headers.get('authorization')
+            payload = await verify_security_token(user_id, auth_token)
+        except Exception:
+            logger.exception('Verifying the security token failed')
+            payload = None
+        if payload is None:
+            metrics.auth_failures.inc()
+            return error_response(
+                message=f'Authorization error: wrong security-token',
+                status_code=401)
+        if not acts_as(user_id, request.view_args,
+                       await request.get_json(silent=True)):
+            metrics.auth_failures.inc()
+            return error_response(
+                message='Authorization error: user_id does not match the '
+                        'security-token',
+                status_code=403)
+        g.auth_payload = payload
+        g.auth_user_id = user_id
+        return await f(*args, **kwargs)
+
+    return decorated
+
+
+async def check_rate_limit(route: str, **ids):
+    """
+    A shared backend is asked from a worker thread.
+    :return: the 429 response, or None when the request is let through
+    """
+    if rate_limiter.backend.blocking:
+        scope, wait = await asyncio.to_thread(rate_limiter.check, route,
+                                              **ids)
+    else:
+        scope, wait = rate_limiter.check(route, **ids)
+    if scope is None:
+        return None
+    response = error_response(message='Too many requests, try again later!',
+                              status_code=429)
+    response.headers.update(retry_after(route, scope, wait))
+    return response
+
+
+def limit_address(route: str):
+    """
+    Async counterpart of cas.ratelimit.limit_address.
+    """
+    def decorator(f):
+        @wraps(f)
+        async def decorated(*args, **kwargs):
+            response = await check_rate_limit(route,
+                                              address=request.remote_addr)
+            if response is not None:
+                return response
+            return await f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+def rate_limit(route: str):
+    """
+    Async counterpart of cas.ratelimit.rate_limit.
+    """
+    def decorator(f):
+        @wraps(f)
+        async def decorated(*args, **kwargs):
+            room_id = request_room_id(request.view_args,
+                                      await request.get_json(silent=True))
+            response = await check_rate_limit(
+                route, user_id=g.auth_user_id, room_id=room_id)
+            if response is not None:
+                return response
+            return await f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+@app.before_serving
+async def warm_membership():
+    await asyncio.to_thread(membership.warm)
+
+
+@app.after_serving
+async def dispose_engine():
+    await dispose_async_engine()
+
+
+@app.before_request
+async def before_request():
+    g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+async def after_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.record_request(route, request.method,
+                           metrics.response_status(response),
+                           time.perf_counter() - g.metrics_start)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_view():
+    return Response(metrics.registry.render(),
+                    content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/register', methods=['POST'])
+async def register():
+    data = await request.get_json()
+    val = validation_check(data, RegisterUserCheck)
+    if not val:
+        async with async_session() as session:
+            if await get_user_by_email(session, data.get('email')):
+                return error_response(message='Email already exist!',
+                                      status_code=400)
+        try:
+            password = await run_hasher(password_hasher.hash,
+                                        data.get('password'))
+        except PasswordHasherBusy:
+            return error_response(message='Server is busy, try again!',
+                                  status_code=503)
+        try:
+            async with async_session() as session, session.begin():
+                await add_user(session, {**data, 'password': password})
+        except IntegrityError:
+            return error_response(message='Email already exist!',
+                                  status_code=400)
+        return ok_response(message='User created!', **{
+            'User_info': {'Nick_name': data.get('nick_name'),
+                          'User_email': data.get('email')}})
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+    async with async_session() as session:
+        user = await get_user_by_email(session, data.get('email'))
+        if not user:
+            return error_response(message='User does no exist!',
+                                  status_code=404)
+        user_id, encoded = user.id, user.password
+    password = data.get('password') or ''
+    try:
+        if not await run_hasher(password_hasher.verify, password, encoded):
+            return error_response(message='Wrong password!',
+                                  status_code=401)
+        rehashed = None
+        if password_hasher.needs_rehash(encoded):
+            rehashed = await run_hasher(password_hasher.hash, password)
+    except PasswordHasherBusy:
+        return error_response(message='Server is busy, try again!',
+                              status_code=503)
+    async with async_session() as session, session.begin():
+        if rehashed:
+            await update_user_password(session, user_id, encoded, rehashed)
+        try:
+            user_id, token = await session.run_sync(rotate_security_token,
+                                                    user_id)
+        except BaseException as ex:
+            return error_response(message=f'Error: {ex}', status_code=500)
+    return ok_response(message='Success!', **{
+        'User_info': {'User_id': user_id, 'Authorization': token}})
+
+
+@app.route('/create_room', methods=['POST'])
+@limit_address('create_room')
+@authorization
+@rate_limit('create_room')
+async def create_room():
+    data = await request.get_json()
+    val = validation_check(data, RoomCheck)
+    new_token = await refresh_security_token()
+    if not val:
+        async with async_session() as session, session.begin():
+            user = await get_user_by_id(session, data.get('user_id'))
+            if not user:
+                return error_response(message='User nickname does not exist!',
+                                      status_code=404)
+            conv = await get_conversation_by_room_name(
+                session, data.get('room_name'))
+            if conv:
+                return error_response(
+                    message='Conversation room already exist!',
+                    status_code=400)
+            await add_conversation(session, data)
+            conv = await get_conversation_by_room_name(
+                session, data.get('room_name'))
+            if not conv:
+                return error_response(
+                    message='Conversation room does not exist!',
+                    status_code=404)
+            if await get_conv_user_by_ids(session, user.id, conv.id):
+                return error_response(message='You are already joined!',
+                                      status_code=400)
+            await add_room_member(session, user.id, conv.id)
+        return ok_response(message='Room created!', **room_created_info(
+            user.id, user.nick_name, user.email, conv.id,
+            conv.conversation_name, new_token))
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/join_room', methods=['POST'])
+@limit_address('join_room')
+@authorization
+@rate_limit('join_room')
+async def join_room():
+    data = await request.get_json()
+    val = validation_check(data, RoomJoinLeave)
+    new_token = await refresh_security_token()
+    if not val:
+        async with async_session() as session, session.begin():
+            user = await get_user_by_id(session, data.get('user_id'))
+            if not user:
+                return error_response(message='User does not exist!',
+                                      status_code=404)
+            conv = await get_conversation_by_id(session, data.get('room_id'))
+            if not conv:
+                return error_response(message='Room does not exist!',
+                                      status_code=404)
+            if membership.contains(user.id, conv.id):
+                return error_response(message='You are already joined!',
+                                      status_code=400)
+            try:
+                await add_room_member(session, user.id, conv.id)
+                await session.flush()
+            except IntegrityError:
+                # Joined through another worker.
+                await session.rollback()
+                return error_response(message='You are already joined!',
+                                      status_code=400)
+        return ok_response(
+            message=f'You joined the room: {data.get("room_id")}',
+            **member_info(user.id, user.nick_name, data.get('room_id'),
+                          new_token))
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/leave_room', methods=['DELETE'])
+@authorization
+async def leave_room():
+    data = await request.get_json()
+    val = validation_check(data, RoomJoinLeave)
+    new_token = await refresh_security_token()
+    if not val:
+        async with async_session() as session, session.begin():
+            user = await get_user_by_id(session, data.get('user_id'))
+            if not user:
+                return error_response(message='User does not exist!',
+                                      status_code=404)
+            if not await remove_room_member(session, user.id,
+                                            data.get('room_id')):
+                return error_response(
+                    message=f'Room for the user {user.nick_name} does not '
+                            f'exist!',
+                    status_code=404)
+        return ok_response(
+            message=f'You leaved the room: {data.get("room_id")}',
+            **member_info(user.id, user.nick_name, data.get('room_id'),
+                          new_token))
+    return error_response(message=val, status_code=400)
+
+
+async def find_sent_message(session, user_id: int, user_name: str,
+                            key: str) -> SentMessage:
+    row = (await get_idempotent_messages(session, [(user_id, key)])).get(
+        (user_id, key))
+    if row is None:
+        return None
+    sent = SentMessage(row.id, row.room_id, row.msg, user_name)
+    remember_sent_message(user_id, key, sent)
+    return sent
+
+
+def replay_sent_message(user_id: int, sent: SentMessage, data: dict,
+                        token: str):
+    if not sent.matches(data.get('room_id'), data.get('msg')):
+        return error_response(
+            message=f'{IDEMPOTENCY_HEADER} was used for another message!',
+            status_code=422)
+    response = ok_response(message='Message is successfully send!',
+                           **sent_message_info(user_id, sent, token))
+    response.headers[IDEMPOTENT_REPLAYED_HEADER] = 'true'
+    return response
+
+
+@app.route('/send_msg', methods=['POST'])
+@limit_address('send_msg')
+@authorization
+@rate_limit('send_msg')
+async def send_msg():
+    data = await request.get_json()
+    val = validation_check(data, MessageCheck)
+    new_token = await refresh_security_token()
+    if not val:
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        key_error = idempotency_key_error(key)
+        if key_error:
+            return error_response(message=key_error, status_code=400)
+        sent = recall_sent_message(data.get('user_id'), key) if key else None
+        if sent is not None:
+            return replay_sent_message(data.get('user_id'), sent, data,
+                                       new_token)
+        ingest_mode = app.config['INGEST_MODE']
+        try:
+            async with async_session() as session, session.begin():
+                user = await get_user_by_id(session, data.get('user_id'))
+                if not user:
+                    return error_response(message='User does not exist!',
+                                          status_code=404)
+                user_id = user.id
+                user_name = user.nick_name
+                room_id = data.get('room_id')
+                if not await is_member(session, user_id, room_id):
+                    return error_response(
+                        message='You are not joined to the conversation!',
+                        status_code=404)
+                if key is not None:
+                    sent = await find_sent_message(session, user_id,
+                                                   user_name, key)
+                    if sent is not None:
+                        return replay_sent_message(user_id, sent, data,
+                                                   new_token)
+                created_at = now()
+                event = message_event(room_id, user_id, user_name,
+                                      data.get('msg'), created_at)
+                if ingest_mode == 'off':
+                    msg_id = await add_room_message(
+                        session, room_id, user_id, data.get('msg'),
+                        created_at, idempotency_key=key)
+        except IntegrityError:
+            if key is None:
+                raise
+            # Sent with the same key through another request at once.
+            async with async_session() as session:
+                sent = await find_sent_message(session, user_id, user_name,
+                                               key)
+            if sent is None:
+                raise
+            return replay_sent_message(user_id, sent, data, new_token)
+        if ingest_mode == 'off':
+            hub.publish(room_id, {**event, 'ID': msg_id})
+            if key is not None:
+                remember_sent_message(user_id, key, SentMessage(
+                    msg_id, room_id, data.get('msg'), user_name))
+        else:
+            try:
+                stored = message_writer.submit(room_id, user_id,
+                                               data.get('msg'), created_at,
+                                               event=event,
+                                               idempotency_key=key)
+            except IngestQueueFull:
+                return error_response(
+                    message='Server is busy, try again later!',
+                    status_code=503)
+            if key is not None:
+                remember_when_stored(stored, user_id, key, room_id,
+                                     data.get('msg'), user_name)
+            if ingest_mode == 'flush':
+                try:
+                    await asyncio.wrap_future(stored)
+                except Exception as ex:
+                    return error_response(message=f'Error: {ex}',
+                                          status_code=500)
+        return ok_response(message='Message is successfully send!',
+                           **member_info(user_id, user_name,
+                                         data.get('room_id'), new_token),
+                           Message=data.get('msg'))
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/send_msgs', methods=['POST'])
+@limit_address('send_msgs')
+@authorization
+@rate_limit('send_msgs')
+async def send_msgs():
+    data = await request.get_json()
+    val = validation_check(data, MessagesCheck)
+    new_token = await refresh_security_token()
+    if not val:
+        async with async_session() as session, session.begin():
+            user = await get_user_by_id(session, data.get('user_id'))
+            if not user:
+                return error_response(message='User does not exist!',
+                                      status_code=404)
+            room_id = data.get('room_id')
+            if not await is_member(session, user.id, room_id):
+                return error_response(
+                    message='You are not joined to the conversation!',
+                    status_code=404)
+            created_at = now()
+            msg_ids = await add_room_messages(session, room_id, user.id,
+                                              data.get('msgs'), created_at)
+        messages = [{'ID': msg_id, 'Message': msg}
+                    for msg_id, msg in zip(msg_ids, data.get('msgs'))]
+        for message in messages:
+            hub.publish(room_id, {**message_event(
+                room_id, user.id, user.nick_name, message['Message'],
+                created_at), 'ID': message['ID']})
+        return ok_response(message='Messages are successfully send!',
+                           **member_info(user.id, user.nick_name, room_id,
+                                         new_token),
+                           Messages=messages)
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/stream/room/<int:room_id>', methods=['GET'])
+@authorization
+async def stream_room(room_id):
+    async with async_session() as session:
+        if not await is_member(session, g.auth_user_id, room_id):
+            return error_response(
+                message='You are not joined to the conversation!',
+                status_code=403)
+    subscription = await hub.subscribe_async(room_id)
+    keep_alive = app.config['STREAM_KEEP_ALIVE']
+
+    async def events():
+        try:
+            yield b': connected\n\n'
+            while True:
+                event = await subscription.get_async(timeout=keep_alive)
+                if event is None:
+                    yield b': keep-alive\n\n'
+                else:
+                    yield b'event: message\ndata: ' + json_dumps(event) + \
+                        b'\n\n'
+        finally:
+            subscription.close()
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+
+@app.route('/history/room/<int:room_id>', methods=['GET'])
+@authorization
+async def room_history(room_id):
+    before, limit, error = history_args(request.args, app.config)
+    if error:
+        return error_response(message=error, status_code=400)
+    new_token = await refresh_security_token()
+    async with async_session() as session:
+        if not await is_member(session, g.auth_user_id, room_id):
+            return error_response(
+                message='You are not joined to the conversation!',
+                status_code=403)
+        messages = [message_info(msg) for msg in await get_room_history(
+            session, room_id, before=before, limit=limit)]
+    if len(messages) < limit:
+        archived = await asyncio.to_thread(
+            message_archive.history, room_id,
+            before=messages[-1]['ID'] if messages else before,
+            limit=limit - len(messages))
+        messages += [message_info(msg) for msg in archived]
+    return ok_response(message='Success!', Room=room_id,
+                       **history_info(messages, limit),
+                       Authorization=new_token)
+
+
+async def export_room(room_id: int, compress: bool, chunk_rows: int):
+    """
+    Async counterpart of cas.export.export_room, the archive is read from
+    a worker thread and the rows through an async server side cursor.
+    """
+    encoder = ChunkEncoder(compress)
+    batches = archived_batches(message_archive, room_id, chunk_rows)
+    last_id = 0
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        last_id = batch[-1].id
+        data = encoder.feed(batch)
+        if data:
+            yield data
+    async with async_session() as session:
+        result = await session.stream(room_messages_select(
+            room_id, last_id).execution_options(yield_per=chunk_rows))
+        async for rows in result.partitions():
+            data = encoder.feed(rows)
+            if data:
+                yield data
+    yield encoder.finish()
+
+
+@app.route('/export/room/<int:room_id>', methods=['GET'])
+@authorization
+async def export_room_messages(room_id):
+    async with async_session() as session:
+        if not await is_member(session, g.auth_user_id, room_id):
+            return error_response(
+                message='You are not joined to the conversation!',
+                status_code=403)
+    compress = wants_gzip(request.headers.get('Accept-Encoding'))
+    response = Response(export_room(room_id, compress,
+                                    app.config['EXPORT_CHUNK_ROWS']),
+                        mimetype=EXPORT_CONTENT_TYPE,
+                        headers=export_headers(room_id, compress))
+    response.timeout = None
+    return response
+
+
+async def request_lines():
+    rest = b''
+    async for chunk in request.body:
+        *lines, rest = (rest + chunk).split(b'\n')
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+@app.route('/import', methods=['POST'])
+async def import_history():
+    if not import_allowed(request.headers.get('import_token')):
+        return error_response(message='Invalid import token!',
+                              status_code=403)
+    importer = Importer(source=request.args.get('source', 'default'),
+                        batch_rows=config.IMPORT_BATCH_ROWS)
+    skip = await asyncio.to_thread(importer.start)
+    batch = []
+    number = 0
+    try:
+        async for line in request_lines():
+            number += 1
+            if number <= skip:
+                continue
+            batch.append(line)
+            if len(batch) == importer.batch_rows:
+                await asyncio.to_thread(importer.write_batch, batch, number)
+                batch = []
+        if batch:
+            await asyncio.to_thread(importer.write_batch, batch, number)
+    except ImportRecordError as ex:
+        return error_response(message=str(ex), status_code=400)
+    finally:
+        await asyncio.to_thread(importer.finish)
+    return ok_response(message='History imported!',
+                       **importer.stats.as_dict())
+
+
+@app.route('/search/room/<int:room_id>', methods=['GET'])
+@authorization
+async def search_room(room_id):
+    query, limit, offset, error = search_args(request.args, app.config)
+    if error:
+        return error_response(message=error, status_code=400)
+    new_token = await refresh_security_token()
+    async with async_session() as session:
+        if not await is_member(session, g.auth_user_id, room_id):
+            return error_response(
+                message='You are not joined to the conversation!',
+                status_code=403)
+        if session.bind.dialect.name != 'postgresql':
+            # The in-process index loads a room on its first search and
+            # catches it up before the next ones through the sync engine,
+            # keep that off the event loop.
+            await asyncio.to_thread(search_index.room, room_id)
+        results = await session.run_sync(search_room_messages, room_id,
+                                         query, limit=limit, offset=offset)
+    return ok_response(message='Success!', Room=room_id, Query=query,
+                       **search_results_info(results, limit, offset),
+                       Authorization=new_token)
+
+
+@app.route('/mark_read', methods=['POST'])
+@authorization
+async def mark_read():
+    data = await request.get_json()
+    val = validation_check(data, MarkReadCheck)
+    new_token = await refresh_security_token()
+    if not val:
+        async with async_session() as session, session.begin():
+            conv_user = await get_conv_user_by_ids(
+                session, data.get('user_id'), data.get('room_id'))
+            if not conv_user:
+                return error_response(
+                    message='You are not joined to the conversation!',
+                    status_code=404)
+            cursor = await mark_room_read(session, conv_user,
+                                          data.get('msg_id'))
+        return ok_response(
+            message='Room marked as read!',
+            **read_cursor_info(conv_user.conversation_id, cursor,
+                               new_token))
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/room_retention', methods=['POST'])
+@authorization
+async def room_retention():
+    data = await request.get_json()
+    val = validation_check(data, RetentionCheck)
+    new_token = await refresh_security_token()
+    if not val:
+        async with async_session() as session, session.begin():
+            if not await is_member(session, data.get('user_id'),
+                                   data.get('room_id')):
+                return error_response(
+                    message='You are not joined to the conversation!',
+                    status_code=403)
+            await set_room_retention(session, data.get('room_id'),
+                                     data.get('days'))
+        return ok_response(message='Retention updated!', **{
+            'Room': data.get('room_id'), 'Retention_days': data.get('days'),
+            'Authorization': new_token})
+    return error_response(message=val, status_code=400)
+
+
+@app.route('/unread/user_id/<int:user_id>', methods=['GET'])
+@authorization
+async def unread_counts(user_id):
+    new_token = await refresh_security_token()
+    async with async_session() as session:
+        unread = {row.room_id: row.unread_count
+                  for row in await get_unread_counts(session, user_id)}
+    return ok_response(message='Success!',
+                       **{'Unread': unread, 'User_id': user_id,
+                          'Authorization': new_token})
+
+
+@app.route('/list_con/user_id/<int:user_id>', methods=['GET'])
+@authorization
+async def lst_of_conversations(user_id):
+    new_token = await refresh_security_token()
+    async with async_session() as session:
+        user = await get_user_by_id(session, user_id)
+        if not user:
+            return error_response(message='User does not exist!',
+                                  status_code=404)
+        summaries = await get_room_summaries(session, user.id)
+        if not summaries:
+            return error_response(
+                message=f'Room for the user {user.nick_name} does not'
+                        f' exist!',
+                status_code=404)
+    return ok_response(message='Success!',
+                       **{'Conversations_info':
+                          room_summaries_info(summaries),
+                          'User_id': user.id,
+                          'Authorization': new_token})
+
+
+@app.route('/delete_con/user_id/<int:user_id>/conv_id/<int:conv_id>',
+           methods=['DELETE'])
+@authorization
+async def delete_conversation(user_id, conv_id):
+    new_token = await refresh_security_token()
+    async with async_session() as session, session.begin():
+        user = await get_user_by_id(session, user_id)
+        if not user:
+            return error_response(message='User does not exist',
+                                  status_code=404)
+        if not await is_member(session, user.id, conv_id):
+            return error_response(
+                message='Room already deleted or doesnt exist!',
+                status_code=404)
+        await delete_conversation_by_id(session, conv_id)
+    room_purger.wake()
+    return ok_response(message='Conversation deleted!', **{
+        'User_ID': user.id, 'Authorization': new_token})
+
+
+@app.route('/delete_msg/user_id/<int:user_id>/msg_id/<int:msg_id>',
+           methods=['DELETE'])
+@authorization
+async def delete_message(user_id, msg_id):
+    new_token = await refresh_security_token()
+    async with async_session() as session, session.begin():
+        user = await get_user_by_id(session, user_id)
+        if not user:
+            return error_response(message='User does not exist',
+                                  status_code=404)
+        if not await get_message_by_user_id(session, user_id):
+            return error_response(
+                message=f'Message by the id: {user_id} does not exist '
+                        f'for the user: {user.nick_name} ', status_code=404)
+        if msg_id not in {msg.id for msg in await join_user_msg(session,
+                                                                user_id)}:
+            return error_response(
+                message='Message already deleted or doesnt exist!',
+                status_code=404)
+        await delete_msg_by_msg_id(session, msg_id)
+    return ok_response(message='Message deleted!', **{
+        'User_ID': user.id, 'Authorization': new_token})
+
+
+if __name__ == '__main__':
+    app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,160 @@
+"""
+Async versions of the helpers in cas.database for the asyncio serving mode.
+Needs an asyncio driver: asyncpg for PostgreSQL, aiosqlite for SQLite.
+"""
+import threading
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.pool import (
+    AsyncAdaptedQueuePool,
+    StaticPool,
+)
+from cas import (
+    config,
+    database,
+)
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def async_url(url: str = None):
+    """
+    The function will swap the driver of the url for its asyncio one.
+    :param url: defaults to config.DATABASE_URL
+    :return: URL
+    """
+    url = make_url(url or config.DATABASE_URL)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No asyncio driver known for {backend}')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_async_database_engine(url: str = None, **settings) -> AsyncEngine:
+    """
+    Async counterpart of cas.database.create_database_engine, it reads the
+    same configuration.
+    """
+    url = async_url(url)
+    options = {
+        'pool_size': config.DB_POOL_SIZE,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': config.DB_POOL_TIMEOUT,
+        'pool_pre_ping': config.DB_POOL_PRE_PING,
+        'pool_recycle': config.DB_POOL_RECYCLE,
+        'echo': config.DB_ECHO,
+    }
+    statement_timeout = settings.pop('statement_timeout',
+                                     config.DB_STATEMENT_TIMEOUT)
+    options.update(settings)
+    connect_args = {}
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            for key in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(key)
+            options['poolclass'] = StaticPool
+        else:
+            options['poolclass'] = AsyncAdaptedQueuePool
+    elif statement_timeout:
+        connect_args['server_settings'] = {
+            'statement_timeout': str(statement_timeout)}
+    engine = create_async_engine(url, connect_args=connect_args, **options)
+    if url.get_backend_name() == 'sqlite':
+        event.listen(engine.sync_engine, 'connect',
+                     database.set_sqlite_pragmas)
+    return engine
+
+
+def get_async_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_async_database_engine()
+    return _engine
+
+
+async def configure_async_engine(url: str = None,
+                                 **settings) -> AsyncEngine:
+    """
+    Replace the engine, e.g. to point the app at another database.
+    """
+    global _engine
+    await dispose_async_engine()
+    _engine = create_async_database_engine(url, **settings)
+    return _engine
+
+
+async def dispose_async_engine():
+    """
+    Close the pooled connections, the next use creates a new engine.
+    """
+    global _engine
+    engine, _engine = _engine, None
+    if engine is not None:
+        await engine.dispose()
+
+
+def async_session() -> AsyncSession:
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+
+def _async_helper(helper):
+    """
+    Run the sync helper through AsyncSession.run_sync, the statements are
+    the same and the IO is awaited on the event loop.
+    """
+
+    @wraps(helper)
+    async def wrapper(session: AsyncSession, *args, **kwargs):
+        return await session.run_sync(helper, *args, **kwargs)
+
+    return wrapper
+
+
+add_user = _async_helper(database.add_user)
+get_user_by_id = _async_helper(database.get_user_by_id)
+get_user_by_email = _async_helper(database.get_user_by_email)
+get_user_by_name = _async_helper(database.get_user_by_name)
+update_user = _async_helper(database.update_user)
+update_user_password = _async_helper(database.update_user_password)
+update_conversation = _async_helper(database.update_conversation)
+get_conversation_by_room_name = _async_helper(
+    database.get_conversation_by_room_name)
+get_all_users = _async_helper(database.get_all_users)
+bump_unread_counts = _async_helper(database.bump_unread_counts)
+insert_room_messages = _async_helper(database.insert_room_messages)
+add_room_messages = _async_helper(database.add_room_messages)
+add_room_message = _async_helper(database.add_room_message)
+get_idempotent_messages = _async_helper(database.get_idempotent_messages)
+get_message_by_msg = _async_helper(database.get_message_by_msg)
+get_message_by_user_id = _async_helper(database.get_message_by_user_id)
+add_conversation = _async_helper(database.add_conversation)
+latest_room_message_id = _async_helper(database.latest_room_message_id)
+add_room_member = _async_helper(database.add_room_member)
+remove_room_member = _async_helper(database.remove_room_member)
+mark_room_read = _async_helper(database.mark_room_read)
+set_room_retention = _async_helper(database.set_room_retention)
+get_unread_counts = _async_helper(database.get_unread_counts)
+get_conv_user_by_ids = _async_helper(database.get_conv_user_by_ids)
+get_conv_user_by_user_id = _async_helper(database.get_conv_user_by_user_id)
+get_all_conv_user_by_user_id = _async_helper(
+    database.get_all_conv_user_by_user_id)
+get_room_summaries = _async_helper(database.get_room_summaries)
+get_conversation_by_id = _async_helper(database.get_conversation_by_id)
+delete_conversation_by_id = _async_helper(database.delete_conversation_by_id)
+delete_message_by_id = _async_helper(database.delete_message_by_id)
+get_room_history = _async_helper(database.get_room_history)
+join_user_msg = _async_helper(database.join_user_msg)
+delete_msg_by_msg_id = _async_helper(database.delete_msg_by_msg_id)
@@ -0,0 +1,98 @@
+"""
+Full room exports as NDJSON, one message per line in id order, the
+archived messages first. Rows are read in batches of `chunk_rows` through
+a server side cursor and sent as soon as about `flush_bytes` are encoded,
+optionally gzip compressed on the fly, so memory stays flat whatever the
+size of the room.
+"""
+import zlib
+from cas.archive import MessageArchive
+from cas.database import room_messages_select
+from cas.utils import (
+    json_dumps,
+    message_info,
+)
+
+CONTENT_TYPE = 'application/x-ndjson'
+
+
+def wants_gzip(accept_encoding: str) -> bool:
+    return any(coding.split(';')[0].strip() == 'gzip'
+               for coding in (accept_encoding or '').split(','))
+
+
+class ChunkEncoder:
+    """
+    Encodes messages to NDJSON and groups them into chunks of about
+    `flush_bytes`, gzip compressed when `compress` is set.
+    """
+
+    def __init__(self, compress: bool = False, flush_bytes: int = 65536,
+                 level: int = 6):
+        self.flush_bytes = flush_bytes
+        self._compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 31) if compress else None
+        self._lines = []
+        self._size = 0
+
+    def feed(self, messages) -> bytes:
+        """
+        :return: the next chunk, or b'' while it is still filling up
+        """
+        for msg in messages:
+            line = json_dumps(message_info(msg)) + b'\n'
+            self._lines.append(line)
+            self._size += len(line)
+        if self._size < self.flush_bytes:
+            return b''
+        return self._drain()
+
+    def finish(self) -> bytes:
+        data = self._drain()
+        if self._compressor is not None:
+            data += self._compressor.flush()
+        return data
+
+    def _drain(self) -> bytes:
+        data = b''.join(self._lines)
+        self._lines.clear()
+        self._size = 0
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        return data
+
+
+def archived_batches(archive: MessageArchive, room_id: int,
+                     chunk_rows: int = 1000):
+    batch = []
+    for message in archive.iter_room(room_id):
+        batch.append(message)
+        if len(batch) == chunk_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_room(session_factory, archive: MessageArchive, room_id: int,
+                compress: bool = False, chunk_rows: int = 1000):
+    """
+    Generator of the export body, opens its own session so it can outlive
+    the request handler.
+    """
+    encoder = ChunkEncoder(compress)
+    last_id = 0
+    for batch in archived_batches(archive, room_id, chunk_rows):
+        last_id = batch[-1].id
+        data = encoder.feed(batch)
+        if data:
+            yield data
+    with session_factory() as session:
+        # Rows archived by an interrupted pass are still in the table.
+        result = session.execute(room_messages_select(
+            room_id, last_id).execution_options(yield_per=chunk_rows))
+        for rows in result.partitions():
+            data = encoder.feed(rows)
+            if data:
+                yield data
+    yield encoder.finish()
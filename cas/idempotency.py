@@ -0,0 +1,60 @@
+"""
+Idempotency keys of send_msg. A client sends an Idempotency-Key header and
+the same one with every retry of the message. The message is stored once,
+the key is unique per sender in the messages table, and the retries get the
+original response back with an Idempotent-Replayed header.
+
+Recently used keys are also kept in memory, so a retry is normally answered
+without a query. A key missing there, after a restart or on another worker,
+is looked up in the database before the message is stored.
+"""
+from collections import namedtuple
+from cas import config
+from cas.cache import TTLCache
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 64
+
+
+class SentMessage(namedtuple('SentMessage', 'id room_id msg user_name')):
+
+    def matches(self, room_id: int, msg: str) -> bool:
+        return self.room_id == room_id and self.msg == msg
+
+
+sent_messages = TTLCache(maxsize=config.IDEMPOTENCY_CACHE_SIZE,
+                         ttl=config.IDEMPOTENCY_CACHE_TTL)
+
+
+def key_error(key: str):
+    """
+    :return: error message for a malformed key, None for a valid or
+        missing one
+    """
+    if key is not None and not (
+            0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()):
+        return f'{HEADER} must be 1 to {MAX_KEY_LENGTH} printable ' \
+               f'characters!'
+    return None
+
+
+def recall(sender_id: int, key: str) -> SentMessage:
+    return sent_messages.get((sender_id, key))
+
+
+def remember(sender_id: int, key: str, sent: SentMessage):
+    sent_messages.set((sender_id, key), sent)
+
+
+def remember_when_stored(future, sender_id: int, key: str, room_id: int,
+                         msg: str, user_name: str):
+    """
+    Remember a message queued on the message writer once it is stored.
+    """
+    def done(stored):
+        if stored.exception() is None:
+            remember(sender_id, key, SentMessage(stored.result(), room_id,
+                                                 msg, user_name))
+
+    future.add_done_callback(done)
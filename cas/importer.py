@@ -0,0 +1,337 @@
+"""
+Bulk import of users, rooms, memberships and messages from another chat
+system. The input is NDJSON, one record per line:
+
+    {"type": "user", "id": "u1", "nick_name": "pero", "email": "p@x.com"}
+    {"type": "room", "id": "r1", "name": "general"}
+    {"type": "member", "user": "u1", "room": "r1"}
+    {"type": "message", "room": "r1", "sender": "u1", "msg": "Hi",
+     "created_at": "2021-05-04T10:00:00"}
+
+Records may only refer to users and rooms on earlier lines. Lines are
+written `batch_rows` at a time, with COPY on PostgreSQL and executemany
+elsewhere. Each batch is one transaction, and that transaction also
+stores the external to internal id map and a checkpoint of the last line
+of the batch. So an import that is run again for the same source resumes
+after the last committed batch.
+
+Users and rooms that already exist, by email and by name, are reused.
+Imported users get an unusable password. Imported history counts as read
+for the imported members.
+
+    python -m cas.importer export.ndjson.gz --source oldchat
+"""
+import argparse
+import gzip
+import json
+import sys
+import time
+from datetime import datetime
+from cas.database import (
+    Conversation,
+    ConversationMessage,
+    ConversationUser,
+    ImportCheckpoint,
+    ImportId,
+    Message,
+    ReadCursor,
+    Session,
+    User,
+    allocate_ids,
+    bulk_insert,
+    catch_up_read_cursors,
+    record_membership_change,
+)
+from cas.search import search_index
+from cas.passwords import unusable_password
+from cas.validation import (
+    ImportMemberCheck,
+    ImportMessageCheck,
+    ImportRoomCheck,
+    ImportUserCheck,
+    validation_check,
+)
+
+KINDS = ('user', 'room', 'member', 'message')
+# Required fields and column lengths of each kind of record, checked
+# before any of a batch is written.
+CHECKS = {'user': ImportUserCheck, 'room': ImportRoomCheck,
+          'member': ImportMemberCheck, 'message': ImportMessageCheck}
+
+
+class ImportRecordError(Exception):
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f'Line {line}: {message}')
+        self.line = line
+
+
+class ImportStats:
+
+    def __init__(self, resumed_from: int = 0):
+        self.resumed_from = resumed_from
+        self.lines = resumed_from
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def rows(self) -> int:
+        # Memberships also write a read cursor and messages a room link.
+        return self.counts['user'] + self.counts['room'] + \
+            2 * (self.counts['member'] + self.counts['message'])
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {'Users': self.counts['user'], 'Rooms': self.counts['room'],
+                'Members': self.counts['member'],
+                'Messages': self.counts['message'], 'Lines': self.lines,
+                'Resumed_from': self.resumed_from, 'Rows': self.rows,
+                'Seconds': round(self.seconds, 3),
+                'Rows_per_second': round(self.rows_per_second, 1)}
+
+
+class Importer:
+    """
+    start() loads the id map and returns the number of input lines to
+    skip, write_batch() stores the following lines and finish() closes the
+    import. run() does all three for an iterable of lines.
+    """
+
+    def __init__(self, session_factory=Session, source: str = 'default',
+                 batch_rows: int = 5000, on_progress=None):
+        self.session_factory = session_factory
+        self.source = source
+        self.batch_rows = batch_rows
+        self.on_progress = on_progress
+        self.ids = {'user': {}, 'room': {}}
+        self.rooms = set()
+        self.stats = None
+
+    def start(self) -> int:
+        with self.session_factory() as session:
+            for kind, external_id, internal_id in session.query(
+                    ImportId.kind, ImportId.external_id,
+                    ImportId.internal_id).filter(
+                    ImportId.source == self.source):
+                self.ids[kind][external_id] = internal_id
+            checkpoint = session.get(ImportCheckpoint, self.source)
+        self.stats = ImportStats(checkpoint.line if checkpoint else 0)
+        return self.stats.resumed_from
+
+    def run(self, lines) -> ImportStats:
+        skip = self.start()
+        batch = []
+        number = 0
+        try:
+            for number, line in enumerate(lines, 1):
+                if number <= skip:
+                    continue
+                batch.append(line)
+                if len(batch) == self.batch_rows:
+                    self.write_batch(batch, number)
+                    batch = []
+            if batch:
+                self.write_batch(batch, number)
+        finally:
+            # Also for the batches committed before a failure.
+            self.finish()
+        return self.stats
+
+    def write_batch(self, lines: list, last_line: int):
+        """
+        :param lines: raw NDJSON lines
+        :param last_line: number of the last of them in the input
+        :raise ImportRecordError: the batch is not written
+        """
+        records = {kind: [] for kind in KINDS}
+        first_line = last_line - len(lines) + 1
+        for number, line in enumerate(lines, first_line):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                checker = CHECKS[record['type']]
+            except (ValueError, KeyError, TypeError) as ex:
+                raise ImportRecordError(number, f'not a valid record: {ex}')
+            error = validation_check(record, checker)
+            if error:
+                raise ImportRecordError(number, error)
+            records[record['type']].append((number, record))
+        ids = {kind: dict(mapping) for kind, mapping in self.ids.items()}
+        with self.session_factory.begin() as session:
+            # Written first, so SQLite takes its write lock before ids are
+            # allocated.
+            session.merge(ImportCheckpoint(source=self.source,
+                                           line=last_line))
+            session.flush()
+            counts = {
+                'user': self._users(session, records['user'], ids),
+                'room': self._rooms(session, records['room'], ids),
+                'member': self._members(session, records['member'], ids),
+                'message': self._messages(session, records['message'], ids),
+            }
+        self.ids = ids
+        for kind, count in counts.items():
+            self.stats.counts[kind] += count
+        self.stats.lines = last_line
+        self.stats.seconds = time.perf_counter() - self.stats.started
+        if self.on_progress is not None:
+            self.on_progress(self.stats)
+
+    def finish(self) -> ImportStats:
+        """
+        Mark the imported history as read and make the search index
+        reload the rooms.
+        """
+        if self.rooms:
+            with self.session_factory.begin() as session:
+                catch_up_read_cursors(session, list(self.rooms))
+            for room_id in self.rooms:
+                search_index.drop(room_id)
+        self.stats.seconds = time.perf_counter() - self.stats.started
+        return self.stats
+
+    def _map(self, session, kind: str, pairs: list):
+        bulk_insert(session, ImportId, [
+            {'source': self.source, 'kind': kind, 'external_id': external_id,
+             'internal_id': internal_id}
+            for external_id, internal_id in pairs])
+
+    @staticmethod
+    def _resolve(ids: dict, kind: str, number: int, external_id):
+        internal_id = ids[kind].get(str(external_id))
+        if internal_id is None:
+            raise ImportRecordError(number, f'unknown {kind} {external_id}')
+        return internal_id
+
+    def _users(self, session, records: list, ids: dict) -> int:
+        new = {}
+        for number, record in records:
+            external_id = str(record['id'])
+            if external_id not in ids['user']:
+                new.setdefault(record['email'], (external_id, record))
+        if not new:
+            return 0
+        existing = dict(session.query(User.email, User.id).filter(
+            User.email.in_(list(new))))
+        rows = [record for email, (_, record) in new.items()
+                if email not in existing]
+        user_ids = allocate_ids(session, User, len(rows))
+        existing.update((record['email'], user_id)
+                        for record, user_id in zip(rows, user_ids))
+        bulk_insert(session, User, [
+            {'id': user_id, 'nick_name': record['nick_name'],
+             'email': record['email'],
+             'password': unusable_password()}
+            for record, user_id in zip(rows, user_ids)])
+        pairs = [(external_id, existing[email])
+                 for email, (external_id, _) in new.items()]
+        self._map(session, 'user', pairs)
+        ids['user'].update(pairs)
+        return len(rows)
+
+    def _rooms(self, session, records: list, ids: dict) -> int:
+        new = {}
+        for number, record in records:
+            external_id = str(record['id'])
+            if external_id not in ids['room']:
+                new.setdefault(record['name'], external_id)
+        if not new:
+            return 0
+        existing = dict(session.query(
+            Conversation.conversation_name, Conversation.id).filter(
+            Conversation.conversation_name.in_(list(new)),
+            Conversation.deleted_at.is_(None)))
+        names = [name for name in new if name not in existing]
+        room_ids = allocate_ids(session, Conversation, len(names))
+        existing.update(zip(names, room_ids))
+        bulk_insert(session, Conversation, [
+            {'id': room_id, 'conversation_name': name}
+            for name, room_id in zip(names, room_ids)])
+        pairs = [(external_id, existing[name])
+                 for name, external_id in new.items()]
+        self._map(session, 'room', pairs)
+        ids['room'].update(pairs)
+        return len(names)
+
+    def _members(self, session, records: list, ids: dict) -> int:
+        pairs = {}
+        for number, record in records:
+            pair = (self._resolve(ids, 'user', number, record['user']),
+                    self._resolve(ids, 'room', number, record['room']))
+            pairs.setdefault(pair, None)
+        if not pairs:
+            return 0
+        rooms = {room_id for _, room_id in pairs}
+        existing = set(session.query(
+            ConversationUser.user_id, ConversationUser.conversation_id).filter(
+            ConversationUser.conversation_id.in_(rooms)))
+        new = [pair for pair in pairs if pair not in existing]
+        member_ids = allocate_ids(session, ConversationUser, len(new))
+        bulk_insert(session, ConversationUser, [
+            {'id': member_id, 'user_id': user_id, 'conversation_id': room_id}
+            for member_id, (user_id, room_id) in zip(member_ids, new)])
+        bulk_insert(session, ReadCursor, [
+            {'conversation_user_id': member_id, 'last_read_message_id': None,
+             'unread_count': 0} for member_id in member_ids])
+        for user_id, room_id in new:
+            record_membership_change(session, 'join', user_id, room_id)
+        self.rooms.update(rooms)
+        return len(new)
+
+    def _messages(self, session, records: list, ids: dict) -> int:
+        if not records:
+            return 0
+        msg_ids = allocate_ids(session, Message, len(records))
+        messages = []
+        links = []
+        for msg_id, (number, record) in zip(msg_ids, records):
+            room_id = self._resolve(ids, 'room', number, record['room'])
+            sender = record.get('sender')
+            try:
+                created_at = datetime.fromisoformat(record['created_at'])
+            except (KeyError, TypeError, ValueError):
+                raise ImportRecordError(number, 'created_at is missing or '
+                                                'not ISO 8601')
+            messages.append({
+                'id': msg_id, 'msg': record['msg'], 'created_at': created_at,
+                'sender_id': None if sender is None else self._resolve(
+                    ids, 'user', number, sender)})
+            links.append({'conversation_id': room_id, 'message_id': msg_id,
+                          'created_at': created_at})
+            self.rooms.add(room_id)
+        bulk_insert(session, Message, messages)
+        bulk_insert(session, ConversationMessage, links)
+        return len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import chat history.')
+    parser.add_argument('path', help='NDJSON file, .gz or - for stdin')
+    parser.add_argument('--source', default='default',
+                        help='name of the import, its checkpoint and id map')
+    parser.add_argument('--batch-rows', type=int, default=5000)
+    args = parser.parse_args()
+
+    def report(stats):
+        print(f'line {stats.lines}: {stats.rows} rows, '
+              f'{stats.rows_per_second:.0f} rows/s', flush=True)
+
+    if args.path == '-':
+        lines = sys.stdin.buffer
+    elif args.path.endswith('.gz'):
+        lines = gzip.open(args.path, 'rb')
+    else:
+        lines = open(args.path, 'rb')
+    with lines:
+        stats = Importer(source=args.source, batch_rows=args.batch_rows,
+                         on_progress=report).run(lines)
+    print(json.dumps(stats.as_dict()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import (
+    defaultdict,
+    namedtuple,
+)
+from concurrent.futures import Future
+from cas.database import (
+    get_idempotent_messages,
+    insert_room_messages,
+)
+
+logger = logging.getLogger(__name__)
+
+PendingMessage = namedtuple(
+    'PendingMessage',
+    'room_id sender_id msg created_at event future idempotency_key')
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class MessageWriter:
+    """
+    Write-behind queue for incoming messages. A single writer thread
+    gathers the queued messages and stores them in one transaction every
+    `flush_interval` seconds or as soon as `batch_rows` are waiting, so a
+    burst of messages costs one commit instead of one per request.
+    """
+
+    def __init__(self, session_factory, flush_interval: float = 0.005,
+                 batch_rows: int = 500, queue_size: int = 10000,
+                 submit_timeout: float = 0.1, on_commit=None):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.batch_rows = batch_rows
+        self.submit_timeout = submit_timeout
+        self.on_commit = on_commit
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='cas-message-writer',
+                    daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout: float = None):
+        """
+        Flush whatever is still queued and stop the writer thread.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, room_id: int, sender_id: int, msg: str, created_at,
+               event: dict = None, idempotency_key: str = None) -> Future:
+        """
+        Queue the message for the next flush.
+        :param room_id:
+        :param sender_id:
+        :param msg:
+        :param created_at:
+        :param event: passed to on_commit once the message is stored
+        :param idempotency_key: a message already stored under the key is
+            not stored again, the future gets its id
+        :return: future resolved with the message id after the flush
+        :raise IngestQueueFull: when the queue stays full for submit_timeout
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        future = Future()
+        try:
+            self._queue.put(PendingMessage(room_id, sender_id, msg,
+                                           created_at, event, future,
+                                           idempotency_key),
+                            timeout=self.submit_timeout)
+        except queue.Full:
+            raise IngestQueueFull('Message queue is full')
+        return future
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: list):
+        """
+        Store the batch in one transaction. When that fails every message
+        is stored again in a transaction of its own, so only the futures of
+        the ones that fail by themselves get the error.
+        """
+        try:
+            stored, repeated = self._store(batch)
+        except Exception as ex:
+            if len(batch) == 1:
+                logger.exception('Storing a message failed')
+                batch[0].future.set_exception(ex)
+            else:
+                logger.warning('Flushing %d messages failed, storing them '
+                               'one by one', len(batch), exc_info=True)
+                for item in batch:
+                    self._flush([item])
+            return
+        keyed = {(item.sender_id, item.idempotency_key): msg_id
+                 for item, msg_id in stored
+                 if item.idempotency_key is not None}
+        for item, msg_id in stored:
+            item.future.set_result(msg_id)
+        for item, msg_id in repeated:
+            item.future.set_result(msg_id or keyed[
+                (item.sender_id, item.idempotency_key)])
+        if self.on_commit is not None:
+            try:
+                self.on_commit(stored)
+            except Exception:
+                logger.exception('Message writer on_commit hook failed')
+
+    def _store(self, batch: list) -> tuple:
+        """
+        :return: the stored messages with their ids, and the repeated ones
+            as returned by split_repeated
+        """
+        stored = []
+        with self.session_factory.begin() as session:
+            fresh, repeated = split_repeated(session, batch)
+            rooms = defaultdict(list)
+            for item in fresh:
+                rooms[item.room_id].append(item)
+            for room_id, items in rooms.items():
+                msg_ids = insert_room_messages(session, room_id, [
+                    {'msg': item.msg, 'created_at': item.created_at,
+                     'sender_id': item.sender_id,
+                     'idempotency_key': item.idempotency_key}
+                    for item in items])
+                stored.extend(zip(items, msg_ids))
+        return stored, repeated
+
+
+def split_repeated(session, batch: list) -> tuple:
+    """
+    Separate the messages whose idempotency key is already stored, or used
+    by an earlier message of the batch.
+    :return: the messages to store, and the repeated ones with the id of
+        the stored message or None when it is stored by this batch
+    """
+    existing = get_idempotent_messages(session, [
+        (item.sender_id, item.idempotency_key) for item in batch
+        if item.idempotency_key is not None])
+    fresh = []
+    repeated = []
+    seen = set()
+    for item in batch:
+        key = (item.sender_id, item.idempotency_key)
+        if item.idempotency_key is None:
+            fresh.append(item)
+        elif key in existing:
+            repeated.append((item, existing[key].id))
+        elif key in seen:
+            repeated.append((item, None))
+        else:
+            seen.add(key)
+            fresh.append(item)
+    return fresh, repeated
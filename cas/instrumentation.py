@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from flask import (
+    Flask,
+    current_app,
+    g,
+    has_request_context,
+    request,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from cas.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    SQL statements executed while serving a single request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.statements[statement] += 1
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+
+class RouteStats:
+    """
+    SQL statements aggregated over every request of a route.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def add(self, stats: QueryStats):
+        self.requests += 1
+        self.statements += stats.count
+        self.total += stats.total
+        if stats.slowest > self.slowest:
+            self.slowest = stats.slowest
+            self.slowest_statement = stats.slowest_statement
+
+    def as_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'statements': self.statements,
+            'statements_per_request': self.statements / self.requests,
+            'db_time_ms': self.total * 1000,
+            'slowest_ms': self.slowest * 1000,
+            'slowest_statement': self.slowest_statement,
+        }
+
+
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if has_request_context():
+        context.cas_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = getattr(context, 'cas_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats = g.get('query_stats')
+    if stats is None:
+        stats = g.query_stats = QueryStats()
+    stats.record(statement, elapsed)
+
+
+def route_stats() -> dict:
+    """
+    The function will return the SQL statistics of every route served so
+    far.
+    :return: dict of route -> stats (dict)
+    """
+    with _routes_lock:
+        return {route: stats.as_dict() for route, stats in _routes.items()}
+
+
+def reset_route_stats():
+    with _routes_lock:
+        _routes.clear()
+
+
+def _collect_route_stats():
+    stats = route_stats()
+    yield ('cas_db_statements_total', 'counter',
+           'SQL statements executed by the route.',
+           [('cas_db_statements_total', {'route': route}, s['statements'])
+            for route, s in stats.items()])
+    yield ('cas_db_time_seconds_total', 'counter',
+           'Time the route spent executing SQL statements.',
+           [('cas_db_time_seconds_total', {'route': route},
+             s['db_time_ms'] / 1000) for route, s in stats.items()])
+
+
+registry.add_collector(_collect_route_stats)
+
+
+def _after_request(response):
+    stats = g.get('query_stats') or QueryStats()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    with _routes_lock:
+        _routes.setdefault(route, RouteStats()).add(stats)
+    threshold = current_app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    for statement, count in stats.statements.items():
+        if threshold and count >= threshold:
+            logger.warning('Possible N+1 on %s, statement executed %d times: '
+                           '%s', route, count, statement)
+    if current_app.debug or current_app.config['SQL_STATS_HEADERS']:
+        response.headers['X-DB-Statements'] = str(stats.count)
+        response.headers['X-DB-Time-ms'] = f'{stats.total * 1000:.3f}'
+        response.headers['X-DB-Slowest-ms'] = f'{stats.slowest * 1000:.3f}'
+    return response
+
+
+def init_app(app: Flask):
+    """
+    Record the SQL statements of every request served by the app.
+    SQL_N_PLUS_ONE_THRESHOLD is the number of executions of the same
+    statement within one request that gets logged, 0 disables the check.
+    """
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', int(
+        os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5)))
+    app.config.setdefault('SQL_STATS_HEADERS', False)
+    app.after_request(_after_request)
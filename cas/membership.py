@@ -0,0 +1,166 @@
+"""
+Process-local index of the room memberships, so the hot paths can check
+whether a user is in a room without a query.
+
+It is loaded from ConversationUser on first use and follows the joins,
+leaves and room deletions committed in this process. Memberships changed
+by other processes are not seen right away. Negative answers are
+confirmed against the database, so a join made elsewhere is picked up on
+its first use. Positive ones are confirmed again once they are older than
+MEMBERSHIP_TTL seconds, so a leave or a room deletion made elsewhere is
+seen within that time.
+"""
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from cas import config
+from cas.database import (
+    ConversationUser,
+    Session,
+    get_conv_user_by_ids,
+)
+
+
+class MembershipIndex:
+    """
+    :param ttl: seconds a membership is answered from memory after it was
+        last confirmed by the database, 0 for as long as it is indexed
+    """
+
+    def __init__(self, session_factory=Session, chunk_size: int = 10000,
+                 ttl: float = config.MEMBERSHIP_TTL, timer=time.monotonic):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.timer = timer
+        self._rooms = {}
+        # user_id -> {room_id: when the membership was last confirmed}
+        self._users = {}
+        self._warm = False
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """
+        Load every membership, the lock is held meanwhile so changes
+        committed during the load are applied after it.
+        """
+        if self._warm:
+            return
+        with self._lock:
+            if self._warm:
+                return
+            last_id = 0
+            loaded_at = self.timer()
+            with self.session_factory() as session:
+                while True:
+                    rows = session.query(
+                        ConversationUser.id, ConversationUser.user_id,
+                        ConversationUser.conversation_id
+                    ).filter(ConversationUser.id > last_id).order_by(
+                        ConversationUser.id).limit(self.chunk_size).all()
+                    for _, user_id, room_id in rows:
+                        self._add(user_id, room_id, loaded_at)
+                    if len(rows) < self.chunk_size:
+                        break
+                    last_id = rows[-1][0]
+            self._warm = True
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._users.clear()
+            self._warm = False
+
+    def contains(self, user_id: int, room_id: int) -> bool:
+        """
+        Answered from memory only, False for a membership due to be
+        confirmed again.
+        """
+        self.warm()
+        confirmed_at = self._users.get(user_id, {}).get(room_id)
+        return confirmed_at is not None and (
+            not self.ttl or self.timer() - confirmed_at < self.ttl)
+
+    def is_member(self, user_id: int, room_id: int) -> bool:
+        """
+        Answered from memory, a miss or an expired membership is confirmed
+        against the database.
+        :param user_id:
+        :param room_id:
+        :return: bool
+        """
+        if self.contains(user_id, room_id):
+            return True
+        with self.session_factory() as session:
+            found = get_conv_user_by_ids(session, user_id, room_id) is not None
+        self.confirm(user_id, room_id, found)
+        return found
+
+    def confirm(self, user_id: int, room_id: int, found: bool):
+        """
+        Record the answer of the database for the membership.
+        """
+        if found:
+            self.add(user_id, room_id)
+        else:
+            self.remove(user_id, room_id)
+
+    # Unlike contains, members and rooms never expire their answers.
+    def members(self, room_id: int) -> frozenset:
+        self.warm()
+        return frozenset(self._rooms.get(room_id, ()))
+
+    def rooms(self, user_id: int) -> frozenset:
+        self.warm()
+        return frozenset(self._users.get(user_id, ()))
+
+    def add(self, user_id: int, room_id: int):
+        with self._lock:
+            if self._warm:
+                self._add(user_id, room_id, self.timer())
+
+    def remove(self, user_id: int, room_id: int):
+        with self._lock:
+            self._remove(user_id, room_id)
+
+    def remove_room(self, room_id: int):
+        with self._lock:
+            for user_id in self._rooms.get(room_id, set()).copy():
+                self._remove(user_id, room_id)
+
+    def _add(self, user_id: int, room_id: int, confirmed_at: float):
+        self._rooms.setdefault(room_id, set()).add(user_id)
+        self._users.setdefault(user_id, {})[room_id] = confirmed_at
+
+    def _remove(self, user_id: int, room_id: int):
+        users = self._rooms.get(room_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._rooms[room_id]
+        rooms = self._users.get(user_id)
+        if rooms is not None:
+            rooms.pop(room_id, None)
+            if not rooms:
+                del self._users[user_id]
+
+
+membership = MembershipIndex()
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _apply_committed_changes(session):
+    for change, user_id, room_id in session.info.pop('membership_changes',
+                                                     ()):
+        if change == 'join':
+            membership.add(user_id, room_id)
+        elif change == 'leave':
+            membership.remove(user_id, room_id)
+        else:
+            membership.remove_room(room_id)
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('membership_changes', None)
@@ -0,0 +1,202 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import (
+    Flask,
+    Response,
+    g,
+    request,
+)
+
+# Seconds, the Prometheus client defaults.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter. The lock is only held for the increment itself.
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(
+                label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets, observations are binned on the way in so
+    rendering only has to accumulate the bucket counts.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            cell = self._values.get(label_values)
+            if cell is None:
+                # Bucket counts followed by the sum of the observations.
+                cell = self._values[label_values] = [0] * len(
+                    self.buckets) + [0.0]
+            cell[index] += 1
+            cell[-1] += value
+
+    def count(self, *label_values) -> int:
+        cell = self._values.get(label_values)
+        return sum(cell[:-1]) if cell else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(v)) for k, v in self._values.items()]
+        for label_values, cell in values:
+            total = 0
+            for bound, count in zip(self.buckets, cell):
+                total += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield self.name + '_bucket', _format_labels(
+                    self.labels, label_values, le), total
+            labels = _format_labels(self.labels, label_values)
+            yield self.name + '_count', labels, total
+            yield self.name + '_sum', labels, cell[-1]
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        The collector is called on every scrape and returns an iterable of
+        (name, type, documentation, samples) with samples being
+        (name, labels (dict), value).
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        for collector in self.collectors:
+            for name, type_, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {type_}')
+                for sample, labels, value in samples:
+                    label_str = _format_labels(tuple(labels),
+                                               tuple(labels.values()))
+                    lines.append(f'{sample}{label_str} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+http_requests = registry.register(Counter(
+    'cas_http_requests_total', 'HTTP requests served.',
+    ('route', 'method', 'status')))
+http_request_duration = registry.register(Histogram(
+    'cas_http_request_duration_seconds', 'HTTP request latency.',
+    ('route',)))
+error_responses = registry.register(Counter(
+    'cas_error_responses_total', 'Error responses by their status code.',
+    ('code',)))
+auth_failures = registry.register(Counter(
+    'cas_auth_failures_total', 'Rejected security tokens.'))
+db_pool_checkout_wait = registry.register(Histogram(
+    'cas_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a pooled database connection.',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)))
+purged_messages = registry.register(Counter(
+    'cas_purged_messages_total', 'Messages removed from deleted rooms.'))
+rate_limited = registry.register(Counter(
+    'cas_rate_limited_total', 'Requests turned away by a rate limit.',
+    ('route', 'scope')))
+
+
+def record_request(route: str, method: str, status: int, duration: float):
+    http_requests.inc(route, method, status)
+    http_request_duration.observe(duration, route)
+
+
+def response_status(response) -> int:
+    """
+    The status_code of the JSON body the clients read, the HTTP status of
+    anything else.
+    """
+    status = getattr(response, 'body_status_code', None)
+    return response.status_code if status is None else status
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.get('metrics_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        record_request(route, request.method, response_status(response),
+                       time.perf_counter() - start)
+    return response
+
+
+def metrics_view():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app: Flask, path: str = '/metrics'):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule(path, 'metrics', metrics_view, methods=['GET'])
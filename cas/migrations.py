@@ -0,0 +1,278 @@
+import logging
+from collections import namedtuple
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    TIMESTAMP,
+    bindparam,
+    delete,
+    func,
+    insert,
+    inspect,
+    literal,
+    select,
+    update,
+)
+from sqlalchemy.engine import (
+    Connection,
+    Engine,
+)
+from cas.database import (
+    Base,
+    ConversationMessage,
+    ConversationUser,
+    Message,
+    ReadCursor,
+    User,
+    get_engine,
+)
+from cas.partitions import (
+    partition_messages,
+    partitioned_tables,
+)
+from cas.search import search_index_ddl
+
+logger = logging.getLogger(__name__)
+
+# Kept out of Base.metadata so recreating the models leaves it alone.
+schema_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', schema_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(64), nullable=False),
+    Column('applied_at', TIMESTAMP(timezone=True), nullable=False,
+           server_default=func.now()),
+)
+# Arbitrary key of the advisory lock serializing concurrent bootstraps.
+BOOTSTRAP_LOCK_ID = 724311
+
+Migration = namedtuple('Migration', 'version name upgrade')
+
+
+def create_missing_tables(connection: Connection):
+    Base.metadata.create_all(connection, checkfirst=True)
+
+
+def create_missing_indexes(connection: Connection, names: tuple):
+    """
+    create_all only adds indexes together with their table, this adds the
+    ones declared later to the tables that already exist.
+    :param names: the indexes a migration declared, the ones declared
+    later may cover columns of later migrations
+    """
+    inspector = inspect(connection)
+    partitioned = partitioned_tables(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(
+            table.name)}
+        for index in table.indexes:
+            # Unique indexes of partitioned tables need the partition key.
+            if index.name in names and index.name not in existing and not (
+                    index.unique and table.name in partitioned):
+                index.create(connection)
+
+
+def add_missing_columns(connection: Connection, names: tuple):
+    """
+    create_all leaves existing tables alone, this adds the nullable columns
+    declared later to them.
+    :param names: 'table.column' of the columns a migration declared
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(
+            table.name)}
+        for column in table.columns:
+            if f'{table.name}.{column.name}' in names and \
+                    column.name not in existing:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                    f'{column.type.compile(connection.dialect)}')
+
+
+def merge_duplicate_users(connection: Connection):
+    """
+    Users sharing an email are merged into the oldest of them, their
+    messages and memberships move over.
+    """
+    kept = select(func.min(User.id).label('id'), User.email).group_by(
+        User.email).having(func.count() > 1).subquery()
+    merged = [{'merged': merged, 'kept': kept_id}
+              for merged, kept_id in connection.execute(
+                  select(User.id, kept.c.id).join(
+                      kept, User.email == kept.c.email).where(
+                      User.id != kept.c.id))]
+    if not merged:
+        return
+    connection.execute(update(Message.__table__).where(
+        Message.sender_id == bindparam('merged')).values(
+        sender_id=bindparam('kept')), merged)
+    connection.execute(update(ConversationUser.__table__).where(
+        ConversationUser.user_id == bindparam('merged')).values(
+        user_id=bindparam('kept')), merged)
+    connection.execute(delete(User.__table__).where(
+        User.id.in_([row['merged'] for row in merged])))
+
+
+def delete_duplicate_memberships(connection: Connection):
+    """
+    Only the oldest membership of a user in a room is kept, the ones left
+    without a user are not unique and stay.
+    """
+    kept = select(func.min(ConversationUser.id)).group_by(
+        ConversationUser.user_id, ConversationUser.conversation_id)
+    duplicates = [id_ for id_, in connection.execute(
+        select(ConversationUser.id).where(
+            ConversationUser.user_id.isnot(None),
+            ConversationUser.id.not_in(kept)))]
+    if not duplicates:
+        return
+    connection.execute(delete(ReadCursor.__table__).where(
+        ReadCursor.conversation_user_id.in_(duplicates)))
+    connection.execute(delete(ConversationUser.__table__).where(
+        ConversationUser.id.in_(duplicates)))
+
+
+def create_lookup_indexes(connection: Connection):
+    """
+    The duplicates the unique indexes would reject are merged or deleted
+    first. ux_conversations_conversation_name went with the tombstones, it
+    is no longer declared and create_conversation_tombstones drops it
+    anyway.
+    """
+    merge_duplicate_users(connection)
+    delete_duplicate_memberships(connection)
+    create_missing_indexes(connection, (
+        'ux_users_email',
+        'ix_messages_sender_id_created_at',
+        'ux_user_conversations_user_id_conversation_id',
+        'ix_user_conversations_conversation_id',
+        'ix_conversation_messages_conversation_id_message_id',
+        'ix_conversation_messages_message_id',
+    ))
+
+
+def create_read_cursors(connection: Connection):
+    """
+    Existing memberships start with the whole room history marked as read,
+    counting it would mean aggregating every room once.
+    """
+    create_missing_tables(connection)
+    latest = select(func.max(ConversationMessage.message_id)).where(
+        ConversationMessage.conversation_id ==
+        ConversationUser.conversation_id).scalar_subquery()
+    missing = ~select(ReadCursor.id).where(
+        ReadCursor.conversation_user_id == ConversationUser.id).exists()
+    connection.execute(insert(ReadCursor).from_select(
+        ['conversation_user_id', 'last_read_message_id', 'unread_count'],
+        select(ConversationUser.id, latest, literal(0)).where(missing)))
+
+
+def create_search_index(connection: Connection):
+    """
+    Only PostgreSQL gets a GIN index, the other backends search in process.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(search_index_ddl)
+
+
+def widen_password_column(connection: Connection):
+    """
+    Password hashes do not fit the 32 characters of the plaintext ones,
+    SQLite does not enforce the length.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(
+            'ALTER TABLE users ALTER COLUMN password TYPE VARCHAR(255)')
+
+
+def create_conversation_tombstones(connection: Connection):
+    """
+    Room names were unique among every room, now only among the live ones.
+    """
+    add_missing_columns(connection, ('conversations.deleted_at',))
+    connection.exec_driver_sql(
+        'DROP INDEX IF EXISTS ux_conversations_conversation_name')
+    create_missing_indexes(connection, ('ux_conversations_live_name',
+                                        'ix_conversations_deleted_at'))
+
+
+def add_room_retention(connection: Connection):
+    add_missing_columns(connection, ('conversations.retention_days',))
+
+
+def add_idempotency_keys(connection: Connection):
+    add_missing_columns(connection, ('messages.idempotency_key',))
+    create_missing_indexes(connection,
+                           ('ux_messages_sender_id_idempotency_key',))
+
+
+def add_conversation_message_times(connection: Connection):
+    """
+    Links carry the created_at of their message, the partition key of the
+    optional partitioned layout, see cas.partitions.
+    """
+    add_missing_columns(connection, ('conversation_messages.created_at',))
+    connection.execute(update(ConversationMessage).where(
+        ConversationMessage.created_at.is_(None)
+    ).values(created_at=select(Message.created_at).where(
+        Message.id == ConversationMessage.message_id).scalar_subquery()))
+    partition_messages(connection)
+
+
+MIGRATIONS = [
+    Migration(1, 'initial schema', create_missing_tables),
+    Migration(2, 'lookup indexes', create_lookup_indexes),
+    Migration(3, 'read cursors', create_read_cursors),
+    Migration(4, 'message search index', create_search_index),
+    Migration(5, 'password hash column', widen_password_column),
+    Migration(6, 'conversation tombstones', create_conversation_tombstones),
+    Migration(7, 'room retention', add_room_retention),
+    Migration(8, 'import bookkeeping', create_missing_tables),
+    Migration(9, 'message idempotency keys', add_idempotency_keys),
+    Migration(10, 'conversation message times',
+              add_conversation_message_times),
+]
+
+
+def schema_version(connection: Connection) -> int:
+    if not inspect(connection).has_table(schema_migrations.name):
+        return 0
+    return connection.execute(
+        select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def bootstrap_schema(engine: Engine = None) -> list:
+    """
+    The function will bring the schema up to date. It never drops a table
+    or column, only the duplicates of migration 2, and is safe to run from
+    several workers at once, the ones starting
+    against an up to date schema only pay for a single query.
+    :param engine: defaults to the app engine
+    :return: versions of the applied migrations
+    """
+    engine = engine or get_engine()
+    head = MIGRATIONS[-1].version
+    with engine.connect() as connection:
+        if schema_version(connection) >= head:
+            return []
+    applied = []
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.exec_driver_sql(
+                f'SELECT pg_advisory_xact_lock({BOOTSTRAP_LOCK_ID})')
+        schema_metadata.create_all(connection, checkfirst=True)
+        current = schema_version(connection)
+        for migration in MIGRATIONS:
+            if migration.version <= current:
+                continue
+            logger.info('Applying migration %d: %s', migration.version,
+                        migration.name)
+            migration.upgrade(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=migration.version, name=migration.name))
+            applied.append(migration.version)
+    return applied
@@ -0,0 +1,335 @@
+"""
+Time partitioned messages on PostgreSQL 12+. With MESSAGE_PARTITIONS set
+the migrations lay out `messages` and `conversation_messages` as tables
+partitioned by range of created_at, one partition per month, plus a
+default partition for anything outside of them:
+
+    messages_p2026_10    conversation_messages_p2026_10    ...
+    messages_default     conversation_messages_default
+
+A link carries the created_at of its message, the primary keys become
+(id, created_at) and the links reference the messages by both columns, so
+the rows of a month of both tables sit in the partitions of that month.
+Unique indexes of a partitioned table must include the partition key, so
+the one on the idempotency keys is left out: the lookup before the insert
+still answers the retries, only two concurrent first sends of the same
+key may both be stored.
+
+PartitionManager creates the partitions some months ahead and detaches
+the ones older than the retained months, their messages are gone from
+the history and the archive alike, keep them longer than the retention of
+every room. Detached partitions are plain tables left to be dumped and
+dropped.
+
+    python -m cas.partitions layout      # on an empty database
+    python -m cas.partitions maintain    # daily from cron
+    python -m cas.partitions list
+"""
+import argparse
+import atexit
+import logging
+import re
+import threading
+from datetime import date
+from sqlalchemy import (
+    bindparam,
+    text,
+)
+from sqlalchemy.engine import (
+    Connection,
+    Engine,
+)
+from sqlalchemy.exc import DBAPIError
+from cas import config
+from cas.database import (
+    ConversationMessage,
+    Message,
+    get_engine,
+)
+from cas.search import search_index_ddl
+
+logger = logging.getLogger(__name__)
+
+# Parents first, the partitions are detached in the reverse order.
+PARTITIONED_TABLES = ('messages', 'conversation_messages')
+MESSAGE_FK = 'fk_conversation_messages_message'
+# Arbitrary key of the advisory lock serializing the maintenance passes.
+MAINTENANCE_LOCK_ID = 724312
+_PARTITION_NAME = re.compile(
+    r'^(?P<table>\w+)_p(?P<year>\d{4})_(?P<month>\d{2})$')
+
+LAYOUT_DDL = [
+    """CREATE TABLE messages (
+        id SERIAL,
+        msg VARCHAR(32) NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        idempotency_key VARCHAR(64),
+        sender_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)""",
+    """CREATE TABLE conversation_messages (
+        id SERIAL,
+        message_id INTEGER,
+        conversation_id INTEGER
+            REFERENCES conversations (id) ON DELETE CASCADE,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        PRIMARY KEY (id, created_at),
+        CONSTRAINT {fk} FOREIGN KEY (message_id, created_at)
+            REFERENCES messages (id, created_at) ON DELETE CASCADE
+    ) PARTITION BY RANGE (created_at)""".format(fk=MESSAGE_FK),
+    'CREATE TABLE messages_default PARTITION OF messages DEFAULT',
+    'CREATE TABLE conversation_messages_default '
+    'PARTITION OF conversation_messages DEFAULT',
+]
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_p{month:%Y_%m}'
+
+
+def parse_partition_name(name: str):
+    """
+    :return: (table, month) of a monthly partition, None for any other name
+    """
+    match = _PARTITION_NAME.match(name)
+    if match is None or match['table'] not in PARTITIONED_TABLES or \
+            not 1 <= int(match['month']) <= 12:
+        return None
+    return match['table'], date(int(match['year']), int(match['month']), 1)
+
+
+def create_partition_ddl(table: str, month: date) -> str:
+    return (f'CREATE TABLE IF NOT EXISTS {partition_name(table, month)} '
+            f'PARTITION OF {table} FOR VALUES FROM (\'{month}\') '
+            f'TO (\'{add_months(month, 1)}\')')
+
+
+def detach_partition_ddl(table: str, month: date) -> list:
+    name = partition_name(table, month)
+    statements = [f'ALTER TABLE {table} DETACH PARTITION {name}']
+    if table == 'conversation_messages':
+        # The detached links would keep the rows of the messages partition
+        # referenced and block its detach.
+        statements.append(
+            f'ALTER TABLE {name} DROP CONSTRAINT IF EXISTS {MESSAGE_FK}')
+    return statements
+
+
+def partitioned_tables(connection: Connection) -> set:
+    """
+    Names of the partitioned tables, always empty off PostgreSQL.
+    """
+    if connection.dialect.name != 'postgresql':
+        return set()
+    return set(connection.execute(text(
+        'SELECT c.relname FROM pg_partitioned_table p '
+        'JOIN pg_class c ON c.oid = p.partrelid '
+        'WHERE pg_table_is_visible(c.oid)')).scalars())
+
+
+def attached_partitions(connection: Connection) -> dict:
+    """
+    :return: dict of partitioned table to the set of months attached
+    """
+    partitions = {table: set() for table in PARTITIONED_TABLES}
+    rows = connection.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE parent.relname IN :tables AND pg_table_is_visible(parent.oid)'
+    ).bindparams(bindparam('tables', PARTITIONED_TABLES, expanding=True)))
+    for name, in rows:
+        parsed = parse_partition_name(name)
+        if parsed is not None:
+            partitions[parsed[0]].add(parsed[1])
+    return partitions
+
+
+def create_partitioned_layout(connection: Connection, months: list):
+    """
+    Replace the empty messages tables by partitioned ones with the given
+    monthly partitions.
+    :raises ValueError: off PostgreSQL or when messages are stored already
+    """
+    if connection.dialect.name != 'postgresql':
+        raise ValueError('Partitioned messages need PostgreSQL')
+    if connection.exec_driver_sql(
+            'SELECT EXISTS (SELECT 1 FROM messages) OR '
+            'EXISTS (SELECT 1 FROM conversation_messages)').scalar():
+        raise ValueError('The messages tables are not empty, move the rows '
+                         'into the partitioned layout by hand')
+    connection.exec_driver_sql('DROP TABLE conversation_messages, messages')
+    for statement in LAYOUT_DDL:
+        connection.exec_driver_sql(statement)
+    for model in (Message, ConversationMessage):
+        for index in model.__table__.indexes:
+            if not index.unique:
+                index.create(connection)
+    connection.execute(search_index_ddl)
+    for month in months:
+        for table in PARTITIONED_TABLES:
+            connection.exec_driver_sql(create_partition_ddl(table, month))
+
+
+def partition_messages(connection: Connection, today: date = None):
+    """
+    Migration step, lays out the messages tables partitioned when
+    MESSAGE_PARTITIONS is set and they are still empty.
+    """
+    if not config.MESSAGE_PARTITIONS or \
+            'messages' in partitioned_tables(connection):
+        return
+    manager = PartitionManager(
+        months_ahead=config.MESSAGE_PARTITION_MONTHS_AHEAD)
+    try:
+        create_partitioned_layout(connection, manager.months(today))
+    except ValueError as e:
+        logger.warning('Messages left unpartitioned: %s', e)
+
+
+class PartitionManager:
+    """
+    Keeps the monthly partitions `months_ahead` months ahead of the
+    current one and detaches the ones older than `retain_months` months
+    before it, 0 keeps them all. Runs every `interval` seconds from a
+    background thread once started.
+    """
+
+    def __init__(self, engine: Engine = None, months_ahead: int = 3,
+                 retain_months: int = 0, interval: float = 86400):
+        self.engine = engine
+        self.months_ahead = months_ahead
+        self.retain_months = retain_months
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='cas-partitions', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def months(self, today: date = None) -> list:
+        """
+        The current month and the ones to create ahead of it.
+        """
+        current = month_start(today or date.today())
+        return [add_months(current, n) for n in range(self.months_ahead + 1)]
+
+    def plan(self, attached: dict, today: date = None) -> tuple:
+        """
+        :param attached: as returned by attached_partitions
+        :return: (months to create, months to detach), each a sorted list
+        """
+        create = sorted({month for month in self.months(today)
+                         for table in PARTITIONED_TABLES
+                         if month not in attached.get(table, ())})
+        detach = []
+        if self.retain_months:
+            oldest = add_months(month_start(today or date.today()),
+                                -self.retain_months)
+            detach = sorted({month for months in attached.values()
+                             for month in months if month < oldest})
+        return create, detach
+
+    def maintain(self, today: date = None) -> tuple:
+        """
+        One pass, every month in a transaction of its own so a month that
+        fails, like one with rows in the default partition, does not hold
+        back the others.
+        :return: (months created, months detached)
+        """
+        engine = self.engine or get_engine()
+        with engine.connect() as connection:
+            if 'messages' not in partitioned_tables(connection):
+                return [], []
+            create, detach = self.plan(attached_partitions(connection),
+                                       today)
+        created, detached = [], []
+        for month in create:
+            statements = [create_partition_ddl(table, month)
+                          for table in PARTITIONED_TABLES]
+            if self._execute(engine, statements, month):
+                created.append(month)
+        for month in detach:
+            statements = [statement for table in reversed(PARTITIONED_TABLES)
+                          for statement in detach_partition_ddl(table, month)]
+            if self._execute(engine, statements, month):
+                detached.append(month)
+        if created or detached:
+            logger.info('Partitions created for %s, detached for %s',
+                        [str(month) for month in created],
+                        [str(month) for month in detached])
+        return created, detached
+
+    @staticmethod
+    def _execute(engine: Engine, statements: list, month: date) -> bool:
+        try:
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    f'SELECT pg_advisory_xact_lock({MAINTENANCE_LOCK_ID})')
+                for statement in statements:
+                    connection.exec_driver_sql(statement)
+        except DBAPIError:
+            logger.exception('Maintaining the partitions of %s failed', month)
+            return False
+        return True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception('Maintaining the message partitions failed')
+            self._stopping.wait(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Manage the monthly partitions of the messages.')
+    parser.add_argument('command', choices=('layout', 'maintain', 'list'))
+    parser.add_argument('--months-ahead', type=int,
+                        default=config.MESSAGE_PARTITION_MONTHS_AHEAD)
+    parser.add_argument('--retain-months', type=int,
+                        default=config.MESSAGE_PARTITION_RETAIN_MONTHS)
+    args = parser.parse_args()
+    manager = PartitionManager(months_ahead=args.months_ahead,
+                               retain_months=args.retain_months)
+    if args.command == 'layout':
+        with get_engine().begin() as connection:
+            try:
+                create_partitioned_layout(connection, manager.months())
+            except ValueError as e:
+                parser.exit(1, f'{e}\n')
+        print('Messages partitioned by month')
+    elif args.command == 'maintain':
+        created, detached = manager.maintain()
+        print(f'{len(created)} months created, {len(detached)} detached')
+    else:
+        with get_engine().connect() as connection:
+            for table, months in attached_partitions(connection).items():
+                for month in sorted(months):
+                    print(partition_name(table, month))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Password hashing with a deliberately slow KDF from hashlib. The hashes are
+computed on a bounded process pool so they neither hold the GIL of the
+request threads nor block the event loop of the async app.
+
+Encoded hashes carry their parameters, so changing the cost only affects
+new hashes and old ones are upgraded on the next login:
+
+    scrypt$<log2 n>$<r>$<p>$<salt>$<hash>
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+Values without a known scheme are plaintext passwords stored before
+hashing was introduced. Values starting with UNUSABLE never match, they
+belong to accounts that cannot log in with a password, like imported ones.
+"""
+import atexit
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+)
+
+UNUSABLE = '!'
+SALT_BYTES = 16
+HASH_BYTES = 32
+SCRYPT_R = 8
+SCRYPT_P = 1
+# Default cost per KDF, log2 of n for scrypt and iterations for PBKDF2.
+DEFAULT_COST = {
+    'scrypt': 14,
+    'pbkdf2_sha256': 600000,
+}
+
+
+# Forked workers would inherit the threads, locks and pooled database
+# connections of the app, they are started from a clean process instead.
+START_METHOD = 'forkserver' \
+    if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password: str, salt: bytes, log2_n: int, r: int, p: int):
+    n = 1 << log2_n
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + (1 << 20), dklen=HASH_BYTES)
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations,
+                               dklen=HASH_BYTES)
+
+
+def hash_password(password: str, kdf: str = 'scrypt',
+                  cost: int = None) -> str:
+    """
+    The function will hash the password with a random salt.
+    :param password:
+    :param kdf: 'scrypt' or 'pbkdf2_sha256'
+    :param cost: log2 of n for scrypt, iterations for PBKDF2
+    :return: encoded hash (str)
+    """
+    cost = cost or DEFAULT_COST[kdf]
+    salt = os.urandom(SALT_BYTES)
+    if kdf == 'scrypt':
+        digest = _scrypt(password, salt, cost, SCRYPT_R, SCRYPT_P)
+        return f'scrypt${cost}${SCRYPT_R}${SCRYPT_P}$' \
+               f'{_b64encode(salt)}${_b64encode(digest)}'
+    if kdf == 'pbkdf2_sha256':
+        digest = _pbkdf2(password, salt, cost)
+        return f'pbkdf2_sha256${cost}${_b64encode(salt)}${_b64encode(digest)}'
+    raise ValueError(f'Unknown password KDF: {kdf}')
+
+
+def unusable_password() -> str:
+    return UNUSABLE + _b64encode(os.urandom(SALT_BYTES))
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """
+    The function will check the password against an encoded hash, or
+    against a legacy plaintext value.
+    :param password:
+    :param encoded:
+    :return: bool
+    """
+    if encoded.startswith(UNUSABLE):
+        return False
+    scheme, _, params = encoded.partition('$')
+    if scheme == 'scrypt':
+        log2_n, r, p, salt, digest = params.split('$')
+        actual = _scrypt(password, base64.b64decode(salt), int(log2_n),
+                         int(r), int(p))
+    elif scheme == 'pbkdf2_sha256':
+        iterations, salt, digest = params.split('$')
+        actual = _pbkdf2(password, base64.b64decode(salt), int(iterations))
+    else:
+        return hmac.compare_digest(password.encode(), encoded.encode())
+    return hmac.compare_digest(actual, base64.b64decode(digest))
+
+
+def needs_rehash(encoded: str, kdf: str = 'scrypt', cost: int = None) -> bool:
+    """
+    Whether the hash was made with another KDF or cost than the current
+    ones, legacy plaintext values always need one.
+    """
+    cost = cost or DEFAULT_COST[kdf]
+    scheme, _, params = encoded.partition('$')
+    return scheme != kdf or int(params.split('$')[0]) != cost
+
+
+class PasswordHasher:
+    """
+    Runs hash_password and verify_password on a process pool. At most
+    `max_pending` calls are queued or running, callers beyond that wait
+    up to `submit_timeout` seconds and then get PasswordHasherBusy, so a
+    login storm cannot queue unbounded work.
+    """
+
+    def __init__(self, kdf: str = 'scrypt', cost: int = None,
+                 max_workers: int = None, max_pending: int = None,
+                 submit_timeout: float = 1.0, start_method: str = None):
+        if kdf not in DEFAULT_COST:
+            raise ValueError(f'Unknown password KDF: {kdf}')
+        self.kdf = kdf
+        self.cost = cost or DEFAULT_COST[kdf]
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.submit_timeout = submit_timeout
+        self.start_method = start_method or START_METHOD
+        self._pending = threading.BoundedSemaphore(
+            max_pending or self.max_workers * 4)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    context = multiprocessing.get_context(self.start_method)
+                    self._executor = ProcessPoolExecutor(
+                        self.max_workers, mp_context=context)
+                    atexit.register(self.shutdown)
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _submit(self, fn, *args) -> Future:
+        if not self._pending.acquire(timeout=self.submit_timeout):
+            raise PasswordHasherBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def hash(self, password: str) -> Future:
+        return self._submit(hash_password, password, self.kdf, self.cost)
+
+    def verify(self, password: str, encoded: str) -> Future:
+        return self._submit(verify_password, password, encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return needs_rehash(encoded, self.kdf, self.cost)
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    """
+    A single subscriber of a room. Events are buffered in an asyncio queue
+    that lives on the hub loop; the synchronous `get` is meant for the
+    request threads serving the push channel.
+    """
+
+    def __init__(self, hub, room_id: int, queue: asyncio.Queue):
+        self.hub = hub
+        self.room_id = room_id
+        self.queue = queue
+
+    def get(self, timeout: float = None):
+        """
+        Block until the next event is available.
+        :param timeout: seconds to wait before giving up
+        :return: event (dict) or None on timeout
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(self.queue.get(), timeout), self.hub.loop)
+        try:
+            return future.result()
+        except asyncio.TimeoutError:
+            return None
+
+    async def get_async(self, timeout: float = None):
+        """
+        Same as `get` for coroutines running on another event loop.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(self.queue.get(), timeout), self.hub.loop)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class RoomHub:
+    """
+    In-process pub/sub hub that fans room events out to every subscriber.
+    The hub owns an asyncio loop running in a daemon thread, so it can be
+    published to from the synchronous request handlers.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._rooms = defaultdict(set)
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever,
+                                     name='cas-room-hub', daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def subscribers(self, room_id: int) -> int:
+        return len(self._rooms.get(room_id, ()))
+
+    def subscribe(self, room_id: int) -> Subscription:
+        return asyncio.run_coroutine_threadsafe(
+            self._subscribe(room_id), self.loop).result()
+
+    async def subscribe_async(self, room_id: int) -> Subscription:
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            self._subscribe(room_id), self.loop))
+
+    async def _subscribe(self, room_id: int) -> Subscription:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._rooms[room_id].add(queue)
+        return Subscription(self, room_id, queue)
+
+    def unsubscribe(self, subscription: Subscription):
+        self.loop.call_soon_threadsafe(self._remove, subscription)
+
+    def publish(self, room_id: int, event: dict):
+        """
+        Schedule the event for delivery to the room subscribers. It is safe
+        to call from any thread and never blocks on slow subscribers.
+        :param room_id:
+        :param event:
+        """
+        if room_id in self._rooms:
+            self.loop.call_soon_threadsafe(self._fan_out, room_id, event)
+
+    def _fan_out(self, room_id: int, event: dict):
+        for queue in self._rooms.get(room_id, ()):
+            if queue.full():
+                # Slow subscriber, drop its oldest event.
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def _remove(self, subscription: Subscription):
+        queues = self._rooms.get(subscription.room_id)
+        if queues is None:
+            return
+        queues.discard(subscription.queue)
+        if not queues:
+            del self._rooms[subscription.room_id]
+
+
+hub = RoomHub()
@@ -0,0 +1,149 @@
+"""
+Background removal of deleted rooms. delete_conversation_by_id only
+tombstones a room, the RoomPurger then deletes its messages a chunk per
+transaction, so a room with millions of messages never turns into one
+huge transaction holding locks. The tombstones live in the database, a
+purge interrupted by a restart is resumed by the next scan.
+
+    python -m cas.purge
+
+runs a single pass in the foreground and prints the progress.
+"""
+import argparse
+import atexit
+import logging
+import threading
+import time
+from cas import metrics
+from cas.archive import message_archive
+from cas.database import (
+    Session,
+    get_deleted_room_ids,
+    purge_room_chunk,
+)
+from cas.search import search_index
+
+logger = logging.getLogger(__name__)
+
+
+class RoomPurger:
+    """
+    Purges the tombstoned rooms from a background thread. It scans for them
+    every `poll_interval` seconds and right away when woken after a delete.
+    `on_progress` is called after every chunk with the room id, the number
+    of messages purged from it so far and whether the room is gone.
+    """
+
+    def __init__(self, session_factory=Session, chunk_size: int = 5000,
+                 chunk_pause: float = 0.01, poll_interval: float = 60,
+                 on_progress=None):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.chunk_pause = chunk_pause
+        self.poll_interval = poll_interval
+        self.on_progress = on_progress
+        self._progress = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='cas-room-purger', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout: float = None):
+        """
+        Stop after the chunk in progress, the rest is resumed on restart.
+        """
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        self._wake.set()
+
+    def progress(self) -> dict:
+        """
+        Messages purged so far per room still being purged.
+        """
+        with self._lock:
+            return dict(self._progress)
+
+    def purge_pending(self) -> int:
+        """
+        Purge every tombstoned room.
+        :return: number of rooms removed
+        """
+        with self.session_factory() as session:
+            room_ids = get_deleted_room_ids(session)
+        purged = 0
+        for room_id in room_ids:
+            if self._stopping.is_set():
+                break
+            purged += self.purge_room(room_id)
+        return purged
+
+    def purge_room(self, room_id: int) -> bool:
+        """
+        :return: True once the room row is deleted
+        """
+        search_index.drop(room_id)
+        total = 0
+        while not self._stopping.is_set():
+            with self.session_factory.begin() as session:
+                deleted = purge_room_chunk(session, room_id, self.chunk_size)
+            total += deleted
+            metrics.purged_messages.inc(amount=deleted)
+            with self._lock:
+                if deleted:
+                    self._progress[room_id] = total
+                else:
+                    self._progress.pop(room_id, None)
+            if self.on_progress is not None:
+                self.on_progress(room_id, total, not deleted)
+            if not deleted:
+                message_archive.remove_room(room_id)
+                logger.info('Purged room %d, %d messages', room_id, total)
+                return True
+            if self.chunk_pause:
+                time.sleep(self.chunk_pause)
+        return False
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                self.purge_pending()
+            except Exception:
+                logger.exception('Purging deleted rooms failed')
+            self._wake.wait(self.poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Purge the deleted rooms once.')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--chunk-pause-ms', type=int, default=0)
+    args = parser.parse_args()
+
+    def report(room_id, total, done):
+        print(f'room {room_id}: {total} messages purged'
+              f'{", done" if done else ""}', flush=True)
+
+    purger = RoomPurger(chunk_size=args.chunk_size,
+                        chunk_pause=args.chunk_pause_ms / 1000,
+                        on_progress=report)
+    print(f'{purger.purge_pending()} rooms purged')
+
+
+if __name__ == '__main__':
+    main()
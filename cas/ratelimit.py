@@ -0,0 +1,249 @@
+"""
+Per address, per user and per room rate limits with token buckets. A
+bucket holds up to `burst` tokens and refills at `rate` tokens per second,
+every request takes one. The 'address' limits are checked before the
+authorization, so a flood of requests from a client is turned away before
+it costs a token check or a database session. The 'user' and 'room' limits
+are checked once the token is verified, so forged user_id headers can not
+drain the buckets of another user. The room comes from the URL or the JSON
+body.
+
+Buckets are refilled lazily when they are next used. LocalBackend keeps
+them in the process, ordered by last use, and drops the ones idle long
+enough to be full again, a missing bucket counts as full. With several
+workers every one of them enforces the limits on its own, RedisBackend
+shares the buckets instead.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import (
+    g,
+    request,
+)
+from cas import (
+    config,
+    metrics,
+)
+from cas.utils import error_response
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    """
+    Buckets of this process, a (tokens, updated) pair per key.
+    """
+    blocking = False
+
+    def __init__(self, max_keys: int = 100000, timer=time.monotonic):
+        self.max_keys = max_keys
+        self.timer = timer
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        # Longest time any bucket takes to refill from empty.
+        self._idle = 0.0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, rate: float, burst: float, cost: float = 1) -> float:
+        """
+        :return: 0 when the tokens were taken, otherwise the seconds until
+            enough of them are back
+        """
+        now = self.timer()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._idle = max(self._idle, burst / rate)
+            self._evict(now)
+        return wait
+
+    def _evict(self, now: float):
+        # Least recently used first, stops at the first one still refilling.
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if now - updated < self._idle and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBackend:
+    """
+    Buckets shared by every worker, updated atomically by a script on the
+    Redis server and timed by its clock. Requests are let through while
+    Redis cannot be reached.
+    """
+    blocking = True
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = burst
+if bucket[1] then
+    tokens = math.min(burst, tonumber(bucket[1]) +
+                      (now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+    def __init__(self, url: str, prefix: str = 'cas:rate:'):
+        if redis is None:
+            raise RuntimeError('RedisBackend needs the redis package')
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate: float, burst: float, cost: float = 1) -> float:
+        name = self.prefix + ':'.join(str(part) for part in key)
+        try:
+            return float(self._script(keys=[name], args=[rate, burst, cost]))
+        except redis.RedisError as ex:
+            logger.warning('Rate limit check failed: %s', ex)
+            return 0.0
+
+    def clear(self):
+        for name in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(name)
+
+
+class RateLimiter:
+    """
+    :param limits: route name to {scope: (rate, burst)}
+    :param backend: LocalBackend, RedisBackend or anything with the same
+        take(key, rate, burst, cost) method
+    """
+
+    def __init__(self, limits: dict, backend=None, enabled: bool = True):
+        self.limits = {route: {scope: (float(rate), float(burst))
+                               for scope, (rate, burst) in scopes.items()}
+                       for route, scopes in limits.items()}
+        self.backend = LocalBackend() if backend is None else backend
+        self.enabled = enabled
+
+    def check(self, route: str, user_id=None, room_id=None,
+              address: str = None) -> tuple:
+        """
+        Take a token from each bucket of the request, up to the first one
+        that is empty. Scopes without an id given are left alone.
+        :return: (scope, seconds to wait) of that bucket, or (None, 0)
+        """
+        scopes = self.limits.get(route)
+        if not self.enabled or not scopes:
+            return None, 0.0
+        ids = {'user': user_id, 'room': room_id, 'address': address}
+        for scope, (rate, burst) in scopes.items():
+            if ids.get(scope) is None:
+                continue
+            wait = self.backend.take((route, scope, ids[scope]), rate, burst)
+            if wait:
+                return scope, wait
+        return None, 0.0
+
+    def reset(self):
+        self.backend.clear()
+
+
+def request_room_id(view_args: dict, data):
+    """
+    The room of a request, None when missing or malformed.
+    """
+    room_id = (view_args or {}).get('room_id')
+    if room_id is None and isinstance(data, dict):
+        room_id = data.get('room_id')
+    return room_id if isinstance(room_id, int) else None
+
+
+def retry_after(route: str, scope: str, wait: float) -> dict:
+    """
+    Counts the rejected request, returns the headers of its response.
+    """
+    metrics.rate_limited.inc(route, scope)
+    return {'Retry-After': str(math.ceil(wait))}
+
+
+def too_many_requests(route: str, scope: str, wait: float):
+    response = error_response(message='Too many requests, try again later!',
+                              status_code=429)
+    response.headers.update(retry_after(route, scope, wait))
+    return response
+
+
+def limit_address(route: str):
+    """
+    Decorator checking the 'address' limits of `route`, goes above
+    authorization.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            scope, wait = rate_limiter.check(route,
+                                             address=request.remote_addr)
+            if scope is not None:
+                return too_many_requests(route, scope, wait)
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+def rate_limit(route: str):
+    """
+    Decorator checking the 'user' and 'room' limits of `route`, goes below
+    authorization.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            room_id = request_room_id(request.view_args,
+                                      request.get_json(silent=True))
+            scope, wait = rate_limiter.check(route, g.auth_user_id, room_id)
+            if scope is not None:
+                return too_many_requests(route, scope, wait)
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+rate_limiter = RateLimiter(
+    config.RATE_LIMITS,
+    RedisBackend(config.RATE_LIMIT_REDIS_URL)
+    if config.RATE_LIMIT_REDIS_URL else LocalBackend(
+        config.RATE_LIMIT_MAX_KEYS),
+    config.RATE_LIMITS_ENABLED)
@@ -0,0 +1,84 @@
+"""
+Hashes the passwords still stored in plaintext from before hashing was
+introduced. Logging in upgrades them one at a time, this converts the
+accounts that have not logged in since. It can run while the app serves
+traffic, a password changed in the meantime is left alone.
+
+    python -m cas.rehash --batch-size 500
+"""
+import argparse
+from cas import config
+from cas.database import (
+    Session,
+    User,
+    update_user_password,
+)
+from cas.passwords import (
+    DEFAULT_COST,
+    UNUSABLE,
+    PasswordHasher,
+)
+
+
+def plaintext_filter() -> list:
+    """
+    The passwords that are neither an encoded hash nor unusable.
+    """
+    prefixes = [UNUSABLE] + [f'{kdf}$' for kdf in DEFAULT_COST]
+    return [~User.password.startswith(prefix, autoescape=True)
+            for prefix in prefixes]
+
+
+def hash_plaintext_passwords(hasher: PasswordHasher,
+                             session_factory=Session, batch_size: int = 500,
+                             on_progress=None) -> int:
+    """
+    :param hasher: its max_pending must fit a batch
+    :param session_factory:
+    :param batch_size: users hashed per transaction
+    :param on_progress: called with the number of passwords hashed so far
+    :return: number of passwords hashed
+    """
+    total = 0
+    last_id = 0
+    while True:
+        with session_factory() as session:
+            rows = session.query(User.id, User.password).filter(
+                User.id > last_id, *plaintext_filter()).order_by(
+                User.id).limit(batch_size).all()
+        if not rows:
+            return total
+        hashes = [future.result() for future in
+                  [hasher.hash(password) for _, password in rows]]
+        with session_factory.begin() as session:
+            for (user_id, old), new in zip(rows, hashes):
+                total += update_user_password(session, user_id, old, new)
+        last_id = rows[-1][0]
+        if on_progress is not None:
+            on_progress(total)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Hash the passwords stored in plaintext once.')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--workers', type=int,
+                        default=config.PASSWORD_POOL_SIZE)
+    args = parser.parse_args()
+
+    def report(total):
+        print(f'{total} passwords hashed', flush=True)
+
+    hasher = PasswordHasher(config.PASSWORD_KDF, cost=config.PASSWORD_COST,
+                            max_workers=args.workers,
+                            max_pending=args.batch_size)
+    try:
+        total = hash_plaintext_passwords(hasher, batch_size=args.batch_size,
+                                         on_progress=report)
+    finally:
+        hasher.shutdown()
+    print(f'{total} passwords hashed in total')
+
+
+if __name__ == '__main__':
+    main()
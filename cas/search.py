@@ -0,0 +1,338 @@
+"""
+Full text search over the messages of a room. PostgreSQL answers from a
+GIN index on the message tsvector, other backends from an in-process
+inverted index that is loaded per room on its first search and kept up to
+date from the messages committed afterwards.
+
+Every worker has an index of its own. The messages committed by the other
+workers are caught up before a search from the last id read for the room,
+at most once per `refresh_interval`; one committed out of id order after
+that read is only found once the room is loaded again. The messages they
+delete are dropped once a search finds them gone. Only
+config.SEARCH_INDEX_ROOMS rooms are kept, the least recently searched one
+is evicted.
+"""
+import re
+import threading
+import time
+from array import array
+from bisect import (
+    bisect_left,
+    insort,
+)
+from collections import (
+    Counter,
+    OrderedDict,
+    namedtuple,
+)
+from sqlalchemy import (
+    DDL,
+    event,
+    func,
+    literal_column,
+)
+from sqlalchemy.orm import Session as OrmSession
+from cas import config
+from cas.database import (
+    ConversationMessage,
+    Message,
+    Session,
+)
+
+# Chat messages are short and not in one language, so no stemming.
+SEARCH_CONFIG = 'simple'
+SEARCH_INDEX_NAME = 'ix_messages_msg_tsv'
+search_index_ddl = DDL(
+    f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} ON messages '
+    f"USING gin (to_tsvector('{SEARCH_CONFIG}', msg))")
+event.listen(Message.__table__, 'after_create',
+             search_index_ddl.execute_if(dialect='postgresql'))
+
+SearchResult = namedtuple('SearchResult', 'message rank')
+_TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall(text.lower())
+
+
+class RoomIndex:
+    """
+    Postings of a single room, every token maps to the sorted ids of the
+    messages containing it. Occurrence counts are only kept for the few
+    messages repeating a token.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.repeats = {}
+        # Read from the database up to here, see InvertedIndex.room.
+        self.last_id = 0
+        self.caught_up_at = 0.0
+
+    def add(self, msg_id: int, tokens: list):
+        for token, count in Counter(tokens).items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = array('q')
+            if not posting or posting[-1] < msg_id:
+                posting.append(msg_id)
+            elif not self._has(posting, msg_id):
+                # Committed out of order by a concurrent transaction.
+                insort(posting, msg_id)
+            if count > 1:
+                self.repeats.setdefault(token, {})[msg_id] = count
+
+    def remove(self, msg_ids, tokens: list = None):
+        """
+        :param msg_ids: ids of the messages deleted
+        :param tokens: of the messages, without them every posting is
+            searched
+        """
+        msg_ids = set(msg_ids)
+        for token in set(tokens) if tokens is not None else list(
+                self.postings):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            if len(msg_ids) == 1:
+                msg_id, = msg_ids
+                i = bisect_left(posting, msg_id)
+                if i < len(posting) and posting[i] == msg_id:
+                    del posting[i]
+            else:
+                posting = array('q', (msg_id for msg_id in posting
+                                      if msg_id not in msg_ids))
+                self.postings[token] = posting
+            if not posting:
+                del self.postings[token]
+            repeats = self.repeats.get(token)
+            if repeats:
+                for msg_id in msg_ids:
+                    repeats.pop(msg_id, None)
+
+    @staticmethod
+    def _has(posting, msg_id: int) -> bool:
+        i = bisect_left(posting, msg_id)
+        return i < len(posting) and posting[i] == msg_id
+
+    def contains(self, msg_id: int, tokens: list) -> bool:
+        posting = self.postings.get(tokens[0]) if tokens else None
+        return bool(posting) and self._has(posting, msg_id)
+
+    def search(self, terms: list, limit: int, window: int = 1000) -> list:
+        """
+        Messages containing every term. The newest `window` of them are
+        ranked by how often the terms occur, newest first among equals,
+        older ones follow newest first. This bounds the work for words
+        found all over the room while keeping the order stable for paging.
+        :return: list of (msg_id, rank) tuples
+        """
+        terms = set(terms)
+        postings = sorted(((self.postings.get(term), term) for term in terms),
+                          key=lambda item: len(item[0] or ()))
+        if not terms or not postings[0][0]:
+            return []
+        (rarest, rarest_term), others = postings[0], postings[1:]
+        wanted = max(window, limit)
+        matches = []
+        for msg_id in reversed(rarest):
+            rank = self.repeats.get(rarest_term, {}).get(msg_id, 1)
+            for posting, term in others:
+                if not self._has(posting, msg_id):
+                    break
+                rank += self.repeats.get(term, {}).get(msg_id, 1)
+            else:
+                matches.append((msg_id, rank))
+                if len(matches) == wanted:
+                    break
+        ranked = sorted(matches[:window], key=lambda match: (match[1],
+                                                             match[0]),
+                        reverse=True)
+        return (ranked + matches[window:])[:limit]
+
+
+class InvertedIndex:
+    """
+    In-process search index of the rooms. A room is loaded from the
+    database on its first search, messages committed or deleted while it
+    loads are buffered and merged once it is ready.
+    """
+
+    def __init__(self, session_factory=Session, chunk_size: int = 10000,
+                 rank_window: int = 1000, max_rooms: int = None,
+                 refresh_interval: float = 1.0):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.rank_window = rank_window
+        self.refresh_interval = refresh_interval
+        self.max_rooms = max_rooms or config.SEARCH_INDEX_ROOMS
+        self._rooms = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def add(self, room_id: int, msg_id: int, text: str):
+        with self._lock:
+            if room_id in self._rooms:
+                self._rooms[room_id].add(msg_id, tokenize(text))
+            elif room_id in self._loading:
+                self._loading[room_id].append((msg_id, text))
+
+    def remove(self, room_id: int, msg_ids, text: str = None):
+        """
+        :param room_id: None for every room
+        :param msg_ids:
+        :param text: of the single message removed, narrows the postings
+            searched
+        """
+        tokens = None if text is None else tokenize(text)
+        with self._lock:
+            rooms = list(self._rooms) + list(self._loading) \
+                if room_id is None else [room_id]
+            for room in rooms:
+                if room in self._rooms:
+                    self._rooms[room].remove(msg_ids, tokens)
+                elif room in self._loading:
+                    self._loading[room].extend(
+                        (msg_id, None) for msg_id in msg_ids)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._loading.clear()
+
+    def drop(self, room_id: int):
+        with self._lock:
+            self._rooms.pop(room_id, None)
+            self._loading.pop(room_id, None)
+
+    def room(self, room_id: int) -> RoomIndex:
+        with self._lock:
+            index = self._rooms.get(room_id)
+            if index is None:
+                self._loading.setdefault(room_id, [])
+            else:
+                self._rooms.move_to_end(room_id)
+        if index is not None:
+            if time.monotonic() - index.caught_up_at >= \
+                    self.refresh_interval:
+                self._catch_up(room_id, index)
+            return index
+        index = self._load(room_id)
+        with self._lock:
+            if room_id in self._rooms:
+                return self._rooms[room_id]
+            for msg_id, text in self._loading.pop(room_id, ()):
+                if text is None:
+                    index.remove([msg_id])
+                    continue
+                tokens = tokenize(text)
+                if not index.contains(msg_id, tokens):
+                    index.add(msg_id, tokens)
+            self._rooms[room_id] = index
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+        return index
+
+    def _rows(self, session, room_id: int, after_id: int) -> list:
+        return session.query(Message.id, Message.msg).join(
+            ConversationMessage,
+            ConversationMessage.message_id == Message.id
+        ).filter(ConversationMessage.conversation_id == room_id,
+                 ConversationMessage.message_id > after_id).order_by(
+            ConversationMessage.message_id).limit(self.chunk_size).all()
+
+    def _catch_up(self, room_id: int, index: RoomIndex):
+        """
+        Add the messages committed since the last id read, the ones of this
+        worker are already indexed and skipped.
+        """
+        index.caught_up_at = time.monotonic()
+        with self.session_factory() as session:
+            while True:
+                rows = self._rows(session, room_id, index.last_id)
+                with self._lock:
+                    for msg_id, text in rows:
+                        tokens = tokenize(text)
+                        if not index.contains(msg_id, tokens):
+                            index.add(msg_id, tokens)
+                    if rows:
+                        index.last_id = max(index.last_id, rows[-1][0])
+                if len(rows) < self.chunk_size:
+                    return
+
+    def _load(self, room_id: int) -> RoomIndex:
+        index = RoomIndex()
+        index.caught_up_at = time.monotonic()
+        with self.session_factory() as session:
+            while True:
+                rows = self._rows(session, room_id, index.last_id)
+                for msg_id, text in rows:
+                    index.add(msg_id, tokenize(text))
+                if rows:
+                    index.last_id = rows[-1][0]
+                if len(rows) < self.chunk_size:
+                    return index
+
+    def search(self, room_id: int, query: str, limit: int) -> list:
+        return self.room(room_id).search(tokenize(query), limit,
+                                         self.rank_window)
+
+
+search_index = InvertedIndex()
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _index_committed_messages(session):
+    for room_id, msg_id, text in session.info.pop('inserted_messages', ()):
+        search_index.add(room_id, msg_id, text)
+    for room_id, msg_ids, text in session.info.pop('deleted_messages', ()):
+        search_index.remove(room_id, msg_ids, text)
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _forget_rolled_back_messages(session):
+    session.info.pop('inserted_messages', None)
+    session.info.pop('deleted_messages', None)
+
+
+def search_room_messages(session: Session, room_id: int, query: str,
+                         limit: int = 20, offset: int = 0) -> list:
+    """
+    Messages of the room matching every word of the query, best match first.
+    :param session:
+    :param room_id:
+    :param query: words to look for
+    :param limit: page size
+    :param offset: number of results to skip
+    :return: list of SearchResult
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        # Inlined so the expression matches the one of the index.
+        config = literal_column(f"'{SEARCH_CONFIG}'")
+        vector = func.to_tsvector(config, Message.msg)
+        tsquery = func.plainto_tsquery(config, query)
+        rank = func.ts_rank(vector, tsquery).label('rank')
+        rows = session.query(Message, rank).join(
+            ConversationMessage, ConversationMessage.message_id == Message.id
+        ).filter(ConversationMessage.conversation_id == room_id,
+                 vector.op('@@')(tsquery)).order_by(
+            rank.desc(), Message.id.desc()).limit(limit).offset(offset).all()
+        return [SearchResult(message, rank) for message, rank in rows]
+    while True:
+        ranked = search_index.search(room_id, query, offset + limit)[offset:]
+        if not ranked:
+            return []
+        messages = {message.id: message for message in session.query(
+            Message).join(ConversationMessage,
+                          ConversationMessage.message_id == Message.id
+                          ).filter(
+            ConversationMessage.conversation_id == room_id,
+            Message.id.in_([msg_id for msg_id, _ in ranked]))}
+        gone = [msg_id for msg_id, _ in ranked if msg_id not in messages]
+        if not gone:
+            return [SearchResult(messages[msg_id], rank)
+                    for msg_id, rank in ranked]
+        # Deleted or archived by another worker, dropped and searched
+        # again so the page is not short.
+        search_index.remove(room_id, gone)
@@ -1,12 +1,28 @@
+import os
+import json
 import jwt
+import logging
 import random
 import string
+import time
 from datetime import datetime
 from functools import wraps
 from flask import (
     Flask,
+    Response,
+    g,
     request,
-    jsonify,
+)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from cas.cache import TTLCache
+from cas.metrics import (
+    auth_failures,
+    error_responses,
 )
 from cas.database import (
     Session,
@@ -14,31 +30,102 @@ from cas.database import (
     get_user_by_id,
 )
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+# 'rotating' re-keys the user on every request, 'expiring' hands out tokens
+# with an exp claim and only re-keys them close to expiry.
+app.config['AUTH_MODE'] = os.environ.get('AUTH_MODE', 'rotating')
+app.config['AUTH_TOKEN_TTL'] = int(os.environ.get('AUTH_TOKEN_TTL', 3600))
+app.config['AUTH_REFRESH_WINDOW'] = int(
+    os.environ.get('AUTH_REFRESH_WINDOW', 300))
+# Key words of the expiring tokens, see cache_key_word.
+key_cache = TTLCache(
+    maxsize=int(os.environ.get('AUTH_KEY_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('AUTH_KEY_CACHE_TTL', 300)))
 
 
 def now() -> datetime:
     return datetime.now()
 
 
+_server_time = (None, None)
+
+
+def server_time() -> str:
+    """
+    The server_time of the responses, formatted once per second.
+    """
+    global _server_time
+    second = int(time.time())
+    cached_second, formatted = _server_time
+    if cached_second != second:
+        formatted = datetime.fromtimestamp(second).strftime(
+            "%Y-%m-%dT%H:%M:%S")
+        _server_time = (second, formatted)
+    return formatted
+
+
+def stdlib_json_dumps(data) -> bytes:
+    return json.dumps(data, separators=(',', ':'), default=str).encode()
+
+
+def orjson_dumps(data) -> bytes:
+    return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+JSON_ENCODERS = {'stdlib': stdlib_json_dumps}
+if orjson is not None:
+    JSON_ENCODERS['orjson'] = orjson_dumps
+_json_encoder = stdlib_json_dumps
+
+
+def json_dumps(data) -> bytes:
+    return _json_encoder(data)
+
+
+def set_json_encoder(name: str):
+    """
+    Select the encoder of the responses, 'orjson' is only available when
+    it is installed, 'auto' picks it when it is.
+    :param name: 'auto', 'orjson' or 'stdlib'
+    """
+    global _json_encoder
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in JSON_ENCODERS else 'stdlib'
+    if name not in JSON_ENCODERS:
+        raise ValueError(f'Unknown or unavailable JSON encoder: {name}')
+    _json_encoder = JSON_ENCODERS[name]
+
+
+set_json_encoder(os.environ.get('JSON_ENCODER', 'auto'))
+
+
 def random_string(size):
     return ''.join(
         [random.choice(string.ascii_letters + string.digits) for n in
          range(size)])
 
 
+def expiring_tokens() -> bool:
+    return app.config['AUTH_MODE'] == 'expiring'
+
+
 def encode_security_token(user_id: int, nick_name: str, key_word: str):
     """
-    The function will encode the security token.
+    The function will encode the security token. In the expiring auth mode
+    the token carries an exp claim.
     :param user_id:
     :param nick_name:
     :param key_word:
     :return: False or hash (str)
     """
-    return jwt.encode(
-        {"user_id": user_id,
-         "nick_name": nick_name,
-         }, key_word, algorithm='HS256')
+    payload = {"user_id": user_id,
+               "nick_name": nick_name,
+               }
+    if expiring_tokens():
+        payload['exp'] = int(time.time()) + app.config['AUTH_TOKEN_TTL']
+    return jwt.encode(payload, key_word, algorithm='HS256')
 
 
 def decode_security_token(token: str, key_word: str):
@@ -56,78 +143,247 @@ def decode_security_token(token: str, key_word: str):
         return Exception(f"Something is wrong with security-token. {str(ex)}")
 
 
-def ok_response(message, status_code=200, **additional_data):
+def message_info(msg) -> dict:
+    return {'ID': msg.id, 'Sender_id': msg.sender_id, 'Message': msg.msg,
+            'Created_at': msg.created_at.isoformat()}
+
+
+def ok_data(message, status_code=200, **additional_data):
     """
-    The function will create https ok response
+    The function will create the body of an ok response
     :param message:
     :param status_code:
     :param additional_data:
-    :return: response object: dict
+    :return: dict
     """
     data = {
         'status': 'OK',
         'code': status_code,
-        'server_time': now().strftime("%Y-%m-%dT%H:%M:%S"),
+        'server_time': server_time(),
         'message': message,
     }
-    for k, v in additional_data.items():
-        data['{0}'.format(k)] = v
-    return jsonify({"info": {'data': data}, "status_code": status_code})
+    data.update(additional_data)
+    return {"info": {'data': data}, "status_code": status_code}
 
 
-def error_response(message, status_code):
+def error_data(message, status_code):
     """
-    The function will create https error response
+    The function will create the body of an error response
     :param message:
     :param status_code:
-    :return: response object: dict
+    :return: dict
     """
+    error_responses.inc(status_code)
     data = {
         'status': 'ERROR',
         'code': status_code,
-        'server_time': now().strftime("%Y-%m-%dT%H:%M:%S"),
+        'server_time': server_time(),
         'message': message
     }
 
-    return jsonify({"info": {'data': data}, "status_code": status_code})
+    return {"info": {'data': data}, "status_code": status_code}
+
+
+def json_response(data, response_class=Response):
+    """
+    The function will encode the data with the selected JSON encoder
+    :param data:
+    :param response_class: Response class of the serving framework
+    :return: response object
+    """
+    response = response_class(_json_encoder(data),
+                              mimetype='application/json')
+    # The HTTP status is always 200, cas.metrics labels by this one.
+    response.body_status_code = data.get('status_code')
+    return response
+
+
+def ok_response(message, status_code=200, **additional_data):
+    """
+    The function will create https ok response
+    :param message:
+    :param status_code:
+    :param additional_data:
+    :return: response object: dict
+    """
+    return json_response(ok_data(message, status_code, **additional_data))
+
+
+def error_response(message, status_code):
+    """
+    The function will create https error response
+    :param message:
+    :param status_code:
+    :return: response object: dict
+    """
+    return json_response(error_data(message, status_code))
+
+
+def rotate_security_token(session: Session, user_id: int):
+    """
+    The function will store a new key word for the user, which invalidates
+    every token signed with the old one.
+    :param session:
+    :param user_id:
+    :return: user id and the new token
+    """
+    user = get_user_by_id(session, user_id)
+    key_word = random_string(64)
+    update_user(session, user, key_word=key_word)
+    # Cached once the transaction has committed, see _cache_committed_keys.
+    session.info.setdefault('key_words', []).append((user.id, key_word))
+    return user.id, encode_security_token(user.id, user.nick_name, key_word)
+
+
+def token_needs_refresh(payload: dict) -> bool:
+    """
+    Rotating tokens are re-keyed on every request, expiring ones only once
+    they get close to their expiry.
+    """
+    if not expiring_tokens():
+        return True
+    return payload.get('exp', 0) - time.time() <= \
+        app.config['AUTH_REFRESH_WINDOW']
 
 
 def refresh_security_token():
     try:
         user_id = int(request.headers.get('user_id'))
-        with Session.begin() as session:
-            user = get_user_by_id(session, user_id)
-            update_user(session, user, key_word=random_string(64))
-            token = encode_security_token(user.id, user.nick_name,
-                                          user.key_word)
-            return ok_response(
-                message='Security token has successfully updated!',
-                **{'User_id': user.id, 'Authorization': token})
-    except BaseException as ex:
-        print(ex)
+        if token_needs_refresh(g.get('auth_payload') or {}):
+            with Session.begin() as session:
+                user_id, token = rotate_security_token(session, user_id)
+        else:
+            token = request.headers.get('authorization')
+        return ok_response(
+            message='Security token has successfully updated!',
+            **{'User_id': user_id, 'Authorization': token})
+    except BaseException:
+        logger.exception('Refreshing the security token failed')
         return error_response(
             message='Something went wrong refreshing the security token',
             status_code=500)
 
 
+def token_payload(user_id: int, auth_token: str, key_word: str):
+    """
+    The function will decode the token and check it belongs to the user.
+    :param user_id:
+    :param auth_token:
+    :param key_word:
+    :return: None or user data (dict)
+    """
+    payload = decode_security_token(auth_token, key_word)
+    if isinstance(payload, dict) and payload.get('user_id') == user_id:
+        return payload
+    return None
+
+
+def cache_key_word(user_id: int, key_word: str):
+    """
+    Only expiring tokens are verified against cached key words. A rotating
+    token is checked against the current key word on every request, the
+    user may have been re-keyed by another worker since and the old token
+    must not be accepted again.
+    """
+    if expiring_tokens():
+        key_cache.set(user_id, key_word)
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _cache_committed_keys(session):
+    for user_id, key_word in session.info.pop('key_words', ()):
+        cache_key_word(user_id, key_word)
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _forget_rolled_back_keys(session):
+    session.info.pop('key_words', None)
+
+
+def verify_cached_security_token(user_id: int, auth_token: str):
+    """
+    The function will verify the token against the cached key word, a key
+    word that no longer matches is evicted, e.g. after the token was
+    rotated by another worker.
+    :param user_id:
+    :param auth_token:
+    :return: None or user data (dict)
+    """
+    if not expiring_tokens():
+        return None
+    key_word = key_cache.get(user_id)
+    if key_word is None:
+        return None
+    payload = token_payload(user_id, auth_token, key_word)
+    if payload is None:
+        key_cache.pop(user_id)
+    return payload
+
+
+def verify_security_token(user_id: int, auth_token: str):
+    """
+    The function will verify the security token of the user. Key words of
+    expiring tokens are served from the cache and only loaded from the
+    database on a miss.
+    :param user_id:
+    :param auth_token:
+    :return: None or user data (dict)
+    """
+    payload = verify_cached_security_token(user_id, auth_token)
+    if payload is not None:
+        return payload
+    with Session.begin() as session:
+        user = get_user_by_id(session, user_id)
+        if not user or not user.key_word:
+            return None
+        key_word = user.key_word
+    cache_key_word(user_id, key_word)
+    return token_payload(user_id, auth_token, key_word)
+
+
+def acts_as(user_id: int, view_args: dict, data) -> bool:
+    """
+    The function will check the user_id of the path and of the body, where
+    given, are the user the security token was verified for.
+    :param user_id: from the user_id header
+    :param view_args:
+    :param data: json body
+    :return: bool
+    """
+    claimed = [(view_args or {}).get('user_id')]
+    if isinstance(data, dict):
+        claimed.append(data.get('user_id'))
+    try:
+        return all(int(value) == user_id for value in claimed
+                   if value is not None)
+    except (TypeError, ValueError):
+        return False
+
+
 def authorization(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         try:
-            data = request.get_json()
             user_id = int(request.headers.get('user_id'))
             auth_token = request.headers.get('authorization')
-            with Session.begin() as session:
-                user = get_user_by_id(session, data.get('user_id'))
-                key_word = user.key_word
-                session.commit()
-            response = decode_security_token(auth_token, key_word)
-            if response.get('user_id') == user_id:
-                return f(*args, **kwargs)
-        except Exception as ex:
-            print(ex)
+            payload = verify_security_token(user_id, auth_token)
+        except Exception:
+            logger.exception('Verifying the security token failed')
+            payload = None
+        if payload is None:
+            auth_failures.inc()
             return error_response(
                 message=f'Authorization error: wrong security-token',
                 status_code=401)
+        if not acts_as(user_id, request.view_args,
+                       request.get_json(silent=True)):
+            auth_failures.inc()
+            return error_response(
+                message='Authorization error: user_id does not match the '
+                        'security-token',
+                status_code=403)
+        g.auth_payload = payload
+        g.auth_user_id = user_id
+        return f(*args, **kwargs)
 
     return decorated
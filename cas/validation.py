@@ -1,5 +1,9 @@
+from typing import Optional
 from pydantic import (
     BaseModel,
+    conint,
+    conlist,
+    constr,
     validator,
     ValidationError,
 )
@@ -38,8 +42,51 @@ class RoomJoinLeave(BaseModel):
     room_id: int
 
 
+# Fits messages.msg, PostgreSQL rejects longer ones.
+MessageText = constr(max_length=32)
+# Fit the users and conversations columns in the same way.
+NickName = constr(max_length=32)
+Email = constr(max_length=32)
+RoomName = constr(max_length=32)
+
+
 class MessageCheck(RoomJoinLeave):
-    msg: str
+    msg: MessageText
+
+
+class MessagesCheck(RoomJoinLeave):
+    msgs: conlist(MessageText, min_items=1, max_items=500)
+
+
+class MarkReadCheck(RoomJoinLeave):
+    msg_id: Optional[int] = None
+
+
+class RetentionCheck(RoomJoinLeave):
+    # None keeps the messages forever.
+    days: Optional[conint(ge=1)] = None
+
+
+class ImportUserCheck(BaseModel):
+    id: str
+    nick_name: NickName
+    email: Email
+
+
+class ImportRoomCheck(BaseModel):
+    id: str
+    name: RoomName
+
+
+class ImportMemberCheck(BaseModel):
+    user: str
+    room: str
+
+
+class ImportMessageCheck(BaseModel):
+    room: str
+    sender: Optional[str] = None
+    msg: MessageText
 
 
 def validation_check(data: dict, checker):
@@ -0,0 +1,131 @@
+import json
+import unittest
+from unittests.utils import ApiUnittest
+
+
+class Api(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        self.ana = self.api_user('Ana')
+        self.bob = self.api_user('Bob')
+
+    def test_room_lifecycle(self):
+        room = self.ana.call('POST', '/create_room', json={
+            'user_id': self.ana.id, 'room_name': 'Science'})['Info']['Room']
+        room_id = room['ID']
+        self.bob.call('POST', '/join_room', json={
+            'user_id': self.bob.id, 'room_id': room_id})
+        self.bob.call('POST', '/join_room', 400, json={
+            'user_id': self.bob.id, 'room_id': room_id})
+        self.ana.call('POST', '/send_msg', json={
+            'user_id': self.ana.id, 'room_id': room_id, 'msg': 'hello'})
+        sent = self.ana.call('POST', '/send_msgs', json={
+            'user_id': self.ana.id, 'room_id': room_id,
+            'msgs': ['one', 'two']})['Messages']
+        self.assertEqual([msg['Message'] for msg in sent], ['one', 'two'])
+
+        unread = self.bob.call('GET', f'/unread/user_id/{self.bob.id}')
+        self.assertEqual(unread['Unread'], {str(room_id): 3})
+        rooms = self.bob.call('GET', f'/list_con/user_id/{self.bob.id}')
+        summary, = rooms['Conversations_info']['summaries']
+        self.assertEqual((summary['Members'], summary['Unread'],
+                          summary['Last_message']['Message']), (2, 3, 'two'))
+        history = self.bob.call('GET', f'/history/room/{room_id}')
+        self.assertEqual([msg['Message'] for msg in history['Messages']],
+                         ['two', 'one', 'hello'])
+        found = self.bob.call('GET', f'/search/room/{room_id}?q=hello')
+        self.assertEqual([msg['Message'] for msg in found['Messages']],
+                         ['hello'])
+        read = self.bob.call('POST', '/mark_read', json={
+            'user_id': self.bob.id, 'room_id': room_id})
+        self.assertEqual(read['Unread'], 0)
+
+        self.ana.call('DELETE', f'/delete_msg/user_id/{self.ana.id}'
+                                f'/msg_id/{sent[0]["ID"]}')
+        history = self.ana.call('GET', f'/history/room/{room_id}')
+        self.assertEqual([msg['Message'] for msg in history['Messages']],
+                         ['two', 'hello'])
+        self.bob.call('DELETE', '/leave_room', json={
+            'user_id': self.bob.id, 'room_id': room_id})
+        self.bob.call('GET', f'/history/room/{room_id}', 403)
+        self.ana.call('DELETE', f'/delete_con/user_id/{self.ana.id}'
+                                f'/conv_id/{room_id}')
+        self.ana.call('GET', f'/history/room/{room_id}', 403)
+
+    def test_non_members(self):
+        room_id = self.ana.call('POST', '/create_room', json={
+            'user_id': self.ana.id, 'room_name': 'Private'})['Info']['Room'][
+            'ID']
+        self.bob.call('POST', '/send_msg', 404, json={
+            'user_id': self.bob.id, 'room_id': room_id, 'msg': 'hi'})
+        for path in (f'/history/room/{room_id}',
+                     f'/search/room/{room_id}?q=hi',
+                     f'/export/room/{room_id}',
+                     f'/stream/room/{room_id}'):
+            self.bob.call('GET', path, 403)
+
+    def test_wrong_token(self):
+        self.ana.token = 'wrong'
+        self.ana.call('POST', '/create_room', 401, json={
+            'user_id': self.ana.id, 'room_name': 'Science'})
+
+    def test_forged_user_id(self):
+        room_id = self.ana.call('POST', '/create_room', json={
+            'user_id': self.ana.id, 'room_name': 'Science'})['Info']['Room'][
+            'ID']
+        self.bob.call('POST', '/send_msg', 403, json={
+            'user_id': self.ana.id, 'room_id': room_id, 'msg': 'forged'})
+        self.bob.call('POST', '/create_room', 403, json={
+            'user_id': self.ana.id, 'room_name': 'Forged'})
+        self.bob.call('GET', f'/unread/user_id/{self.ana.id}', 403)
+        self.bob.call('GET', f'/list_con/user_id/{self.ana.id}', 403)
+        self.bob.call('DELETE', f'/delete_con/user_id/{self.ana.id}'
+                                f'/conv_id/{room_id}', 403)
+        history = self.ana.call('GET', f'/history/room/{room_id}')
+        self.assertEqual(history['Messages'], [])
+        rooms = self.ana.call('GET', f'/list_con/user_id/{self.ana.id}')
+        self.assertEqual(len(rooms['Conversations_info']['summaries']), 1)
+
+    def test_page_arguments(self):
+        room_id = self.ana.call('POST', '/create_room', json={
+            'user_id': self.ana.id, 'room_name': 'Science'})['Info']['Room'][
+            'ID']
+        for query in ('', '?q=+', '?q=hi&limit=0', '?q=hi&limit=101',
+                      '?q=hi&offset=-1'):
+            with self.subTest(query=query):
+                self.ana.call('GET', f'/search/room/{room_id}{query}', 400)
+        self.ana.call('GET', f'/history/room/{room_id}?limit=0', 400)
+        page = self.ana.call('GET', f'/search/room/{room_id}?q=hi&limit=1')
+        self.assertEqual((page['Messages'], page['Next_offset']), ([], None))
+
+
+
+class Stream(ApiUnittest):
+    # Quart's test client buffers the whole body, the endless stream is only
+    # read through Flask's.
+    both_apps = False
+
+    def test_member_reads_sent_message(self):
+        ana = self.api_user('Ana')
+        bob = self.api_user('Bob')
+        room_id = ana.call('POST', '/create_room', json={
+            'user_id': ana.id, 'room_name': 'Science'})['Info']['Room']['ID']
+        bob.call('POST', '/join_room', json={
+            'user_id': bob.id, 'room_id': room_id})
+        res = self.http.get(f'/stream/room/{room_id}', headers=ana.headers(),
+                            buffered=False)
+        self.addCleanup(res.close)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        events = iter(res.response)
+        self.assertEqual(next(events), b': connected\n\n')
+        bob.call('POST', '/send_msg', json={
+            'user_id': bob.id, 'room_id': room_id, 'msg': 'hello'})
+        kind, data = next(events).decode().rstrip('\n').split('\n')
+        self.assertEqual(kind, 'event: message')
+        event = json.loads(data[len('data: '):])
+        self.assertEqual((event['Room'], event['User'], event['Message']),
+                         (room_id, {'ID': bob.id, 'Name': 'Bob'}, 'hello'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import (
+    datetime,
+    timedelta,
+)
+from unittest import mock
+from cas import archive
+from cas.archive import (
+    INDEX_FILE,
+    ArchivedMessage,
+    Archiver,
+    MessageArchive,
+)
+from cas.database import (
+    Message,
+    Session,
+    get_room_history,
+    insert_room_messages,
+    set_room_retention,
+)
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+NOW = datetime(2026, 3, 15, 12)
+
+
+def archived(msg_id: int, created_at: datetime) -> ArchivedMessage:
+    return ArchivedMessage(msg_id, 1, f'msg {msg_id}', created_at)
+
+
+class Archive(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.archive = MessageArchive(self.root)
+
+    def test_segments_per_month(self):
+        self.archive.append(1, [archived(1, datetime(2026, 1, 5)),
+                                archived(2, datetime(2026, 1, 20)),
+                                archived(3, datetime(2026, 2, 1))])
+        self.archive.append(1, [archived(4, datetime(2026, 2, 2))])
+        self.assertEqual(
+            [(s['bucket'], s['min_id'], s['max_id'], s['count'])
+             for s in self.archive.index(1)],
+            [('2026-01', 1, 2, 2), ('2026-02', 3, 4, 2)])
+        self.assertEqual(sorted(os.listdir(self.archive.room_dir(1))),
+                         ['2026-01.ndjson.gz', '2026-02.ndjson.gz',
+                          'index.json'])
+
+    def test_history_pages_newest_first(self):
+        self.archive.append(1, [archived(n, datetime(2026, 1 + n // 4, 1))
+                                for n in range(1, 10)])
+        self.assertEqual([m.id for m in self.archive.history(1, limit=4)],
+                         [9, 8, 7, 6])
+        self.assertEqual([m.id for m in self.archive.history(1, before=6,
+                                                             limit=4)],
+                         [5, 4, 3, 2])
+        self.assertEqual([m.id for m in self.archive.history(1, before=2)],
+                         [1])
+        self.assertEqual(self.archive.history(2), [])
+
+    def test_repeated_append_is_skipped(self):
+        messages = [archived(1, NOW), archived(2, NOW)]
+        self.assertEqual(self.archive.append(1, messages), 2)
+        self.assertEqual(self.archive.append(1, messages), 0)
+        self.assertEqual([m.id for m in self.archive.history(1)], [2, 1])
+
+    def test_interrupted_append_is_ignored(self):
+        self.archive.append(1, [archived(1, NOW)])
+        path = os.path.join(self.archive.room_dir(1), '2026-03.ndjson.gz')
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(b'{"id": 1, "sender_id": 1, "msg": "x", '
+                                  b'"created_at": "2026-03-15T12:00:00"}\n'
+                                  b'{"id": 2, "sender_id": 1, "msg": "y", '
+                                  b'"created_at": "2026-03-15T12:00:00"}\n')
+                    [:-10])
+        self.assertEqual([(m.id, m.msg) for m in self.archive.history(1)],
+                         [(1, 'msg 1')])
+        self.archive.append(1, [archived(2, NOW)])
+        self.assertEqual([(m.id, m.msg) for m in self.archive.history(1)],
+                         [(2, 'msg 2'), (1, 'msg 1')])
+
+    def test_history_reads_only_the_members_it_needs(self):
+        for first in range(1, 100, 10):
+            self.archive.append(1, [archived(n, NOW)
+                                    for n in range(first, first + 10)])
+        members = self.archive.index(1)[0]['members']
+        self.assertEqual([(m['min_id'], m['max_id']) for m in members],
+                         [(n, n + 9) for n in range(1, 100, 10)])
+        with mock.patch.object(archive, 'read_member',
+                               wraps=archive.read_member) as read_member:
+            page = self.archive.history(1, before=45, limit=12)
+        self.assertEqual([m.id for m in page], list(range(44, 32, -1)))
+        self.assertEqual([call.args[1]['min_id']
+                          for call in read_member.call_args_list], [41, 31])
+
+    def test_history_merges_overlapping_segments(self):
+        self.archive.append(1, [archived(n, datetime(2026, 3, 1))
+                                for n in range(1, 6)])
+        # Imported messages get new ids but keep their old created_at.
+        self.archive.append(1, [archived(100, datetime(2021, 5, 1)),
+                                archived(101, datetime(2021, 5, 2))])
+        self.archive.append(1, [archived(n, datetime(2026, 3, 2))
+                                for n in (200, 201)])
+        self.assertEqual([m.id for m in self.archive.history(1, limit=4)],
+                         [201, 200, 101, 100])
+        self.assertEqual([m.id for m in self.archive.history(1, before=201,
+                                                             limit=3)],
+                         [200, 101, 100])
+        self.assertEqual([m.id for m in self.archive.history(1, before=101)],
+                         [100, 5, 4, 3, 2, 1])
+
+    def test_segments_without_members(self):
+        self.archive.append(1, [archived(n, datetime(2026, 1 + n // 4, 1))
+                                for n in range(1, 10)])
+        path = os.path.join(self.archive.room_dir(1), INDEX_FILE)
+        with open(path) as f:
+            index = json.load(f)
+        for segment in index['segments']:
+            del segment['members']
+        with open(path, 'w') as f:
+            json.dump(index, f)
+        self.assertEqual([m.id for m in self.archive.history(1, limit=4)],
+                         [9, 8, 7, 6])
+        self.assertEqual([m.id for m in self.archive.history(1, before=6,
+                                                             limit=4)],
+                         [5, 4, 3, 2])
+        self.archive.append(1, [archived(10, datetime(2026, 3, 2))])
+        self.assertEqual([m.id for m in self.archive.history(1, limit=2)],
+                         [10, 9])
+
+
+class Archiving(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.archive = MessageArchive(self.root)
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session, conv_name='Science')
+            create_conversation(session, conv_name='Art')
+            for room_id in (1, 2):
+                insert_room_messages(session, room_id, [
+                    {'msg': f'msg {n}', 'sender_id': 1,
+                     'created_at': NOW - timedelta(days=n)}
+                    for n in range(60, 0, -10)])
+            set_room_retention(session, 1, 30)
+
+    def test_expired_messages_move_to_the_archive(self):
+        archiver = Archiver(self.archive, Session, chunk_size=2)
+        self.assertEqual(archiver.archive_expired(NOW), 3)
+        with Session() as session:
+            hot = get_room_history(session, 1)
+            self.assertEqual([m.msg for m in hot],
+                             ['msg 10', 'msg 20', 'msg 30'])
+            self.assertEqual(session.query(Message).count(), 9)
+        self.assertEqual([m.msg for m in self.archive.history(
+            1, before=hot[-1].id)], ['msg 40', 'msg 50', 'msg 60'])
+        self.assertEqual(archiver.archive_expired(NOW), 0)
+
+    def test_default_retention(self):
+        archiver = Archiver(self.archive, Session, default_days=45)
+        self.assertEqual(archiver.archive_expired(NOW), 5)
+        self.assertEqual([m.msg for m in self.archive.history(2)],
+                         ['msg 50', 'msg 60'])
+
+
+if __name__ == '__main__':
+    unittest.main()
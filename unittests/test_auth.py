@@ -0,0 +1,159 @@
+import re
+import time
+import unittest
+from unittest import (
+    TestCase,
+    mock,
+)
+import jwt
+from sqlalchemy import event
+from cas.async_database import get_async_engine
+from cas.database import (
+    Session,
+    User,
+    get_engine,
+)
+from cas.utils import (
+    app,
+    key_cache,
+    rotate_security_token,
+    token_needs_refresh,
+)
+from unittests.utils import (
+    ApiUnittest,
+    AsyncApp,
+)
+
+
+def expiring_mode(test: TestCase):
+    patch = mock.patch.dict(app.config, {'AUTH_MODE': 'expiring',
+                                         'AUTH_TOKEN_TTL': 3600,
+                                         'AUTH_REFRESH_WINDOW': 300})
+    patch.start()
+    test.addCleanup(patch.stop)
+
+
+class RotatingTokens(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        self.ana = self.api_user('Ana')
+        self.path = f'/unread/user_id/{self.ana.id}'
+
+    def test_key_rotated_by_another_worker(self):
+        self.ana.call('GET', self.path)
+        with Session.begin() as session:
+            session.query(User).filter(User.id == self.ana.id).update(
+                {User.key_word: 'rotated elsewhere'})
+        self.ana.call('GET', self.path, 401)
+
+    def test_used_token_is_rejected(self):
+        used = self.ana.token
+        self.ana.call('GET', self.path)
+        self.ana.token = used
+        self.ana.call('GET', self.path, 401)
+
+
+class ExpiringTokens(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        expiring_mode(self)
+        self.ana = self.api_user('Ana')
+        self.path = f'/unread/user_id/{self.ana.id}'
+
+    def key_word(self) -> str:
+        with Session() as session:
+            return session.get(User, self.ana.id).key_word
+
+    def sign(self, expires_in: int) -> str:
+        return jwt.encode({'user_id': self.ana.id, 'nick_name': 'Ana',
+                           'exp': int(time.time()) + expires_in},
+                          self.key_word(), algorithm='HS256')
+
+    def user_statements(self) -> list:
+        """
+        The statements on the users table executed until the test ends.
+        """
+        if isinstance(self, AsyncApp):
+            engine = get_async_engine().sync_engine
+        else:
+            engine = get_engine()
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if re.search(r'\busers\b', statement):
+                statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute',
+                        record)
+        return statements
+
+    def test_exp_claim(self):
+        payload = jwt.decode(self.ana.token, self.key_word(),
+                             algorithms='HS256')
+        self.assertAlmostEqual(payload['exp'], time.time() + 3600, delta=5)
+
+    def test_token_kept_outside_refresh_window(self):
+        token, key_word = self.ana.token, self.key_word()
+        self.ana.call('GET', self.path)
+        self.assertEqual(self.ana.token, token)
+        self.assertEqual(self.key_word(), key_word)
+
+    def test_authorized_without_database(self):
+        self.ana.call('GET', self.path)
+        statements = self.user_statements()
+        self.ana.call('GET', self.path)
+        self.assertEqual(statements, [])
+
+    def test_token_refreshed_in_refresh_window(self):
+        old = self.ana.token = self.sign(expires_in=60)
+        self.ana.call('GET', self.path)
+        self.assertNotEqual(self.ana.token, old)
+        payload = jwt.decode(self.ana.token, self.key_word(),
+                             algorithms='HS256')
+        self.assertAlmostEqual(payload['exp'], time.time() + 3600, delta=5)
+        self.ana.call('GET', self.path)
+        self.ana.token = old
+        self.ana.call('GET', self.path, 401)
+
+    def test_expired_token(self):
+        self.ana.call('GET', self.path)
+        self.ana.token = self.sign(expires_in=-10)
+        self.ana.call('GET', self.path, 401)
+
+    def test_key_cached_after_commit(self):
+        with Session() as session:
+            rotate_security_token(session, self.ana.id)
+            self.assertIsNone(key_cache.get(self.ana.id))
+            session.rollback()
+        self.assertIsNone(key_cache.get(self.ana.id))
+        with Session.begin() as session:
+            rotate_security_token(session, self.ana.id)
+        self.ana.resign()
+        with Session() as session:
+            key_word = session.get(User, self.ana.id).key_word
+        self.assertEqual(key_cache.get(self.ana.id), key_word)
+        self.ana.call('GET', self.path)
+
+
+class TokenRefresh(TestCase):
+
+    def setUp(self):
+        expiring_mode(self)
+
+    def test_expiring_tokens(self):
+        now = time.time()
+        self.assertFalse(token_needs_refresh({'exp': now + 301}))
+        self.assertTrue(token_needs_refresh({'exp': now + 299}))
+        self.assertTrue(token_needs_refresh({'exp': now - 1}))
+        self.assertTrue(token_needs_refresh({}))
+
+    def test_rotating_tokens(self):
+        app.config['AUTH_MODE'] = 'rotating'
+        self.assertTrue(token_needs_refresh({'exp': time.time() + 3600}))
+
+
+if __name__ == '__main__':
+    unittest.main()
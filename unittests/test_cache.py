@@ -0,0 +1,44 @@
+import unittest
+from cas.cache import TTLCache
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_entries_expire(self):
+        timer = FakeTimer()
+        cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+        cache.set(1, 'key')
+        timer.now = 4
+        self.assertEqual(cache.get(1), 'key')
+        timer.now = 5
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.get(1)
+        cache.set(3, 'c')
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertIn(3, cache)
+
+    def test_pop(self):
+        cache = TTLCache()
+        cache.set(1, 'a')
+        self.assertEqual(cache.pop(1), 'a')
+        self.assertIsNone(cache.pop(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import unittest
+from datetime import (
+    datetime,
+    timedelta,
+)
+from unittest import mock
+from sqlalchemy import event
+from cas.database import (
+    ConversationMessage,
+    Message,
+    Session,
+    add_room_member,
+    add_room_message,
+    add_room_messages,
+    get_conv_user_by_ids,
+    get_engine,
+    get_room_summaries,
+    get_unread_counts,
+    insert_room_messages,
+    mark_room_read,
+)
+from cas.utils import now
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+    create_conv_user,
+)
+
+
+class RoomSummaries(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            for n in range(1, 4):
+                create_user(session, name=f'User {n}',
+                            email=f'user{n}@gmail.com')
+            for n in range(1, 4):
+                create_conversation(session, conv_name=f'Room {n}')
+            create_conv_user(session, user_id=1, conv_id=1)
+            create_conv_user(session, user_id=1, conv_id=2)
+            create_conv_user(session, user_id=2, conv_id=1)
+            create_conv_user(session, user_id=3, conv_id=1)
+            create_conv_user(session, user_id=3, conv_id=3)
+            add_room_message(session, 1, 2, 'First', now())
+            add_room_message(session, 1, 3, 'Last', now())
+            add_room_message(session, 3, 3, 'Elsewhere', now())
+
+    def test_summaries(self):
+        with Session.begin() as session:
+            summaries = [(row.room_name, row.members, row.last_message)
+                         for row in get_room_summaries(session, 1)]
+        self.assertEqual(summaries, [('Room 1', 3, 'Last'),
+                                     ('Room 2', 1, None)])
+
+    def test_single_statement(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        engine = get_engine()
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            with Session.begin() as session:
+                get_room_summaries(session, 1)
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        self.assertEqual(len(statements), 1)
+
+
+class UnreadCounts(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            for n in range(1, 4):
+                create_user(session, name=f'User {n}',
+                            email=f'user{n}@gmail.com')
+            create_conversation(session, conv_name='Room 1')
+            create_conversation(session, conv_name='Room 2')
+            add_room_message(session, 1, 1, 'Before anyone joined', now())
+            for user_id in range(1, 4):
+                add_room_member(session, user_id, 1)
+            add_room_member(session, 1, 2)
+
+    def unread(self, user_id):
+        with Session.begin() as session:
+            return {row.room_id: row.unread_count
+                    for row in get_unread_counts(session, user_id)}
+
+    def test_messages_count_for_other_members(self):
+        with Session.begin() as session:
+            add_room_messages(session, 1, 1, ['One', 'Two'], now())
+            add_room_message(session, 1, 2, 'Three', now())
+        self.assertEqual(self.unread(1), {1: 1, 2: 0})
+        self.assertEqual(self.unread(2), {1: 2})
+        self.assertEqual(self.unread(3), {1: 3})
+
+    def test_batch_from_several_senders(self):
+        with Session.begin() as session:
+            insert_room_messages(session, 1, [
+                {'msg': 'Hi', 'created_at': now(), 'sender_id': sender_id}
+                for sender_id in (1, 1, 2)])
+        self.assertEqual(self.unread(1), {1: 1, 2: 0})
+        self.assertEqual(self.unread(2), {1: 2})
+        self.assertEqual(self.unread(3), {1: 3})
+
+    def test_mark_read(self):
+        with Session.begin() as session:
+            ids = add_room_messages(session, 1, 1, ['One', 'Two', 'Three'],
+                                    now())
+        with Session.begin() as session:
+            conv_user = get_conv_user_by_ids(session, 2, 1)
+            cursor = mark_room_read(session, conv_user, ids[0])
+            self.assertEqual((cursor.last_read_message_id,
+                              cursor.unread_count), (ids[0], 2))
+            # Cursors only move forward.
+            cursor = mark_room_read(session, conv_user, ids[0] - 1)
+            self.assertEqual(cursor.unread_count, 2)
+            cursor = mark_room_read(session, conv_user)
+            self.assertEqual((cursor.last_read_message_id,
+                              cursor.unread_count), (ids[-1], 0))
+        self.assertEqual(self.unread(2), {1: 0})
+        self.assertEqual(self.unread(3), {1: 3})
+
+    def test_mark_read_past_the_latest_message(self):
+        with Session.begin() as session:
+            latest = add_room_message(session, 1, 1, 'One', now())
+            elsewhere = add_room_message(session, 2, 1, 'Two', now())
+        with Session.begin() as session:
+            conv_user = get_conv_user_by_ids(session, 2, 1)
+            cursor = mark_room_read(session, conv_user, elsewhere + 1000)
+            self.assertEqual((cursor.last_read_message_id,
+                              cursor.unread_count), (latest, 0))
+        with Session.begin() as session:
+            later = add_room_message(session, 1, 1, 'Three', now())
+        self.assertEqual(self.unread(2), {1: 1})
+        with Session.begin() as session:
+            conv_user = get_conv_user_by_ids(session, 2, 1)
+            cursor = mark_room_read(session, conv_user, later + 1)
+            self.assertEqual((cursor.last_read_message_id,
+                              cursor.unread_count), (later, 0))
+
+
+class InsertRoomMessages(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            for n in range(1, 3):
+                create_user(session, name=f'User {n}',
+                            email=f'user{n}@gmail.com')
+            create_conversation(session, conv_name='Room 1')
+            create_conversation(session, conv_name='Room 2')
+        start = datetime(2026, 10, 18, 12)
+        self.rows = [{'msg': f'msg {n}', 'sender_id': n % 2 + 1,
+                      'created_at': start + timedelta(minutes=n)}
+                     for n in range(5)]
+
+    def paths(self) -> list:
+        """
+        The RETURNING path where the backend has it, and the fallback.
+        """
+        full_returning = get_engine().dialect.full_returning
+        return sorted({full_returning, False}, reverse=True)
+
+    def insert(self, room_id: int, full_returning: bool) -> tuple:
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = get_engine()
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            with mock.patch.object(engine.dialect, 'full_returning',
+                                   full_returning), \
+                    Session.begin() as session:
+                ids = insert_room_messages(session, room_id, self.rows)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        return ids, [statement for statement in statements
+                     if statement.lstrip().upper().startswith(
+                         ('INSERT', 'WITH'))]
+
+    def test_ids_match_the_stored_rows(self):
+        for room_id, full_returning in enumerate(self.paths(), 1):
+            with self.subTest(full_returning=full_returning):
+                ids, _ = self.insert(room_id, full_returning)
+                self.assertEqual(len(set(ids)), len(self.rows))
+                with Session() as session:
+                    stored = session.query(
+                        Message.id, Message.msg, Message.sender_id,
+                        Message.created_at, ConversationMessage.created_at
+                    ).join(ConversationMessage,
+                           ConversationMessage.message_id == Message.id
+                           ).filter(ConversationMessage.conversation_id ==
+                                    room_id).order_by(Message.id).all()
+                self.assertEqual(stored, [
+                    (id_, row['msg'], row['sender_id'], row['created_at'],
+                     row['created_at']) for id_, row in zip(ids, self.rows)])
+
+    def test_round_trips(self):
+        for room_id, full_returning in enumerate(self.paths(), 1):
+            with self.subTest(full_returning=full_returning):
+                _, inserts = self.insert(room_id, full_returning)
+                # One statement, or an executemany for the messages, on
+                # SQLite, or one per message elsewhere, and one for the
+                # links.
+                if full_returning:
+                    expected = 1
+                elif get_engine().dialect.name == 'sqlite':
+                    expected = 2
+                else:
+                    expected = len(self.rows) + 1
+                self.assertEqual(len(inserts), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -71,7 +71,7 @@ class Endpoints(BaseUnittest):
         with Session.begin() as session:
             user = create_user(session)
             email = user.email
-            password = user.email
+            password = user.password
         with app.test_client() as client_test:
             client_test.post('/login',
                              json={"email": email, "password": password})
@@ -0,0 +1,163 @@
+import gc
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import (
+    datetime,
+    timedelta,
+)
+from sqlalchemy import insert
+from cas.archive import (
+    Archiver,
+    MessageArchive,
+    message_archive,
+)
+from cas.database import (
+    ConversationMessage,
+    Message,
+    Session,
+    add_room_member,
+    insert_room_messages,
+    set_room_retention,
+)
+from cas.export import (
+    ChunkEncoder,
+    export_room,
+    wants_gzip,
+)
+from cas.utils import encode_security_token
+from unittests.utils import (
+    ApiUnittest,
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+
+def rss_kb() -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+class Encoder(unittest.TestCase):
+
+    def test_wants_gzip(self):
+        self.assertTrue(wants_gzip('gzip, deflate, br'))
+        self.assertTrue(wants_gzip('br;q=1.0, gzip;q=0.8'))
+        self.assertFalse(wants_gzip('deflate'))
+        self.assertFalse(wants_gzip(None))
+
+    def test_chunks(self):
+        msg = Message(id=1, sender_id=2, msg='Hi', created_at=datetime(
+            2026, 1, 1))
+        encoder = ChunkEncoder(flush_bytes=200)
+        self.assertEqual(encoder.feed([msg]), b'')
+        chunk = encoder.feed([msg] * 3)
+        self.assertEqual(chunk.count(b'\n'), 4)
+        self.assertEqual(json.loads(chunk.splitlines()[0]), {
+            'ID': 1, 'Sender_id': 2, 'Message': 'Hi',
+            'Created_at': '2026-01-01T00:00:00'})
+        self.assertEqual(encoder.finish(), b'')
+
+    def test_gzip(self):
+        msg = Message(id=1, sender_id=2, msg='Hi', created_at=datetime(
+            2026, 1, 1))
+        encoder = ChunkEncoder(compress=True)
+        body = encoder.feed([msg] * 10) + encoder.finish()
+        self.assertEqual(gzip.decompress(body).count(b'\n'), 10)
+
+
+class Export(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.archive = MessageArchive(root)
+        with Session.begin() as session:
+            user = create_user(session, key_word='key')
+            create_conversation(session)
+            add_room_member(session, user.id, 1)
+            insert_room_messages(session, 1, [
+                {'msg': f'msg {n}', 'sender_id': 1,
+                 'created_at': datetime.now() - timedelta(days=n)}
+                for n in range(10, 0, -1)])
+            set_room_retention(session, 1, 5)
+            self.token = encode_security_token(user.id, user.nick_name,
+                                               'key')
+        Archiver(self.archive, Session).archive_expired()
+
+    def lines(self, body: bytes) -> list:
+        return [json.loads(line)['Message'] for line in body.splitlines()]
+
+    def test_archive_then_table(self):
+        self.assertTrue(self.archive.index(1))
+        body = b''.join(export_room(Session, self.archive, 1,
+                                    chunk_rows=3))
+        self.assertEqual(self.lines(body),
+                         [f'msg {n}' for n in range(10, 0, -1)])
+
+    def test_endpoint(self):
+        root = message_archive.root
+        message_archive.root = self.archive.root
+        self.addCleanup(setattr, message_archive, 'root', root)
+        headers = {'user_id': '1', 'authorization': self.token}
+        with self.client() as client:
+            res = client.get('/export/room/1', headers=headers)
+            self.assertEqual(res.mimetype, 'application/x-ndjson')
+            self.assertEqual(len(self.lines(res.data)), 10)
+            res = client.get('/export/room/1', headers={
+                **headers, 'Accept-Encoding': 'gzip'})
+            self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(len(self.lines(gzip.decompress(res.data))), 10)
+            res = client.get('/export/room/2', headers=headers)
+            self.assertEqual(res.json['status_code'], 403)
+
+
+
+@unittest.skipUnless(os.environ.get('CAS_LARGE_TESTS'),
+                     'set CAS_LARGE_TESTS=1 to export a million messages')
+class LargeExport(BaseUnittest):
+    MESSAGES = 1000000
+
+    def test_rss_stays_flat(self):
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session)
+        created_at = datetime.now()
+        for start in range(1, self.MESSAGES + 1, 50000):
+            ids = range(start, min(start + 50000, self.MESSAGES + 1))
+            with Session.begin() as session:
+                session.execute(insert(Message), [
+                    {'id': n, 'sender_id': 1, 'msg': f'message {n}',
+                     'created_at': created_at} for n in ids])
+                session.execute(insert(ConversationMessage), [
+                    {'conversation_id': 1, 'message_id': n,
+                     'created_at': created_at} for n in ids])
+        gc.collect()
+        archive = MessageArchive(tempfile.mkdtemp())
+        for compress in (False, True):
+            baseline = peak = rss_kb()
+            size = lines = 0
+            start = time.perf_counter()
+            for chunk in export_room(Session, archive, 1, compress):
+                size += len(chunk)
+                if not compress:
+                    lines += chunk.count(b'\n')
+                peak = max(peak, rss_kb())
+            print(f'compress={compress}: {size / 2 ** 20:.0f} MiB in '
+                  f'{time.perf_counter() - start:.1f}s, RSS grew '
+                  f'{(peak - baseline) / 1024:.1f} MiB')
+            if not compress:
+                self.assertEqual(lines, self.MESSAGES)
+            self.assertLess(peak - baseline, 32 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
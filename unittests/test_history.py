@@ -0,0 +1,72 @@
+import unittest
+from datetime import (
+    datetime,
+    timedelta,
+)
+from cas.database import (
+    Session,
+    add_room_member,
+    insert_room_messages,
+)
+from unittests.utils import (
+    ApiUnittest,
+    create_conversation,
+)
+
+
+class History(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        self.ana = self.api_user('Ana')
+        self.bob = self.api_user('Bob')
+        start = datetime.now() - timedelta(hours=1)
+        with Session.begin() as session:
+            create_conversation(session)
+            create_conversation(session, 'Empty')
+            add_room_member(session, self.ana.id, 1)
+            add_room_member(session, self.ana.id, 2)
+            self.ids = insert_room_messages(session, 1, [
+                {'msg': f'msg {n}', 'sender_id': self.ana.id,
+                 'created_at': start + timedelta(minutes=n)}
+                for n in range(7)])
+
+    def page(self, query: str = '') -> dict:
+        return self.ana.call('GET', f'/history/room/1{query}')
+
+    def test_first_page(self):
+        data = self.page()
+        self.assertEqual([msg['ID'] for msg in data['Messages']],
+                         self.ids[::-1])
+        self.assertEqual(data['Messages'][0]['Message'], 'msg 6')
+        self.assertIsNone(data['Next_before'])
+
+    def test_before_pages(self):
+        pages = []
+        data = self.page('?limit=3')
+        while True:
+            pages.append([msg['ID'] for msg in data['Messages']])
+            if data['Next_before'] is None:
+                break
+            data = self.page(f'?limit=3&before={data["Next_before"]}')
+        self.assertEqual(pages, [self.ids[6:3:-1], self.ids[3:0:-1],
+                                 self.ids[:1]])
+
+    def test_limit_bounds(self):
+        most = self.app().config['HISTORY_MAX_PAGE_SIZE']
+        self.assertEqual(len(self.page('?limit=1')['Messages']), 1)
+        self.assertEqual(len(self.page(f'?limit={most}')['Messages']), 7)
+        for limit in (0, -1, most + 1):
+            self.ana.call('GET', f'/history/room/1?limit={limit}', 400)
+
+    def test_non_member(self):
+        self.bob.call('GET', '/history/room/1', 403)
+
+    def test_empty_room(self):
+        data = self.ana.call('GET', '/history/room/2')
+        self.assertEqual((data['Messages'], data['Next_before']), ([], None))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
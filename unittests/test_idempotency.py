@@ -0,0 +1,131 @@
+import unittest
+from sqlalchemy import event
+from cas.database import (
+    Message,
+    Session,
+    User,
+    add_room_member,
+    get_engine,
+)
+from cas.idempotency import (
+    key_error,
+    sent_messages,
+)
+from cas.ingest import MessageWriter
+from cas.utils import (
+    encode_security_token,
+    now,
+)
+from unittests.utils import (
+    ApiUnittest,
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+
+class Keys(unittest.TestCase):
+
+    def test_key_error(self):
+        self.assertIsNone(key_error(None))
+        self.assertIsNone(key_error('0b6f4c1e-6f7a-4c36-9f0e-8a1c2d3e4f50'))
+        self.assertIsNotNone(key_error(''))
+        self.assertIsNotNone(key_error('x' * 65))
+        self.assertIsNotNone(key_error('line\nbreak'))
+
+
+class SendMsg(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            user = create_user(session, key_word='key')
+            create_conversation(session)
+            add_room_member(session, user.id, 1)
+            self.token = encode_security_token(user.id, user.nick_name,
+                                               'key')
+
+    def send(self, client, key, msg='Hi', room_id=1):
+        headers = {'user_id': '1', 'authorization': self.token}
+        if key is not None:
+            headers['Idempotency-Key'] = key
+        res = client.post('/send_msg', headers=headers, json={
+            'user_id': 1, 'room_id': room_id, 'msg': msg})
+        data = res.json['info']['data']
+        self.token = (data.get('User') or {}).get('Authorization',
+                                                  self.token)
+        return res
+
+    def messages(self) -> int:
+        with Session() as session:
+            return session.query(Message).count()
+
+    def test_retry_is_replayed_from_memory(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client() as client:
+            res = self.send(client, 'k1')
+            self.assertEqual(res.json['status_code'], 200)
+            self.assertNotIn('Idempotent-Replayed', res.headers)
+            event.listen(get_engine(), 'before_cursor_execute', record)
+            try:
+                res = self.send(client, 'k1')
+            finally:
+                event.remove(get_engine(), 'before_cursor_execute', record)
+        self.assertEqual(res.json['status_code'], 200)
+        self.assertEqual(res.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(res.json['info']['data']['Message'], 'Hi')
+        self.assertFalse([s for s in statements if 'messages' in s])
+        self.assertEqual(self.messages(), 1)
+
+    def test_retry_is_replayed_from_the_database(self):
+        with self.client() as client:
+            self.send(client, 'k1')
+            sent_messages.clear()
+            res = self.send(client, 'k1')
+            self.assertEqual(res.headers['Idempotent-Replayed'], 'true')
+            self.assertEqual(len(sent_messages), 1)
+            self.send(client, 'k2')
+            self.send(client, None)
+            self.send(client, None)
+        self.assertEqual(self.messages(), 4)
+
+    def test_reused_key(self):
+        with self.client() as client:
+            res = self.send(client, 'x' * 100)
+            self.assertEqual(res.json['status_code'], 400)
+            # Error replies carry no new token.
+            with Session() as session:
+                self.token = encode_security_token(
+                    1, 'Pero', session.get(User, 1).key_word)
+            self.send(client, 'k1')
+            res = self.send(client, 'k1', msg='Other')
+            self.assertEqual(res.json['status_code'], 422)
+        self.assertEqual(self.messages(), 1)
+
+
+
+class Writer(BaseUnittest):
+
+    def test_repeated_keys_are_stored_once(self):
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session)
+        writer = MessageWriter(Session, flush_interval=0.05)
+        self.addCleanup(writer.stop)
+        first = [writer.submit(1, 1, f'msg {n}', now(), idempotency_key=key)
+                 for n, key in enumerate(['a', 'b', 'a', None, None])]
+        ids = [future.result(5) for future in first]
+        self.assertEqual(ids[0], ids[2])
+        self.assertEqual(len(set(ids)), 4)
+        again = writer.submit(1, 1, 'msg 1', now(), idempotency_key='b')
+        self.assertEqual(again.result(5), ids[1])
+        with Session() as session:
+            self.assertEqual(session.query(Message).count(), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
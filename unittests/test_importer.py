@@ -0,0 +1,173 @@
+import json
+import unittest
+from unittest import mock
+from cas import config
+from cas.database import (
+    ConversationMessage,
+    ConversationUser,
+    ImportCheckpoint,
+    Message,
+    ReadCursor,
+    Session,
+    User,
+    get_room_history,
+    get_unread_counts,
+)
+from cas.importer import (
+    ImportRecordError,
+    Importer,
+)
+from cas.membership import membership
+from cas.passwords import verify_password
+from unittests.utils import (
+    ApiUnittest,
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+
+def export_lines(messages: int = 5) -> list:
+    records = [
+        {'type': 'user', 'id': 'u1', 'nick_name': 'Ana',
+         'email': 'ana@old.chat'},
+        {'type': 'user', 'id': 'u2', 'nick_name': 'Pero',
+         'email': 'pero.peric@gmail.com'},
+        {'type': 'room', 'id': 'r1', 'name': 'general'},
+        {'type': 'room', 'id': 'r2', 'name': 'Science'},
+        {'type': 'member', 'user': 'u1', 'room': 'r1'},
+        {'type': 'member', 'user': 'u2', 'room': 'r1'},
+        {'type': 'member', 'user': 'u1', 'room': 'r2'},
+    ] + [
+        {'type': 'message', 'room': 'r1', 'sender': f'u{n % 2 + 1}',
+         'msg': f'old {n}', 'created_at': f'2021-05-04T10:00:{n:02}'}
+        for n in range(messages)
+    ]
+    return [json.dumps(record) + '\n' for record in records]
+
+
+class Importing(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session, conv_name='Science')
+
+    def test_ids_are_remapped(self):
+        stats = Importer(Session, batch_rows=3).run(export_lines())
+        self.assertEqual(stats.counts, {'user': 1, 'room': 1, 'member': 3,
+                                        'message': 5})
+        self.assertEqual(stats.lines, 12)
+        with Session() as session:
+            ana = session.query(User).filter_by(email='ana@old.chat').one()
+            self.assertEqual(ana.id, 2)
+            self.assertFalse(verify_password('', ana.password))
+            # Existing user and room were reused.
+            self.assertEqual(session.query(User).count(), 2)
+            self.assertEqual(sorted(session.query(
+                ConversationUser.user_id, ConversationUser.conversation_id)),
+                [(1, 2), (2, 1), (2, 2)])
+            history = get_room_history(session, 2)
+            self.assertEqual([(m.sender_id, m.msg) for m in history],
+                             [(1, f'old {n}') if n % 2 else (2, f'old {n}')
+                              for n in range(4, -1, -1)])
+            # Imported history counts as read.
+            self.assertEqual(
+                [(row.room_id, row.unread_count, row.last_read_message_id)
+                 for row in get_unread_counts(session, 2)],
+                [(1, 0, None), (2, 0, 5)])
+        self.assertTrue(membership.is_member(2, 2))
+
+    def test_resume_after_interruption(self):
+        lines = export_lines(10)
+        importer = Importer(Session, batch_rows=4)
+        importer.start()
+        importer.write_batch(lines[:4], 4)
+        importer.write_batch(lines[4:8], 8)
+        with Session() as session:
+            self.assertEqual(session.get(ImportCheckpoint, 'default').line, 8)
+        stats = Importer(Session, batch_rows=4).run(lines)
+        self.assertEqual(stats.resumed_from, 8)
+        self.assertEqual(stats.counts['message'], 9)
+        with Session() as session:
+            self.assertEqual(session.query(Message).count(), 10)
+            self.assertEqual(session.query(ConversationMessage).filter_by(
+                conversation_id=2).count(), 10)
+            self.assertEqual(session.query(ReadCursor).count(), 3)
+
+    def test_failed_batch_is_rolled_back(self):
+        lines = export_lines(2) + [json.dumps({
+            'type': 'message', 'room': 'r9', 'sender': 'u1', 'msg': 'x',
+            'created_at': '2021-05-04T10:00:00'})]
+        importer = Importer(Session, batch_rows=5)
+        with self.assertRaises(ImportRecordError) as context:
+            importer.run(lines)
+        self.assertEqual(context.exception.line, 10)
+        with Session() as session:
+            self.assertEqual(session.get(ImportCheckpoint, 'default').line, 5)
+            self.assertEqual(session.query(Message).count(), 0)
+
+    def test_invalid_records(self):
+        long = 'x' * 33
+        for record in ({'type': 'user', 'id': 'u3'},
+                       {'type': 'user', 'id': 'u3', 'nick_name': long,
+                        'email': 'long@old.chat'},
+                       {'type': 'user', 'id': 'u3', 'nick_name': 'Long',
+                        'email': f'{long}@old.chat'},
+                       {'type': 'room', 'id': 'r3'},
+                       {'type': 'room', 'id': 'r3', 'name': long},
+                       {'type': 'member', 'user': 'u1'},
+                       {'type': 'message', 'room': 'r1', 'sender': 'u1',
+                        'created_at': '2021-05-04T10:00:00'},
+                       {'type': 'message', 'room': 'r1', 'sender': 'u1',
+                        'msg': long, 'created_at': '2021-05-04T10:00:00'}):
+            with self.subTest(record=record):
+                lines = export_lines(2) + [json.dumps(record)]
+                with self.assertRaises(ImportRecordError) as context:
+                    Importer(Session, source=str(record)).run(lines)
+                self.assertEqual(context.exception.line, 10)
+        with Session() as session:
+            self.assertEqual(session.query(Message).count(), 0)
+
+    def test_sources_are_separate(self):
+        Importer(Session, source='a').run(export_lines(1))
+        stats = Importer(Session, source='b').run(export_lines(1))
+        self.assertEqual(stats.resumed_from, 0)
+        self.assertEqual(stats.counts['user'], 0)
+        with Session() as session:
+            self.assertEqual(session.query(Message).count(), 2)
+
+
+class Endpoint(ApiUnittest):
+
+    def test_import(self):
+        body = ''.join(export_lines(3))
+        with self.client() as client:
+            with mock.patch.object(config, 'IMPORT_TOKEN', ''):
+                res = client.post('/import', data=body,
+                                  headers={'import_token': ''})
+                self.assertEqual(res.json['status_code'], 403)
+            with mock.patch.object(config, 'IMPORT_TOKEN', 'secret'):
+                res = client.post('/import', data=body,
+                                  headers={'import_token': 'wrong'})
+                self.assertEqual(res.json['status_code'], 403)
+                res = client.post('/import?source=old', data=body,
+                                  headers={'import_token': 'secret'})
+        self.assertEqual(res.json['status_code'], 200)
+        data = res.json['info']['data']
+        self.assertEqual(data['Messages'], 3)
+        self.assertEqual(data['Lines'], 10)
+
+    def test_invalid_record(self):
+        body = json.dumps({'type': 'user', 'id': 'u1'})
+        with self.client() as client, \
+                mock.patch.object(config, 'IMPORT_TOKEN', 'secret'):
+            res = client.post('/import', data=body,
+                              headers={'import_token': 'secret'})
+        self.assertEqual(res.json['status_code'], 400)
+        self.assertIn('Line 1', res.json['info']['data']['message'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest import mock
+from sqlalchemy.exc import IntegrityError
+from cas.app import message_writer
+from cas.database import (
+    Message,
+    Session,
+    add_room_member,
+)
+from cas.ingest import MessageWriter
+from cas.utils import now
+from unittests.utils import (
+    ApiUnittest,
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+
+class Writer(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session)
+        self.commits = []
+
+    def writer(self) -> MessageWriter:
+        writer = MessageWriter(Session, flush_interval=0.5, batch_rows=3,
+                               on_commit=self.commits.append)
+        self.addCleanup(writer.stop)
+        return writer
+
+    def messages(self) -> list:
+        with Session() as session:
+            return [msg for msg, in session.query(Message.msg).order_by(
+                Message.id)]
+
+    def test_batch_is_one_transaction(self):
+        writer = self.writer()
+        futures = [writer.submit(1, 1, f'msg {n}', now()) for n in range(3)]
+        ids = [future.result(5) for future in futures]
+        self.assertEqual(len(self.commits), 1)
+        self.assertEqual([msg_id for item, msg_id in self.commits[0]], ids)
+        self.assertEqual(self.messages(), ['msg 0', 'msg 1', 'msg 2'])
+
+    def test_failed_message_leaves_the_batch_alone(self):
+        writer = self.writer()
+        futures = [writer.submit(room_id, 1, msg, now())
+                   for room_id, msg in ((1, 'first'), (99, 'lost'),
+                                        (1, 'last'))]
+        self.assertIsInstance(futures[0].result(5), int)
+        self.assertIsInstance(futures[2].result(5), int)
+        self.assertIsInstance(futures[1].exception(5), IntegrityError)
+        self.assertEqual(len(self.commits), 2)
+        self.assertEqual(self.messages(), ['first', 'last'])
+
+
+class Queued(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.dict(self.app().config, INGEST_MODE='queued')
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(message_writer.stop)
+        self.ana = self.api_user('Ana')
+        with Session.begin() as session:
+            create_conversation(session)
+            add_room_member(session, self.ana.id, 1)
+
+    def test_reply_before_the_flush(self):
+        data = self.ana.call('POST', '/send_msg', json={
+            'user_id': self.ana.id, 'room_id': 1, 'msg': 'queued'})
+        self.assertEqual(data['Message'], 'queued')
+        message_writer.stop(5)
+        with Session() as session:
+            self.assertEqual(session.query(Message.msg).scalar(), 'queued')
+
+    def test_too_long_message(self):
+        self.ana.call('POST', '/send_msg', 400, json={
+            'user_id': self.ana.id, 'room_id': 1, 'msg': 'x' * 33})
+        message_writer.stop(5)
+        with Session() as session:
+            self.assertEqual(session.query(Message).count(), 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+from cas.database import (
+    Session,
+    add_room_member,
+)
+from cas.instrumentation import (
+    reset_route_stats,
+    route_stats,
+)
+from cas.metrics import registry
+from unittests.utils import (
+    ApiUnittest,
+    create_conversation,
+)
+
+
+class Instrumentation(ApiUnittest):
+    # The SQL statistics are recorded by the Flask app only.
+    both_apps = False
+
+    def setUp(self):
+        super().setUp()
+        reset_route_stats()
+        self.addCleanup(reset_route_stats)
+        self.ana = self.api_user('Ana')
+        with Session.begin() as session:
+            create_conversation(session)
+            add_room_member(session, self.ana.id, 1)
+
+    def test_statements_per_route(self):
+        self.ana.call('GET', '/history/room/1')
+        self.ana.call('GET', '/history/room/1')
+        stats = route_stats()['/history/room/<int:room_id>']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['statements'], 0)
+        self.assertEqual(stats['statements_per_request'],
+                         stats['statements'] / 2)
+        self.assertIn('cas_db_statements_total{route="/history/room/'
+                      '<int:room_id>"} %d' % stats['statements'],
+                      registry.render())
+
+    def test_unmatched_urls_share_a_label(self):
+        for n in range(3):
+            self.http.get(f'/no/such/page/{n}')
+        stats = route_stats()
+        self.assertEqual(stats['unmatched']['requests'], 3)
+        self.assertFalse([route for route in stats
+                          if route.startswith('/no/')])
+        self.assertIn('cas_db_statements_total{route="unmatched"} 0',
+                      registry.render())
+
+    def test_headers(self):
+        res = self.http.get('/history/room/1', headers=self.ana.headers())
+        self.assertNotIn('X-DB-Statements', res.headers)
+        self.ana.resign()
+        with mock.patch.dict(self.app().config, SQL_STATS_HEADERS=True):
+            res = self.http.get('/history/room/1',
+                                headers=self.ana.headers())
+        self.assertEqual(res.json['status_code'], 200)
+        self.assertGreater(int(res.headers['X-DB-Statements']), 0)
+        self.assertGreaterEqual(float(res.headers['X-DB-Time-ms']),
+                                float(res.headers['X-DB-Slowest-ms']))
+
+    def test_repeated_statements_are_logged(self):
+        with mock.patch.dict(self.app().config, SQL_N_PLUS_ONE_THRESHOLD=1), \
+                self.assertLogs('cas.instrumentation', 'WARNING') as logs:
+            self.ana.call('GET', '/history/room/1')
+        self.assertIn('Possible N+1 on /history/room/<int:room_id>',
+                      logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from sqlalchemy import event
+from cas.database import (
+    Session,
+    add_room_member,
+    delete_conversation_by_id,
+    get_engine,
+    remove_room_member,
+)
+from cas.membership import (
+    MembershipIndex,
+    membership,
+)
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+    create_conv_user,
+)
+
+
+class MembershipIndexTest(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            for n in range(1, 4):
+                create_user(session, name=f'User {n}',
+                            email=f'user{n}@gmail.com')
+            create_conversation(session, conv_name='Room 1')
+            create_conversation(session, conv_name='Room 2')
+            create_conv_user(session, user_id=1, conv_id=1)
+            create_conv_user(session, user_id=2, conv_id=1)
+            create_conv_user(session, user_id=2, conv_id=2)
+
+    def test_warms_from_the_database(self):
+        self.assertEqual(membership.members(1), {1, 2})
+        self.assertEqual(membership.rooms(2), {1, 2})
+        self.assertFalse(membership.contains(3, 1))
+
+    def test_hits_do_not_query(self):
+        membership.warm()
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        event.listen(get_engine(), 'before_cursor_execute', count)
+        try:
+            self.assertTrue(membership.is_member(1, 1))
+        finally:
+            event.remove(get_engine(), 'before_cursor_execute', count)
+        self.assertEqual(statements, [])
+
+    def test_follows_committed_changes(self):
+        membership.warm()
+        with Session.begin() as session:
+            add_room_member(session, 3, 2)
+            self.assertTrue(remove_room_member(session, 1, 1))
+            self.assertFalse(remove_room_member(session, 1, 2))
+        self.assertEqual(membership.rooms(3), {2})
+        self.assertEqual(membership.members(1), {2})
+        with Session.begin() as session:
+            delete_conversation_by_id(session, 2)
+        self.assertEqual(membership.members(2), frozenset())
+        self.assertEqual(membership.rooms(3), frozenset())
+
+    def test_ignores_rolled_back_changes(self):
+        membership.warm()
+        session = Session()
+        add_room_member(session, 3, 1)
+        session.flush()
+        session.rollback()
+        session.close()
+        self.assertFalse(membership.contains(3, 1))
+
+    def test_miss_is_confirmed_against_the_database(self):
+        membership.warm()
+        # Joined by another process.
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql(
+                'INSERT INTO user_conversations (user_id, conversation_id) '
+                'VALUES (3, 2)')
+        self.assertFalse(membership.contains(3, 2))
+        self.assertTrue(membership.is_member(3, 2))
+        self.assertTrue(membership.contains(3, 2))
+
+    def test_expired_hit_is_confirmed_against_the_database(self):
+        clock = [0.0]
+        index = MembershipIndex(ttl=10, timer=lambda: clock[0])
+        index.warm()
+        # Left through another process.
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql(
+                'DELETE FROM user_conversations WHERE user_id = 2 '
+                'AND conversation_id = 1')
+        clock[0] = 9
+        self.assertTrue(index.is_member(2, 1))
+        clock[0] = 10
+        self.assertFalse(index.contains(1, 1))
+        self.assertFalse(index.is_member(2, 1))
+        self.assertEqual(index.rooms(2), {2})
+        self.assertEqual(index.members(1), {1})
+        # Confirmed again, trusted for another ttl.
+        self.assertTrue(index.is_member(1, 1))
+        clock[0] = 19
+        self.assertTrue(index.contains(1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from cas.metrics import (
+    Counter,
+    Histogram,
+    Registry,
+)
+from unittests.utils import ApiUnittest
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.register(Counter('requests_total', 'Requests.',
+                                            ('route',)))
+        counter.inc('/send_msg')
+        counter.inc('/send_msg', amount=2)
+        self.assertEqual(counter.value('/send_msg'), 3)
+        self.assertEqual(registry.render(),
+                         '# HELP requests_total Requests.\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{route="/send_msg"} 3\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        histogram = registry.register(Histogram('latency_seconds',
+                                                'Latency.', buckets=(1, 2)))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.count(), 4)
+        self.assertEqual(registry.render().splitlines()[2:], [
+            'latency_seconds_bucket{le="1"} 1',
+            'latency_seconds_bucket{le="2"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_count 4',
+            'latency_seconds_sum 6.5',
+        ])
+
+    def test_label_values_are_escaped(self):
+        counter = Counter('errors_total', 'Errors.', ('message',))
+        counter.inc('say "hi"\n')
+        self.assertEqual(list(counter.samples()), [
+            ('errors_total', '{message="say \\"hi\\"\\n"}', 1)])
+
+
+
+class Scrape(ApiUnittest):
+
+    def scrape(self) -> dict:
+        res = self.http.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        samples = {}
+        for line in res.data.decode().splitlines():
+            if not line.startswith('#'):
+                sample, value = line.rsplit(' ', 1)
+                samples[sample] = float(value)
+        return samples
+
+    def test_requests_labelled_by_body_status(self):
+        ana = self.api_user('Ana')
+        bob = self.api_user('Bob')
+        room_id = ana.call('POST', '/create_room', json={
+            'user_id': ana.id, 'room_name': 'Science'})['Info']['Room']['ID']
+        sample = ('cas_http_requests_total{route="/history/room/'
+                  '<int:room_id>",method="GET",status="%d"}')
+        before = self.scrape()
+        ana.call('GET', f'/history/room/{room_id}')
+        bob.call('GET', f'/history/room/{room_id}', 403)
+        bob.call('GET', f'/history/room/{room_id}', 403)
+        after = self.scrape()
+        for status, count in ((200, 1), (403, 2)):
+            self.assertEqual(after[sample % status]
+                             - before.get(sample % status, 0), count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+import unittest
+from sqlalchemy import inspect
+from cas.database import (
+    Base,
+    ConversationMessage,
+    ConversationUser,
+    Message,
+    ReadCursor,
+    Session,
+    User,
+    add_room_message,
+    get_engine,
+    recreate_database,
+)
+from cas.migrations import (
+    MIGRATIONS,
+    add_idempotency_keys,
+    bootstrap_schema,
+    schema_metadata,
+    schema_migrations,
+)
+from cas.utils import now
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+    create_conv_user,
+)
+
+# The tables of the first release, before any migration.
+BASELINE_DDL = [
+    """CREATE TABLE users (
+        id INTEGER PRIMARY KEY,
+        nick_name VARCHAR(32) NOT NULL,
+        password VARCHAR(32) NOT NULL,
+        email VARCHAR(32) NOT NULL,
+        key_word VARCHAR(64))""",
+    """CREATE TABLE messages (
+        id INTEGER PRIMARY KEY,
+        msg VARCHAR(32) NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        sender_id INTEGER REFERENCES users (id) ON DELETE CASCADE)""",
+    """CREATE TABLE conversations (
+        id INTEGER PRIMARY KEY,
+        conversation_name VARCHAR(32) NOT NULL)""",
+    """CREATE TABLE user_conversations (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER REFERENCES users (id) ON DELETE SET NULL,
+        conversation_id INTEGER
+            REFERENCES conversations (id) ON DELETE CASCADE)""",
+    """CREATE TABLE conversation_messages (
+        id INTEGER PRIMARY KEY,
+        message_id INTEGER REFERENCES messages (id) ON DELETE CASCADE,
+        conversation_id INTEGER
+            REFERENCES conversations (id) ON DELETE CASCADE)""",
+]
+
+
+class Migrations(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        schema_metadata.drop_all(get_engine())
+
+    def tearDown(self):
+        schema_metadata.drop_all(get_engine())
+        super().tearDown()
+
+    def test_bootstrap_is_idempotent(self):
+        self.assertEqual(bootstrap_schema(),
+                         [migration.version for migration in MIGRATIONS])
+        self.assertEqual(bootstrap_schema(), [])
+
+    def test_recreate_database_forgets_migrations(self):
+        bootstrap_schema()
+        recreate_database()
+        self.assertEqual(bootstrap_schema(),
+                         [migration.version for migration in MIGRATIONS])
+
+    def test_bootstrap_adds_missing_indexes(self):
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql('DROP INDEX ux_users_email')
+        bootstrap_schema()
+        indexes = {index['name']
+                   for index in inspect(get_engine()).get_indexes('users')}
+        self.assertIn('ux_users_email', indexes)
+
+    def test_read_cursors_are_backfilled(self):
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session)
+            create_conv_user(session)
+            msg_id = add_room_message(session, 1, 1, 'Hello', now())
+        schema_metadata.create_all(get_engine())
+        with get_engine().begin() as connection:
+            connection.execute(schema_migrations.insert(), [
+                {'version': 1, 'name': 'initial schema'},
+                {'version': 2, 'name': 'lookup indexes'}])
+        self.assertIn(3, bootstrap_schema())
+        with Session.begin() as session:
+            cursor = session.query(ReadCursor).one()
+            self.assertEqual((cursor.last_read_message_id,
+                              cursor.unread_count), (msg_id, 0))
+
+    def test_conversation_tombstones(self):
+        schema_metadata.create_all(get_engine())
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql('DROP TABLE conversations')
+            connection.exec_driver_sql(
+                'CREATE TABLE conversations (id INTEGER PRIMARY KEY, '
+                'conversation_name VARCHAR(32) NOT NULL)')
+            connection.exec_driver_sql(
+                'CREATE UNIQUE INDEX ux_conversations_conversation_name '
+                'ON conversations (conversation_name)')
+            connection.execute(schema_migrations.insert(), [
+                {'version': migration.version, 'name': migration.name}
+                for migration in MIGRATIONS if migration.version < 6])
+        self.assertIn(6, bootstrap_schema())
+        inspector = inspect(get_engine())
+        self.assertIn('deleted_at', {column['name'] for column in
+                                     inspector.get_columns('conversations')})
+        self.assertEqual({index['name'] for index in inspector.get_indexes(
+            'conversations')}, {'ux_conversations_live_name',
+                                'ix_conversations_deleted_at'})
+
+    def test_conversation_message_times_are_backfilled(self):
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session)
+            created_at = now()
+            add_room_message(session, 1, 1, 'Hello', created_at)
+            session.query(ConversationMessage).update(
+                {ConversationMessage.created_at: None})
+        schema_metadata.create_all(get_engine())
+        with get_engine().begin() as connection:
+            connection.execute(schema_migrations.insert(), [
+                {'version': migration.version, 'name': migration.name}
+                for migration in MIGRATIONS if migration.version < 10])
+        self.assertIn(10, bootstrap_schema())
+        with Session.begin() as session:
+            self.assertEqual(session.query(
+                ConversationMessage.created_at).scalar(), created_at)
+
+    def test_upgrade_baseline_schema(self):
+        Base.metadata.drop_all(get_engine())
+        with get_engine().begin() as connection:
+            for statement in BASELINE_DDL:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(
+                "INSERT INTO users VALUES (1, 'Ana', 'secret', "
+                "'ana@gmail.com', NULL)")
+            connection.exec_driver_sql(
+                "INSERT INTO conversations VALUES (1, 'Science')")
+            connection.exec_driver_sql(
+                'INSERT INTO user_conversations VALUES (1, 1, 1)')
+            connection.exec_driver_sql(
+                "INSERT INTO messages VALUES "
+                "(1, 'Hello', '2026-10-18 12:00:00', 1)")
+            connection.exec_driver_sql(
+                'INSERT INTO conversation_messages VALUES (1, 1, 1)')
+        self.assertEqual(bootstrap_schema(),
+                         [migration.version for migration in MIGRATIONS])
+        inspector = inspect(get_engine())
+        for table in Base.metadata.sorted_tables:
+            self.assertEqual(
+                {column['name']
+                 for column in inspector.get_columns(table.name)},
+                {column.name for column in table.columns}, table.name)
+            self.assertEqual(
+                {index['name']
+                 for index in inspector.get_indexes(table.name)},
+                {index.name for index in table.indexes}, table.name)
+        with Session.begin() as session:
+            cursor = session.query(ReadCursor).one()
+            self.assertEqual((cursor.last_read_message_id,
+                              cursor.unread_count), (1, 0))
+            self.assertIsNotNone(session.query(
+                ConversationMessage.created_at).scalar())
+            add_room_message(session, 1, 1, 'Again', now())
+
+    def test_upgrade_baseline_with_duplicates(self):
+        Base.metadata.drop_all(get_engine())
+        with get_engine().begin() as connection:
+            for statement in BASELINE_DDL:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(
+                "INSERT INTO users VALUES "
+                "(1, 'Ana', 'secret', 'ana@gmail.com', NULL), "
+                "(2, 'Ana2', 'secret', 'ana@gmail.com', NULL), "
+                "(3, 'Bob', 'secret', 'bob@gmail.com', NULL)")
+            connection.exec_driver_sql(
+                "INSERT INTO conversations VALUES (1, 'Science')")
+            connection.exec_driver_sql(
+                'INSERT INTO user_conversations VALUES '
+                '(1, 1, 1), (2, 2, 1), (3, 3, 1), (4, 3, 1), '
+                '(5, NULL, 1), (6, NULL, 1)')
+            connection.exec_driver_sql(
+                "INSERT INTO messages VALUES "
+                "(1, 'Hello', '2026-10-18 12:00:00', 2)")
+            connection.exec_driver_sql(
+                'INSERT INTO conversation_messages VALUES (1, 1, 1)')
+        self.assertEqual(bootstrap_schema(),
+                         [migration.version for migration in MIGRATIONS])
+        with Session() as session:
+            self.assertEqual(session.query(User.id).order_by(User.id).all(),
+                             [(1,), (3,)])
+            self.assertEqual(session.query(Message.sender_id).scalar(), 1)
+            self.assertEqual(session.query(
+                ConversationUser.id, ConversationUser.user_id).order_by(
+                ConversationUser.id).all(),
+                [(1, 1), (3, 3), (5, None), (6, None)])
+            self.assertEqual(session.query(ReadCursor).count(), 4)
+
+    def test_idempotency_keys_only(self):
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql('DROP TABLE conversation_messages')
+            connection.exec_driver_sql('DROP TABLE messages')
+            connection.exec_driver_sql(BASELINE_DDL[1])
+            connection.exec_driver_sql(BASELINE_DDL[4])
+            add_idempotency_keys(connection)
+        inspector = inspect(get_engine())
+        self.assertIn('idempotency_key', {
+            column['name'] for column in inspector.get_columns('messages')})
+        self.assertEqual({index['name'] for index in inspector.get_indexes(
+            'messages')}, {'ux_messages_sender_id_idempotency_key'})
+        # Left to migration 10.
+        self.assertNotIn('created_at', {
+            column['name']
+            for column in inspector.get_columns('conversation_messages')})
+
+
+if __name__ == '__main__':
+    unittest.main()
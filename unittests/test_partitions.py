@@ -0,0 +1,180 @@
+import unittest
+from datetime import (
+    date,
+    datetime,
+    timedelta,
+)
+from cas.database import (
+    ConversationMessage,
+    Message,
+    Session,
+    get_engine,
+    get_room_history,
+    insert_room_messages,
+)
+from cas.partitions import (
+    LAYOUT_DDL,
+    PartitionManager,
+    add_months,
+    create_partition_ddl,
+    create_partitioned_layout,
+    detach_partition_ddl,
+    month_start,
+    parse_partition_name,
+    partition_name,
+    partitioned_tables,
+)
+from unittests.test_query_plans import (
+    capture_statements,
+    explain,
+)
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+TODAY = date(2026, 10, 18)
+
+
+def months(*pairs) -> set:
+    return {date(year, month, 1) for year, month in pairs}
+
+
+class Naming(unittest.TestCase):
+
+    def test_add_months(self):
+        self.assertEqual(add_months(date(2026, 11, 1), 2), date(2027, 1, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -13),
+                         date(2024, 12, 1))
+
+    def test_partition_names(self):
+        name = partition_name('messages', date(2026, 3, 1))
+        self.assertEqual(name, 'messages_p2026_03')
+        self.assertEqual(parse_partition_name(name),
+                         ('messages', date(2026, 3, 1)))
+        self.assertEqual(
+            parse_partition_name('conversation_messages_p2025_12'),
+            ('conversation_messages', date(2025, 12, 1)))
+        for name in ('messages_default', 'users_p2026_03',
+                     'messages_p2026_13', 'messages_p2026_03_old'):
+            self.assertIsNone(parse_partition_name(name))
+
+    def test_ddl(self):
+        self.assertIn("FOR VALUES FROM ('2026-12-01') TO ('2027-01-01')",
+                      create_partition_ddl('messages', date(2026, 12, 1)))
+        messages = detach_partition_ddl('messages', date(2026, 1, 1))
+        links = detach_partition_ddl('conversation_messages',
+                                     date(2026, 1, 1))
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(len(links), 2)
+        self.assertIn('DROP CONSTRAINT', links[1])
+
+    def test_layout_has_every_column(self):
+        for model, ddl in ((Message, LAYOUT_DDL[0]),
+                           (ConversationMessage, LAYOUT_DDL[1])):
+            for column in model.__table__.columns:
+                self.assertIn(f'{column.name} ', ddl)
+
+
+class Plan(unittest.TestCase):
+
+    def test_creates_ahead(self):
+        manager = PartitionManager(months_ahead=2)
+        attached = {'messages': months((2026, 10), (2026, 11)),
+                    'conversation_messages': months((2026, 10))}
+        create, detach = manager.plan(attached, TODAY)
+        self.assertEqual(create, [date(2026, 11, 1), date(2026, 12, 1)])
+        self.assertEqual(detach, [])
+
+    def test_detaches_past_retention(self):
+        manager = PartitionManager(months_ahead=0, retain_months=2)
+        attached = {table: months((2026, 6), (2026, 7), (2026, 8),
+                                  (2026, 10))
+                    for table in ('messages', 'conversation_messages')}
+        create, detach = manager.plan(attached, TODAY)
+        self.assertEqual(create, [])
+        self.assertEqual(detach, [date(2026, 6, 1), date(2026, 7, 1)])
+
+
+class Layout(BaseUnittest):
+
+    def test_needs_postgresql(self):
+        with get_engine().begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                self.skipTest('only for the other backends')
+            self.assertEqual(partitioned_tables(connection), set())
+            with self.assertRaises(ValueError):
+                create_partitioned_layout(connection, [])
+        self.assertEqual(PartitionManager().maintain(TODAY), ([], []))
+
+
+class History(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        start = datetime.now() - timedelta(days=100)
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session)
+            self.ids = insert_room_messages(session, 1, [
+                {'msg': f'msg {n}', 'sender_id': 1,
+                 'created_at': start + timedelta(days=n, hours=n % 3)}
+                for n in range(100)])
+
+    def test_links_carry_the_message_time(self):
+        with Session() as session:
+            rows = session.query(ConversationMessage.created_at,
+                                 Message.created_at).join(
+                Message, Message.id == ConversationMessage.message_id).all()
+        self.assertEqual(len(rows), 100)
+        for link, message in rows:
+            self.assertEqual(link, message)
+
+    def test_window_pages_match_the_plain_ones(self):
+        with Session() as session:
+            for before in (None, self.ids[-1], self.ids[60], self.ids[5],
+                           self.ids[0]):
+                for limit in (1, 10, 50, 200):
+                    plain = get_room_history(session, 1, before, limit,
+                                             window_days=0)
+                    windowed = get_room_history(session, 1, before, limit,
+                                                window_days=7)
+                    self.assertEqual([msg.id for msg in windowed],
+                                     [msg.id for msg in plain])
+
+
+
+class Pruning(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        this_month = month_start(date.today())
+        self.old_month = add_months(this_month, -3)
+        with get_engine().begin() as connection:
+            if connection.dialect.name != 'postgresql':
+                self.skipTest('needs PostgreSQL')
+            create_partitioned_layout(connection, [
+                add_months(this_month, n) for n in range(-4, 2)])
+        start = datetime.now() - timedelta(days=100)
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session)
+            insert_room_messages(session, 1, [
+                {'msg': f'msg {n}', 'sender_id': 1,
+                 'created_at': start + timedelta(days=n)}
+                for n in range(100)])
+
+    def test_history_window_skips_old_partitions(self):
+        with Session() as session:
+            statements = capture_statements(session, lambda s: (
+                get_room_history(s, 1, limit=3, window_days=7)))
+            plan = '\n'.join(explain(session.connection(), *statements[0]))
+        for table in ('messages', 'conversation_messages'):
+            self.assertIn(partition_name(table, month_start(date.today())),
+                          plan)
+            self.assertNotIn(partition_name(table, self.old_month), plan)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+from unittest import TestCase
+from cas.database import (
+    Session,
+    User,
+    get_user_by_id,
+)
+from cas.passwords import (
+    PasswordHasher,
+    PasswordHasherBusy,
+    START_METHOD,
+    hash_password,
+    needs_rehash,
+    unusable_password,
+    verify_password,
+)
+from cas.rehash import hash_plaintext_passwords
+from unittests.utils import (
+    ApiUnittest,
+    BaseUnittest,
+    create_user,
+)
+
+
+class Passwords(TestCase):
+
+    def test_scrypt_round_trip(self):
+        encoded = hash_password('secret', 'scrypt', 10)
+        self.assertTrue(encoded.startswith('scrypt$10$'))
+        self.assertTrue(verify_password('secret', encoded))
+        self.assertFalse(verify_password('secret2', encoded))
+
+    def test_pbkdf2_round_trip(self):
+        encoded = hash_password('secret', 'pbkdf2_sha256', 1000)
+        self.assertTrue(encoded.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(verify_password('secret', encoded))
+        self.assertFalse(verify_password('', encoded))
+
+    def test_salted(self):
+        self.assertNotEqual(hash_password('secret', 'scrypt', 10),
+                            hash_password('secret', 'scrypt', 10))
+
+    def test_legacy_plaintext(self):
+        self.assertTrue(verify_password('secret', 'secret'))
+        self.assertFalse(verify_password('secret2', 'secret'))
+        self.assertTrue(needs_rehash('secret', 'scrypt', 10))
+
+    def test_needs_rehash(self):
+        encoded = hash_password('secret', 'scrypt', 10)
+        self.assertFalse(needs_rehash(encoded, 'scrypt', 10))
+        self.assertTrue(needs_rehash(encoded, 'scrypt', 11))
+        self.assertTrue(needs_rehash(encoded, 'pbkdf2_sha256', 1000))
+
+    def test_unknown_kdf(self):
+        with self.assertRaises(ValueError):
+            PasswordHasher('md5')
+
+
+class Hasher(TestCase):
+
+    def test_pool(self):
+        hasher = PasswordHasher('scrypt', cost=10, max_workers=2)
+        self.addCleanup(hasher.shutdown)
+        encoded = hasher.hash('secret').result()
+        self.assertTrue(hasher.verify('secret', encoded).result())
+        self.assertFalse(hasher.verify('secret2', encoded).result())
+        self.assertFalse(hasher.needs_rehash(encoded))
+        self.assertEqual(hasher.executor._mp_context.get_start_method(),
+                         START_METHOD)
+        self.assertNotEqual(START_METHOD, 'fork')
+
+    def test_busy(self):
+        hasher = PasswordHasher('pbkdf2_sha256', cost=500000, max_workers=1,
+                                max_pending=1, submit_timeout=0.01)
+        self.addCleanup(hasher.shutdown)
+        pending = hasher.hash('secret')
+        with self.assertRaises(PasswordHasherBusy):
+            hasher.hash('secret')
+        pending.result()
+        self.assertTrue(hasher.hash('secret').result())
+
+
+class HashPlaintext(BaseUnittest):
+
+    def test_hash_plaintext_passwords(self):
+        hashed = hash_password('other', 'pbkdf2_sha256', 1000)
+        with Session.begin() as session:
+            for n, password in enumerate(['secret', 'secret2', hashed,
+                                          unusable_password()]):
+                create_user(session, name=f'u{n}', email=f'u{n}@gmail.com',
+                            password=password)
+        hasher = PasswordHasher('pbkdf2_sha256', cost=1000, max_workers=1)
+        self.addCleanup(hasher.shutdown)
+        progress = []
+        self.assertEqual(hash_plaintext_passwords(
+            hasher, batch_size=1, on_progress=progress.append), 2)
+        self.assertEqual(progress, [1, 2])
+        with Session() as session:
+            passwords = [password for password, in session.query(
+                User.password).order_by(User.id)]
+        self.assertTrue(verify_password('secret', passwords[0]))
+        self.assertTrue(verify_password('secret2', passwords[1]))
+        self.assertFalse(needs_rehash(passwords[1], 'pbkdf2_sha256', 1000))
+        self.assertEqual(passwords[2], hashed)
+        self.assertFalse(verify_password('', passwords[3]))
+        self.assertEqual(hash_plaintext_passwords(hasher), 0)
+
+
+class Login(ApiUnittest):
+
+    def login(self, email, password):
+        with self.client() as client_test:
+            res = client_test.post('/login', json={"email": email,
+                                                   "password": password})
+            return res.json.get('info').get('data')
+
+    def test_wrong_password(self):
+        with Session.begin() as session:
+            create_user(session, password='secret')
+        info = self.login('pero.peric@gmail.com', 'secret2')
+        self.assertEqual(info.get('message'), 'Wrong password!')
+        self.assertEqual(info.get('code'), 401)
+
+    def test_legacy_password_is_rehashed(self):
+        with Session.begin() as session:
+            user_id = create_user(session, password='secret').id
+        info = self.login('pero.peric@gmail.com', 'secret')
+        self.assertEqual(info.get('code'), 200)
+        with Session() as session:
+            encoded = get_user_by_id(session, user_id).password
+        self.assertTrue(encoded.startswith('scrypt$'))
+        self.assertTrue(verify_password('secret', encoded))
+        info = self.login('pero.peric@gmail.com', 'secret')
+        self.assertEqual(info.get('code'), 200)
+
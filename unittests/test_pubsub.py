@@ -0,0 +1,51 @@
+import asyncio
+import unittest
+from cas.pubsub import RoomHub
+
+
+class RoomHubTest(unittest.TestCase):
+
+    def test_publish_reaches_room_subscribers(self):
+        hub = RoomHub()
+        first = hub.subscribe(1)
+        second = hub.subscribe(1)
+        other = hub.subscribe(2)
+        hub.publish(1, {'Message': 'Hello'})
+        self.assertEqual(first.get(timeout=1), {'Message': 'Hello'})
+        self.assertEqual(second.get(timeout=1), {'Message': 'Hello'})
+        self.assertIsNone(other.get(timeout=0.05))
+
+    def test_unsubscribe(self):
+        hub = RoomHub()
+        sub = hub.subscribe(1)
+        self.assertEqual(hub.subscribers(1), 1)
+        sub.close()
+        # Runs on the hub loop after the removal scheduled by close().
+        hub.subscribe(2)
+        self.assertEqual(hub.subscribers(1), 0)
+
+    def test_slow_subscriber_drops_oldest(self):
+        hub = RoomHub(queue_size=2)
+        sub = hub.subscribe(1)
+        for n in range(3):
+            hub.publish(1, {'ID': n})
+        self.assertEqual(sub.get(timeout=1), {'ID': 1})
+        self.assertEqual(sub.get(timeout=1), {'ID': 2})
+
+    def test_subscribe_from_another_loop(self):
+        hub = RoomHub()
+
+        async def receive():
+            sub = await hub.subscribe_async(1)
+            hub.publish(1, {'Message': 'Hello'})
+            try:
+                return (await sub.get_async(timeout=1),
+                        await sub.get_async(timeout=0.05))
+            finally:
+                sub.close()
+
+        self.assertEqual(asyncio.run(receive()), ({'Message': 'Hello'}, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
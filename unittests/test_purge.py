@@ -0,0 +1,98 @@
+import threading
+import unittest
+from cas.database import (
+    Conversation,
+    ConversationMessage,
+    ConversationUser,
+    Message,
+    ReadCursor,
+    Session,
+    add_room_member,
+    delete_conversation_by_id,
+    get_conversation_by_id,
+    get_conversation_by_room_name,
+    insert_room_messages,
+)
+from cas.membership import membership
+from cas.purge import RoomPurger
+from cas.utils import now
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+
+class Purge(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session, conv_name='Science')
+            create_conversation(session, conv_name='Art')
+            add_room_member(session, 1, 1)
+            add_room_member(session, 1, 2)
+            for room_id, count in ((1, 10), (2, 2)):
+                insert_room_messages(session, room_id, [
+                    {'msg': f'msg {n}', 'created_at': now(), 'sender_id': 1}
+                    for n in range(count)])
+
+    def count(self, model, *criteria) -> int:
+        with Session() as session:
+            return session.query(model).filter(*criteria).count()
+
+    def test_delete_is_logical(self):
+        with Session.begin() as session:
+            self.assertTrue(delete_conversation_by_id(session, 1))
+            self.assertFalse(delete_conversation_by_id(session, 1))
+        with Session() as session:
+            self.assertIsNone(get_conversation_by_id(session, 1))
+            self.assertIsNone(get_conversation_by_room_name(session,
+                                                            'Science'))
+        self.assertFalse(membership.contains(1, 1))
+        self.assertEqual(self.count(ConversationUser,
+                                    ConversationUser.conversation_id == 1), 0)
+        self.assertEqual(self.count(ReadCursor), 1)
+        self.assertEqual(self.count(Conversation), 2)
+        self.assertEqual(self.count(Message), 12)
+
+    def test_name_is_reusable_before_the_purge(self):
+        with Session.begin() as session:
+            delete_conversation_by_id(session, 1)
+        with Session.begin() as session:
+            create_conversation(session, conv_name='Science')
+        self.assertEqual(self.count(Conversation), 3)
+
+    def test_purge_in_chunks(self):
+        with Session.begin() as session:
+            delete_conversation_by_id(session, 1)
+        progress = []
+        purger = RoomPurger(Session, chunk_size=4, chunk_pause=0,
+                            on_progress=lambda *args: progress.append(args))
+        self.assertEqual(purger.purge_pending(), 1)
+        self.assertEqual(progress, [(1, 4, False), (1, 8, False),
+                                    (1, 10, False), (1, 10, True)])
+        self.assertEqual(purger.progress(), {})
+        self.assertEqual(self.count(Conversation), 1)
+        self.assertEqual(self.count(Message), 2)
+        self.assertEqual(self.count(ConversationMessage,
+                                    ConversationMessage.conversation_id == 2),
+                         2)
+        self.assertEqual(purger.purge_pending(), 0)
+
+    def test_background_purge(self):
+        with Session.begin() as session:
+            delete_conversation_by_id(session, 2)
+        done = threading.Event()
+        purger = RoomPurger(Session, chunk_size=1, chunk_pause=0,
+                            on_progress=lambda *args: args[2] and done.set())
+        self.addCleanup(purger.stop)
+        purger.wake()
+        self.assertTrue(done.wait(5))
+        purger.stop()
+        self.assertEqual(self.count(Message), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import event
+from cas.database import (
+    Session,
+    bump_unread_counts,
+    get_engine,
+    get_user_by_id,
+    get_user_by_email,
+    get_conversation_by_id,
+    get_conversation_by_room_name,
+    get_conv_user_by_ids,
+    get_all_conv_user_by_user_id,
+    get_expired_room_messages,
+    get_message_by_user_id,
+    get_room_history,
+    get_room_summaries,
+    get_unread_counts,
+    join_user_msg,
+    mark_room_read,
+)
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+    create_conv_user,
+    create_message,
+)
+
+HELPERS = {
+    'get_user_by_id': lambda s: get_user_by_id(s, 7),
+    'get_user_by_email': lambda s: get_user_by_email(s, 'user7@gmail.com'),
+    'get_conversation_by_id': lambda s: get_conversation_by_id(s, 3),
+    'get_conversation_by_room_name':
+        lambda s: get_conversation_by_room_name(s, 'Room 3'),
+    'get_conv_user_by_ids': lambda s: get_conv_user_by_ids(s, 7, 3),
+    'get_all_conv_user_by_user_id':
+        lambda s: get_all_conv_user_by_user_id(s, 7),
+    'get_message_by_user_id': lambda s: get_message_by_user_id(s, 7),
+    'get_room_history': lambda s: get_room_history(s, 3, before=100,
+                                                   limit=20),
+    'get_room_summaries': lambda s: get_room_summaries(s, 7),
+    'get_unread_counts': lambda s: get_unread_counts(s, 7),
+    'bump_unread_counts': lambda s: bump_unread_counts(s, 3, Counter({7: 2,
+                                                                      8: 1})),
+    'mark_room_read': lambda s: mark_room_read(
+        s, get_conv_user_by_ids(s, 7, 8), 100),
+    'join_user_msg': lambda s: join_user_msg(s, 7),
+    'get_expired_room_messages': lambda s: get_expired_room_messages(
+        s, 3, datetime(2020, 1, 1), 100),
+}
+
+
+def capture_statements(session, helper):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append((statement, parameters))
+
+    engine = get_engine()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        helper(session)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in rows]
+    return [row[0] for row in connection.exec_driver_sql(
+        'EXPLAIN ' + statement, parameters)]
+
+
+def full_scans(plan):
+    return [line for line in plan
+            if 'Seq Scan' in line or line.startswith('SCAN ')]
+
+
+class QueryPlans(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            for n in range(1, 51):
+                create_user(session, name=f'User {n}',
+                            email=f'user{n}@gmail.com')
+            for n in range(1, 11):
+                create_conversation(session, conv_name=f'Room {n}')
+            for n in range(1, 51):
+                create_conv_user(session, user_id=n, conv_id=n % 10 + 1)
+            for n in range(1, 501):
+                create_message(session, msg=f'Message {n}',
+                               sender_id=n % 50 + 1)
+
+    def test_helpers_do_not_scan_tables(self):
+        with Session.begin() as session:
+            connection = session.connection()
+            if connection.dialect.name == 'postgresql':
+                # The seeded tables are small enough for the planner to
+                # prefer sequential scans, only fall back when forced.
+                connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            for name, helper in HELPERS.items():
+                for statement, parameters in capture_statements(session,
+                                                                helper):
+                    plan = explain(connection, statement, parameters)
+                    with self.subTest(helper=name):
+                        self.assertEqual(full_scans(plan), [],
+                                         '\n'.join(plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
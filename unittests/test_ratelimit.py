@@ -0,0 +1,154 @@
+import unittest
+from cas.database import Session
+from cas.ratelimit import (
+    LocalBackend,
+    RateLimiter,
+    rate_limiter,
+)
+from cas.utils import encode_security_token
+from unittests.utils import (
+    ApiUnittest,
+    create_user,
+    find_token,
+)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Buckets(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.backend = LocalBackend(timer=self.clock)
+
+    def test_burst_then_refill(self):
+        for _ in range(3):
+            self.assertEqual(self.backend.take('k', 2, 3), 0)
+        self.assertAlmostEqual(self.backend.take('k', 2, 3), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(self.backend.take('k', 2, 3), 0)
+        self.clock.now += 60
+        for _ in range(3):
+            self.assertEqual(self.backend.take('k', 2, 3), 0)
+        self.assertGreater(self.backend.take('k', 2, 3), 0)
+
+    def test_idle_buckets_are_evicted(self):
+        for key in range(10):
+            self.backend.take(key, 1, 5)
+        self.assertEqual(len(self.backend), 10)
+        self.clock.now += 4
+        self.backend.take('new', 1, 5)
+        self.assertEqual(len(self.backend), 11)
+        self.clock.now += 1
+        self.backend.take('new', 1, 5)
+        self.assertEqual(len(self.backend), 1)
+
+    def test_max_keys(self):
+        self.backend.max_keys = 5
+        for key in range(10):
+            self.backend.take(key, 1, 5)
+        self.assertEqual(len(self.backend), 5)
+
+
+class Limiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = RateLimiter(
+            {'send_msg': {'user': (1, 2), 'room': (1, 3)}},
+            LocalBackend(timer=self.clock))
+
+    def test_scopes(self):
+        self.assertEqual(self.limiter.check('send_msg', 1, 1), (None, 0))
+        self.assertEqual(self.limiter.check('send_msg', 1, 1), (None, 0))
+        self.assertEqual(self.limiter.check('send_msg', 1, 1), ('user', 1))
+        self.assertEqual(self.limiter.check('send_msg', 2, 1), (None, 0))
+        self.assertEqual(self.limiter.check('send_msg', 3, 1), ('room', 1))
+        self.assertEqual(self.limiter.check('send_msg', 3, 2), (None, 0))
+
+    def test_address(self):
+        limiter = RateLimiter({'send_msg': {'address': (1, 1),
+                                            'user': (1, 1)}},
+                              LocalBackend(timer=self.clock))
+        self.assertEqual(limiter.check('send_msg', address='10.0.0.1'),
+                         (None, 0))
+        self.assertEqual(limiter.check('send_msg', address='10.0.0.1'),
+                         ('address', 1))
+        self.assertEqual(limiter.check('send_msg', address='10.0.0.2'),
+                         (None, 0))
+        # Charged apart, once the user is authorized.
+        self.assertEqual(limiter.check('send_msg', 1, 1), (None, 0))
+
+    def test_unlimited(self):
+        for _ in range(10):
+            self.assertEqual(self.limiter.check('login', 1, 1), (None, 0))
+            self.assertEqual(self.limiter.check('send_msg'), (None, 0))
+        self.limiter.enabled = False
+        for _ in range(10):
+            self.assertEqual(self.limiter.check('send_msg', 1, 1), (None, 0))
+
+
+class Endpoint(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            user = create_user(session, key_word='key')
+            self.token = encode_security_token(user.id, user.nick_name,
+                                               'key')
+        limits = rate_limiter.limits
+        self.addCleanup(setattr, rate_limiter, 'limits', limits)
+
+    def create_rooms(self, client, count: int, token: str = None) -> list:
+        """
+        :param token: sent instead of the current token of the user
+        """
+        replies = []
+        for n in range(count):
+            res = client.post('/create_room', headers={
+                'user_id': '1', 'authorization': token or self.token}, json={
+                'user_id': 1, 'room_name': f'Room {n}'})
+            replies.append(res)
+            self.token = find_token(res.json) or self.token
+        return replies
+
+    def test_create_room_is_limited(self):
+        rate_limiter.limits = {'create_room': {'user': (0.001, 2)}}
+        with self.client() as client:
+            replies = self.create_rooms(client, 2)
+            res, = self.create_rooms(client, 1)
+        self.assertEqual([r.json['status_code'] for r in replies],
+                         [200, 200])
+        self.assertEqual(res.json['status_code'], 429)
+        self.assertGreater(int(res.headers['Retry-After']), 500)
+
+    def test_unauthorized_requests_leave_the_user_bucket_alone(self):
+        rate_limiter.limits = {'create_room': {'user': (0.001, 1)}}
+        with self.client() as client:
+            replies = self.create_rooms(client, 3, 'wrong')
+            res, = self.create_rooms(client, 1)
+        self.assertEqual([r.json['status_code'] for r in replies],
+                         [401] * 3)
+        self.assertEqual(res.json['status_code'], 200)
+
+    def test_address_is_limited_before_the_authorization(self):
+        rate_limiter.limits = {'create_room': {'address': (0.001, 2)}}
+        with self.client() as client:
+            replies = self.create_rooms(client, 2, 'wrong')
+            res, = self.create_rooms(client, 1)
+        self.assertEqual([r.json['status_code'] for r in replies],
+                         [401, 401])
+        self.assertEqual(res.json['status_code'], 429)
+        self.assertGreater(int(res.headers['Retry-After']), 500)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
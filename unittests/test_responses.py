@@ -0,0 +1,53 @@
+import json
+import unittest
+from unittest import mock
+from cas import utils
+from cas.utils import (
+    JSON_ENCODERS,
+    app,
+    error_response,
+    ok_response,
+    server_time,
+    set_json_encoder,
+)
+
+
+class Responses(unittest.TestCase):
+
+    def tearDown(self):
+        set_json_encoder('auto')
+
+    def test_encoders_agree(self):
+        bodies = []
+        with app.app_context():
+            for name in JSON_ENCODERS:
+                set_json_encoder(name)
+                response = ok_response('Success!', Unread={1: 2}, Room=1)
+                self.assertEqual(response.mimetype, 'application/json')
+                bodies.append(json.loads(response.get_data()))
+                error = json.loads(error_response('Nope', 404).get_data())
+                self.assertEqual(error['status_code'], 404)
+        data = bodies[0]['info']['data']
+        self.assertEqual((data['status'], data['message'], data['Unread'],
+                          data['Room']), ('OK', 'Success!', {'1': 2}, 1))
+        for body in bodies[1:]:
+            body['info']['data']['server_time'] = data['server_time']
+            self.assertEqual(body, bodies[0])
+
+    def test_unknown_encoder(self):
+        with self.assertRaises(ValueError):
+            set_json_encoder('yaml')
+
+    def test_server_time_is_cached_per_second(self):
+        with mock.patch.object(utils.time, 'time', return_value=1000.1):
+            first = server_time()
+        with mock.patch.object(utils.time, 'time', return_value=1000.9), \
+                mock.patch.object(utils, 'datetime') as datetime:
+            self.assertEqual(server_time(), first)
+            datetime.fromtimestamp.assert_not_called()
+        with mock.patch.object(utils.time, 'time', return_value=1001.0):
+            self.assertNotEqual(server_time(), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+from unittest import mock
+from cas.database import (
+    ConversationMessage,
+    Message,
+    Session,
+    add_room_message,
+    add_room_messages,
+    delete_msg_by_msg_id,
+    delete_room_messages,
+)
+from cas.search import (
+    RoomIndex,
+    search_index,
+    search_room_messages,
+    tokenize,
+)
+from cas.utils import now
+from unittests.utils import (
+    BaseUnittest,
+    create_user,
+    create_conversation,
+)
+
+
+class RoomIndexTest(unittest.TestCase):
+
+    def test_every_term_must_match(self):
+        index = RoomIndex()
+        index.add(1, tokenize('Hello world'))
+        index.add(2, tokenize('hello there'))
+        index.add(3, tokenize('World, hello hello!'))
+        self.assertEqual(index.search(tokenize('hello world'), 10),
+                         [(3, 3), (1, 2)])
+        self.assertEqual(index.search(tokenize('missing'), 10), [])
+
+    def test_out_of_order_ids(self):
+        index = RoomIndex()
+        index.add(5, ['a'])
+        index.add(3, ['a'])
+        index.add(3, ['a'])
+        self.assertEqual(list(index.postings['a']), [3, 5])
+        self.assertTrue(index.contains(3, ['a']))
+        self.assertEqual(index.search(['a'], 1), [(5, 1)])
+
+    def test_only_the_newest_matches_are_ranked(self):
+        index = RoomIndex()
+        index.add(1, ['a', 'a', 'a'])
+        index.add(2, ['a'])
+        index.add(3, ['a', 'a'])
+        index.add(4, ['a'])
+        self.assertEqual(index.search(['a'], 10, window=2),
+                         [(3, 2), (4, 1), (2, 1), (1, 3)])
+
+    def test_remove(self):
+        index = RoomIndex()
+        index.add(1, ['a', 'b'])
+        index.add(2, ['a', 'a'])
+        index.add(3, ['b'])
+        index.remove([2], ['a', 'a'])
+        self.assertEqual(list(index.postings['a']), [1])
+        self.assertEqual(index.repeats['a'], {})
+        index.remove([1, 3])
+        self.assertEqual(index.postings, {})
+
+
+class SearchRoomMessages(BaseUnittest):
+
+    def setUp(self):
+        super().setUp()
+        with Session.begin() as session:
+            create_user(session)
+            create_conversation(session, conv_name='Room 1')
+            create_conversation(session, conv_name='Room 2')
+            add_room_messages(session, 1, 1, ['lunch at noon', 'no lunch',
+                                              'dinner'], now())
+            add_room_message(session, 2, 1, 'lunch elsewhere', now())
+
+    def search(self, query, **kwargs):
+        with Session.begin() as session:
+            return [result.message.msg for result in search_room_messages(
+                session, 1, query, **kwargs)]
+
+    def test_search(self):
+        self.assertEqual(self.search('lunch'), ['no lunch', 'lunch at noon'])
+        self.assertEqual(self.search('lunch', limit=1, offset=1),
+                         ['lunch at noon'])
+        self.assertEqual(self.search('Lunch noon'), ['lunch at noon'])
+
+    def test_index_follows_commits(self):
+        self.search('lunch')
+        with Session.begin() as session:
+            add_room_message(session, 1, 1, 'late lunch', now())
+        session = Session()
+        add_room_message(session, 1, 1, 'lunch rolled back', now())
+        session.rollback()
+        session.close()
+        self.assertEqual(self.search('lunch'),
+                         ['late lunch', 'no lunch', 'lunch at noon'])
+
+    def indexed(self, word: str) -> list:
+        return list(search_index.room(1).postings.get(word, ()))
+
+    def test_deleted_and_archived_messages_are_dropped(self):
+        self.search('lunch')
+        with Session.begin() as session:
+            delete_msg_by_msg_id(session, 2)
+        self.assertEqual(self.indexed('lunch'), [1])
+        with Session.begin() as session:
+            delete_room_messages(session, 1, [1])
+        self.assertEqual(self.indexed('lunch'), [])
+
+    def test_other_workers(self):
+        self.search('lunch')
+        with Session.begin() as session:
+            add_room_message(session, 1, 1, 'lunch elsewhere', now())
+            # Committed by another worker.
+            del session.info['inserted_messages']
+        with mock.patch.object(search_index, 'refresh_interval', 0):
+            self.assertEqual(self.search('lunch', limit=1),
+                             ['lunch elsewhere'])
+        with Session.begin() as session:
+            session.query(ConversationMessage).filter_by(
+                message_id=5).delete()
+            session.query(Message).filter_by(id=5).delete()
+        self.assertEqual(self.search('lunch', limit=1), ['no lunch'])
+        self.assertEqual(self.indexed('lunch'), [1, 2])
+
+    def test_least_recently_searched_room_is_evicted(self):
+        with mock.patch.object(search_index, 'max_rooms', 1):
+            self.search('lunch')
+            with Session.begin() as session:
+                search_room_messages(session, 2, 'lunch')
+            self.assertEqual(list(search_index._rooms), [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
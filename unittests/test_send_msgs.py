@@ -0,0 +1,60 @@
+import unittest
+from cas.database import (
+    ConversationMessage,
+    Message,
+    Session,
+    add_room_member,
+)
+from unittests.utils import (
+    ApiUnittest,
+    create_conversation,
+)
+
+
+class SendMsgs(ApiUnittest):
+
+    def setUp(self):
+        super().setUp()
+        self.ana = self.api_user('Ana')
+        self.bob = self.api_user('Bob')
+        with Session.begin() as session:
+            create_conversation(session)
+            add_room_member(session, self.ana.id, 1)
+
+    def send(self, msgs: list, status_code: int = 200, user=None) -> dict:
+        user = user or self.ana
+        return user.call('POST', '/send_msgs', status_code, json={
+            'user_id': user.id, 'room_id': 1, 'msgs': msgs})
+
+    def stored(self) -> list:
+        with Session() as session:
+            return session.query(
+                Message.id, Message.msg, Message.sender_id,
+                ConversationMessage.conversation_id
+            ).join(ConversationMessage,
+                   ConversationMessage.message_id == Message.id
+                   ).order_by(Message.id).all()
+
+    def test_messages_are_stored_in_order(self):
+        msgs = ['one', 'two', 'three']
+        sent = self.send(msgs)['Messages']
+        self.assertEqual([msg['Message'] for msg in sent], msgs)
+        self.assertEqual(self.stored(), [
+            (msg['ID'], msg['Message'], self.ana.id, 1) for msg in sent])
+        more = self.send(['four'])['Messages']
+        self.assertGreater(more[0]['ID'], sent[-1]['ID'])
+
+    def test_rejected_batches(self):
+        for msgs in ([], ['x'] * 501, ['fine', 'x' * 33]):
+            self.send(msgs, 400)
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(len(self.send(['x'] * 500)['Messages']), 500)
+
+    def test_non_member(self):
+        self.send(['hi'], 404, user=self.bob)
+        self.assertEqual(self.stored(), [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
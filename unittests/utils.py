@@ -1,14 +1,26 @@
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
 from unittest import TestCase
 from cas.database import (
     Session,
     Base,
-    engine,
+    configure_engine,
+    get_engine,
     User,
     Conversation,
     ConversationUser,
     Message,
 )
+from cas.idempotency import sent_messages
+from cas.membership import membership
+from cas.ratelimit import rate_limiter
+from cas.search import search_index
 from cas.utils import (
+    encode_security_token,
+    key_cache,
     now,
     random_string,
 )
@@ -17,11 +29,207 @@ from cas.utils import (
 class BaseUnittest(TestCase):
 
     def setUp(self):
-        Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
+        Base.metadata.drop_all(get_engine())
+        Base.metadata.create_all(get_engine())
+        # Process caches of the rows dropped above.
+        membership.clear()
+        search_index.clear()
+        rate_limiter.reset()
+        sent_messages.clear()
+        key_cache.clear()
 
     def tearDown(self):
-        Base.metadata.drop_all(engine)
+        Base.metadata.drop_all(get_engine())
+
+
+class ApiUnittest(BaseUnittest):
+    """
+    Endpoint tests, they go through `self.http`, a client of `self.app()`.
+    Every subclass gets an Async<name> twin in its module running the same
+    tests against cas.async_app, unless it sets both_apps to False.
+    """
+    both_apps = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.both_apps or issubclass(cls, AsyncApp):
+            return
+        name = f'Async{cls.__name__}'
+        twin = type(name, (AsyncApp, cls), {'__module__': cls.__module__,
+                                             '__qualname__': name})
+        setattr(sys.modules[cls.__module__], name, twin)
+
+    def setUp(self):
+        super().setUp()
+        self.http = self.client().__enter__()
+        self.addCleanup(self.http.__exit__, None, None, None)
+
+    def app(self):
+        from cas.app import app
+
+        return app
+
+    def client(self):
+        return self.app().test_client()
+
+    def api_user(self, name: str) -> 'ApiUser':
+        return ApiUser(self, self.http, name)
+
+
+def find_token(data):
+    """
+    The new token of a reply, it sits at a different depth per endpoint.
+    """
+    if isinstance(data, dict):
+        if isinstance(data.get('Authorization'), str):
+            return data['Authorization']
+        for value in data.values():
+            token = find_token(value)
+            if token is not None:
+                return token
+    return None
+
+
+class ApiUser:
+    """
+    A logged in user, it follows the token rotation.
+    """
+
+    def __init__(self, test: ApiUnittest, client, name: str):
+        self.test = test
+        self.client = client
+        self.name = name
+        with Session.begin() as session:
+            self.id = create_user(session, name=name,
+                                  email=f'{name.lower()}@gmail.com').id
+        self.resign()
+
+    def resign(self):
+        """
+        Error replies carry no token, sign one with the current key.
+        """
+        with Session() as session:
+            key_word = session.get(User, self.id).key_word
+        self.token = encode_security_token(self.id, self.name, key_word)
+
+    def headers(self) -> dict:
+        return {'user_id': str(self.id), 'authorization': self.token}
+
+    def call(self, method: str, path: str, status_code: int = 200,
+             **kwargs) -> dict:
+        res = self.client.open(path, method=method, headers=self.headers(),
+                               **kwargs)
+        self.test.assertEqual(res.json['status_code'], status_code,
+                              res.json)
+        data = res.json['info']['data']
+        if status_code == 200:
+            self.token = find_token(data) or self.token
+        else:
+            self.resign()
+        return data
+
+
+class AsyncResponse:
+    """
+    The parts of a Flask test response the endpoint tests read.
+    """
+
+    def __init__(self, status_code: int, headers, mimetype: str,
+                 data: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.mimetype = mimetype
+        self.data = data
+
+    @property
+    def json(self):
+        if self.mimetype != 'application/json':
+            return None
+        return json.loads(self.data)
+
+
+class AsyncClient:
+    """
+    Drives the Quart test client of cas.async_app from a synchronous test
+    with the calls of Flask's test client.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        from cas.async_app import app
+
+        self.loop = loop
+        self.client = app.test_client()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def open(self, path: str, method: str, headers: dict = None,
+             **kwargs) -> AsyncResponse:
+        headers = {name: str(value)
+                   for name, value in (headers or {}).items()}
+
+        async def request():
+            response = await self.client.open(path, method=method,
+                                              headers=headers, **kwargs)
+            return AsyncResponse(response.status_code, response.headers,
+                                 response.mimetype,
+                                 await response.get_data())
+
+        return self.loop.run_until_complete(request())
+
+    def get(self, path: str, **kwargs) -> AsyncResponse:
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path: str, **kwargs) -> AsyncResponse:
+        return self.open(path, 'POST', **kwargs)
+
+    def delete(self, path: str, **kwargs) -> AsyncResponse:
+        return self.open(path, 'DELETE', **kwargs)
+
+
+class AsyncApp:
+    """
+    Mixed in before an ApiUnittest it runs the tests against cas.async_app.
+    An in-memory SQLite database is not shared between the sync and the
+    async engine, both are moved to a temporary file for the class.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from cas.async_database import configure_async_engine
+
+        super().setUpClass()
+        cls.loop = asyncio.new_event_loop()
+        cls.database_url = get_engine().url
+        cls.database_dir = None
+        if cls.database_url.get_backend_name() == 'sqlite' and \
+                cls.database_url.database in (None, '', ':memory:'):
+            cls.database_dir = tempfile.mkdtemp()
+            configure_engine(f'sqlite:///{cls.database_dir}/cas.db')
+        cls.loop.run_until_complete(configure_async_engine(
+            get_engine().url.render_as_string(hide_password=False)))
+
+    @classmethod
+    def tearDownClass(cls):
+        from cas.async_database import dispose_async_engine
+
+        cls.loop.run_until_complete(dispose_async_engine())
+        cls.loop.close()
+        if cls.database_dir is not None:
+            configure_engine(cls.database_url)
+            shutil.rmtree(cls.database_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def app(self):
+        from cas.async_app import app
+
+        return app
+
+    def client(self):
+        return AsyncClient(self.loop)
 
 
 def create_user(session: Session, name="Pero", email="pero.peric@gmail.com",